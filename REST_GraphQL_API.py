@@ -2,15 +2,18 @@
 
 # standard library dependencies
 import typing
+from functools import lru_cache, partial
 
 # external dependencies
 import uvicorn
 import strawberry
 from strawberry.fastapi import GraphQLRouter
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 
 # local dependencies
-from src.dbms.postgrestest import PostgresDatabaseClient
+from src.dbms.PostgresDatabaseClient import PostgresDatabaseClient
+from src.search import ETFIndex, find_k_nearest, find_k_farthest
+from src.utils import get_similarity, asymmetric_coverage_overlap
 
 app = FastAPI(
     title="ETF Comparer REST API",
@@ -49,6 +52,97 @@ def get_etf_holdings():
     etfs = postgres_db_client.get_known_etfs()
     return {"known_etfs": etfs}
 
+@lru_cache(maxsize=1)
+def get_etf_index(date_: str) -> ETFIndex:
+    """Returns the index over all known ETFs, rebuilt at most once per `date_`."""
+    postgres_db_client = PostgresDatabaseClient(
+        "aws_credentials.json"
+    )
+    return ETFIndex.from_database(postgres_db_client)
+
+def search_etfs(tickers: str, 
+                k: int, 
+                distance_measure: str,
+                farthest: bool):
+    postgres_db_client = PostgresDatabaseClient(
+        "aws_credentials.json"
+    )
+    etf_tickers = [ ticker.strip().upper() for ticker in tickers.split(",") if ticker.strip() != "" ]
+    etfs_data, unavailable_etfs = postgres_db_client.get_holdings_and_weights_for_etfs(
+        etf_tickers
+    )
+    if len(etfs_data) == 0:
+        raise HTTPException(status_code=404, detail=f"No data available for {etf_tickers}")
+    index = get_etf_index(str(postgres_db_client.today))
+    search = find_k_farthest if farthest else find_k_nearest
+    try:
+        ranking = search(
+            index,
+            etfs_data,
+            k = k,
+            distance_measure = distance_measure
+        )
+    except AssertionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "etf_tickers": list(etfs_data.keys()),
+        "unavailable_etfs": unavailable_etfs,
+        "distance_measure": distance_measure,
+        "results": [
+            {"etf_ticker": etf_ticker, "similarity": similarity}
+            for etf_ticker, similarity in ranking
+        ]
+    }
+
+@app.get("/etfs/nearest")
+def get_k_nearest_etfs( tickers: str, 
+                        k: int = 5, 
+                        distance_measure: str = "weighted_jaccard"):
+    return search_etfs(tickers, k, distance_measure, farthest=False)
+
+@app.get("/etfs/farthest")
+def get_k_farthest_etfs(tickers: str, 
+                        k: int = 5, 
+                        distance_measure: str = "weighted_jaccard"):
+    return search_etfs(tickers, k, distance_measure, farthest=True)
+
+@app.get("/similarity")
+def get_etf_similarities(   tickers: str,
+                            distance_measure: str = "jaccard",
+                            swap_vectors: bool = False):
+    postgres_db_client = PostgresDatabaseClient(
+        "aws_credentials.json"
+    )
+    etf_tickers = [ ticker.strip().upper() for ticker in tickers.split(",") if ticker.strip() != "" ]
+    try:
+        similarities = postgres_db_client.get_stored_similarities(
+            etf_tickers,
+            distance_measure,
+            swap_vectors = swap_vectors
+        )
+    except AssertionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    unavailable_etfs = []
+    if similarities is None:
+        # not precomputed by `prefetch.py` yet
+        etfs_data, unavailable_etfs = postgres_db_client.get_holdings_and_weights_for_etfs(
+            etf_tickers
+        )
+        similarities = get_similarity(
+            etfs_data,
+            distance_measure = partial(asymmetric_coverage_overlap, swap_vectors=swap_vectors) \
+                if distance_measure.lower() == 'asymmetric_coverage_overlap' else distance_measure
+        )
+    return {
+        "etf_tickers": etf_tickers,
+        "unavailable_etfs": unavailable_etfs,
+        "distance_measure": distance_measure,
+        "similarities": [
+            {"etf_ticker_1": etf1, "etf_ticker_2": etf2, "similarity": similarity}
+            for (etf1, etf2), similarity in similarities.items()
+        ]
+    }
+
 @strawberry.type
 class HoldingData:
     holding_ticker: str
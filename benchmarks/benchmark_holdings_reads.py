@@ -0,0 +1,102 @@
+# benchmark_holdings_reads.py
+"""Benchmarks the latency of the main reads of `etf_holdings_table` on a synthetic
+multi-year history, before and after the schema migrations (see `SQLDatabaseClient.migrate`).
+
+Usage: python -m benchmarks.benchmark_holdings_reads [--years 3] [--etfs 50] [--holdings 100]
+"""
+
+# standard library dependencies
+import os
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import date, timedelta
+from typing import Callable, List, Mapping
+
+# local dependencies
+from src.dbms.SQLite3DatabaseClient import SQLite3DatabaseClient
+
+
+def populate(db_client: SQLite3DatabaseClient, years: int, n_etfs: int, n_holdings: int) -> List[date]:
+    """Fills the database with one snapshot of `n_holdings` holdings per ETF and per weekday over `years` years."""
+    start = date.today() - timedelta(days=365 * years)
+    dates = [ start + timedelta(days=i) for i in range(365 * years) if (start + timedelta(days=i)).weekday() < 5 ]
+    universe = [ f"H{i}" for i in range(n_holdings * 5) ]
+    rng = random.Random(0)
+    with db_client.transaction() as cur:
+        cur.executemany("INSERT INTO holdings_table (Holding) VALUES (?);", [ (holding,) for holding in universe ])
+        cur.executemany("INSERT INTO etf_ticker_table (ETF_ticker) VALUES (?);", [ (f"ETF{i}",) for i in range(n_etfs) ])
+        for etf_ticker_id in range(1, n_etfs + 1):
+            holding_ids = rng.sample(range(1, len(universe) + 1), n_holdings)
+            cur.executemany(
+                "INSERT INTO etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight) VALUES (?, ?, ?, ?);",
+                [ (date_, etf_ticker_id, holding_id, 1.0 / n_holdings) for date_ in dates for holding_id in holding_ids ]
+            )
+    return dates
+
+def measure(read: Callable[[], object], repeat: int) -> float:
+    """Returns the median latency of `read` (in milliseconds)."""
+    latencies: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+def benchmark(db_client: SQLite3DatabaseClient, dates: List[date], n_etfs: int, repeat: int) -> Mapping[str, float]:
+    rng = random.Random(1)
+    per_etf_query = """SELECT major.Date, minor.ETF_ticker, other.Holding, major.Holding_Weight
+        FROM (
+            select etf_holdings_table.* from etf_holdings_table where ETF_ticker_ID = ?
+            and Date = ?
+        ) as major
+        INNER JOIN etf_ticker_table as minor on major.ETF_ticker_ID = minor.ETF_ticker_ID
+        LEFT JOIN holdings_table as other on major.Holding_ID = other.Holding_ID;
+        """
+    return {
+        "get_holdings_and_weights_for_etf": measure(
+            lambda: db_client.execute_query(per_etf_query, (rng.randint(1, n_etfs), rng.choice(dates))),
+            repeat
+        ),
+        "MAX(Date) (prefetch.get_latest_update)": measure(
+            lambda: db_client.execute_query("SELECT MAX(Date) FROM etf_holdings_table;"),
+            repeat
+        ),
+        "get_holdings_snapshot (10 ETFs)": measure(
+            lambda: db_client.get_holdings_snapshot(rng.choice(dates), [ f"ETF{i}" for i in rng.sample(range(n_etfs), 10) ]),
+            repeat
+        ),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--etfs", type=int, default=50)
+    parser.add_argument("--holdings", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_client = SQLite3DatabaseClient(os.path.join(directory, "benchmark.sqlite"))
+        # start from the schema that predates the migrations
+        for index in ("etf_holdings_etf_date_holding_idx", "etf_holdings_date_etf_idx"):
+            db_client.execute_query(f"DROP INDEX IF EXISTS {index};")
+        db_client.execute_query("DELETE FROM schema_migrations_table;")
+        dates = populate(db_client, args.years, args.etfs, args.holdings)
+        n_rows = db_client.execute_query("SELECT COUNT(*) FROM etf_holdings_table;")[0][0]
+        print(f"{n_rows} rows in etf_holdings_table ({len(dates)} dates x {args.etfs} ETFs x {args.holdings} holdings)")
+
+        before = benchmark(db_client, dates, args.etfs, args.repeat)
+        start = time.perf_counter()
+        db_client.migrate()
+        print(f"Migrated in {time.perf_counter() - start:.1f}s")
+        after = benchmark(db_client, dates, args.etfs, args.repeat)
+
+    print(f"{'read':<42}{'before (ms)':>14}{'after (ms)':>14}")
+    for read in before.keys():
+        print(f"{read:<42}{before[read]:>14.2f}{after[read]:>14.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# benchmark_sqlite3_concurrency.py
+"""Benchmarks the throughput of concurrent readers (emulating Streamlit sessions) and of one
+writer (emulating `prefetch.py`) on the SQLite3 backend, with per-statement connections and the
+default rollback journal versus per-thread connections in WAL mode (see `SQLite3ConnectionManager`).
+
+Usage: python -m benchmarks.benchmark_sqlite3_concurrency [--readers 8] [--seconds 5]
+"""
+
+# standard library dependencies
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager, closing
+from datetime import date, timedelta
+from typing import Any, Iterator, List, Mapping
+
+# local dependencies
+from src.dbms.SQLite3DatabaseClient import SQLite3DatabaseClient
+from benchmarks.benchmark_holdings_reads import populate
+
+
+class PerStatementSQLite3DatabaseClient(SQLite3DatabaseClient):
+    """SQLite3 client opening a new connection for every statement, with the default rollback journal."""
+    journal_mode = "DELETE"
+    synchronous = "FULL"
+
+    def __init__(self, connection_str: str):
+        self.path = connection_str
+        super().__init__(connection_str)
+
+    def execute_query(self, query: str, *args) -> List[Any]:
+        with closing(sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)) as conn:
+            with conn:
+                return conn.execute(query, *args).fetchall()
+
+    def execute_query_over_many_arguments(self, query: str, args: Any) -> List[Any]:
+        with closing(sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)) as conn:
+            with conn:
+                return conn.executemany(query, args).fetchall()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        with closing(sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)) as conn:
+            with conn:
+                yield conn.cursor()
+
+
+def run(db_client: SQLite3DatabaseClient, dates: List[date], n_etfs: int, n_readers: int, seconds: float) -> Mapping[str, float]:
+    stop = threading.Event()
+    counts = { "reads": 0, "writes": 0, "errors": 0 }
+    lock = threading.Lock()
+
+    def count(key: str) -> None:
+        with lock:
+            counts[key] += 1
+
+    def reader(seed: int) -> None:
+        rng = random.Random(seed)
+        while not stop.is_set():
+            try:
+                # roughly the queries of one page load
+                etf_tickers = [ f"ETF{i}" for i in rng.sample(range(n_etfs), 5) ]
+                db_client.get_known_etfs()
+                for etf_ticker in etf_tickers:
+                    db_client.get_etf_id_for_ticker(etf_ticker)
+                db_client.get_holdings_snapshot(rng.choice(dates), etf_tickers)
+            except sqlite3.OperationalError:
+                count("errors")
+            else:
+                count("reads")
+
+    def writer() -> None:
+        rng = random.Random(-1)
+        date_ = dates[-1]
+        while not stop.is_set():
+            date_ += timedelta(days=1)
+            rows = [ (date_, etf_ticker_id, holding_id, 0.01) for etf_ticker_id in rng.sample(range(1, n_etfs + 1), 5) for holding_id in range(1, 101) ]
+            try:
+                with db_client.transaction() as cur:
+                    cur.executemany(
+                        "INSERT INTO etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight) VALUES (?, ?, ?, ?);",
+                        rows
+                    )
+            except sqlite3.OperationalError:
+                count("errors")
+            else:
+                count("writes")
+
+    threads = [ threading.Thread(target=reader, args=(seed,)) for seed in range(n_readers) ] + [ threading.Thread(target=writer) ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return { key: value / seconds for key, value in counts.items() }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--etfs", type=int, default=50)
+    parser.add_argument("--holdings", type=int, default=100)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'client':<36}{'page loads/s':>14}{'writes/s':>10}{'errors/s':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, client_class in (
+            ("per-statement connections", PerStatementSQLite3DatabaseClient),
+            ("per-thread connections, WAL", SQLite3DatabaseClient)
+        ):
+            db_client = client_class(os.path.join(directory, f"{client_class.__name__}.sqlite"))
+            dates = populate(db_client, args.years, args.etfs, args.holdings)
+            throughput = run(db_client, dates, args.etfs, args.readers, args.seconds)
+            print(f"{name:<36}{throughput['reads']:>14.1f}{throughput['writes']:>10.1f}{throughput['errors']:>10.1f}")
+
+if __name__ == '__main__':
+    main()
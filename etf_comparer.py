@@ -8,18 +8,22 @@ logger = logging.getLogger(f"mainLogger")
 logging.info("Initiating Streamlit app")
 logger.info("Initiating Streamlit app")
 
-from io import BytesIO
-from typing import List
+from typing import Callable, List, Mapping, Tuple, Union
 from functools import partial
 
 # external dependencies
+import pandas as pd
 import streamlit as st 
 from streamlit_tags import st_tags
 
 # local dependencies
 from src.backend import select_database
-from src.utils import asymmetric_coverage_overlap, get_etf_holding_weight_vectors
-from src.plotting import plot_holdings_tracks, plot_similarity
+from src.dbms.SQLDatabaseClient import SQLDatabaseClient
+from src.cache import get_render_cache, render_key
+from src.holdings import HoldingsMatrix
+from src.utils import asymmetric_coverage_overlap, get_holdings_matrix, get_similarities
+from src.plotting import THEME, figure_to_png, plot_holdings_tracks, plot_similarity
+from src.search import find_k_nearest, find_k_farthest, get_etf_index
 
 st.set_page_config(layout='centered')
 
@@ -45,6 +49,8 @@ st.write('Using:', backend_option)
 dbc = select_database(backend_option)
 logger.info(f"Connected to {backend_option} client instance")
 
+render_cache = get_render_cache()
+
 @st.cache 
 def clean_user_data(user_input: List[str]) -> List[str]:    
     return [
@@ -53,7 +59,42 @@ def clean_user_data(user_input: List[str]) -> List[str]:
         if ticker != "" 
     ]
 
-def run(user_input: str) -> None:
+def load_similarities( etfs_data: Mapping[str, Mapping[str, Mapping]], 
+                        holdings_matrix: HoldingsMatrix) -> List[Mapping[Tuple[str,str], float]]:
+    """Returns the weighted Jaccard, Jaccard, asymmetric coverage and swapped asymmetric coverage
+    similarities between the ETFs in `etfs_data`."""
+    # read the similarity matrices precomputed by `prefetch.py` if possible, 
+    # otherwise compute all of them in a single pass
+    stored_similarities = [None]
+    if isinstance(dbc, SQLDatabaseClient):
+        stored_similarities = [
+            dbc.get_stored_similarities(etfs_data.keys(), distance_measure, swap_vectors=swap_vectors)
+            for distance_measure, swap_vectors in (
+                ('weighted_jaccard', False),
+                ('jaccard', False),
+                ('asymmetric_coverage_overlap', False),
+                ('asymmetric_coverage_overlap', True)
+            )
+        ]
+    if all(similarities is not None for similarities in stored_similarities):
+        logger.info(f'Using precomputed similarities for: {list(etfs_data.keys())}')
+        return stored_similarities
+    return get_similarities(
+        etfs_data,
+        distance_measures = [
+            'weighted_jaccard',
+            'jaccard',
+            partial(asymmetric_coverage_overlap, swap_vectors=False),
+            partial(asymmetric_coverage_overlap, swap_vectors=True)
+        ],
+        holdings_matrix = holdings_matrix
+    )
+
+def show_figure(key: str, render: Callable[[], bytes], **image_kwargs) -> None:
+    """Displays the PNG image cached under `key`, rendering it on a miss."""
+    st.image(render_cache.get_or_render(key, dbc.today, render), **image_kwargs)
+
+def run(user_input: str, k: int = 5) -> None:
     logger.info(f'Loading data for: {user_input}')
     etfs_data, unavailable_etfs = dbc.get_holdings_and_weights_for_etfs(
         clean_user_data(user_input)[:10]
@@ -66,7 +107,18 @@ def run(user_input: str) -> None:
     logger.info(f'Loaded data for: {user_input}')
     logger.info(f'Processing data for: {user_input}')
     
-    st.pyplot(plot_holdings_tracks(etfs_data), dpi=1000)
+    holdings_matrix = get_holdings_matrix(etfs_data)
+    etf_tickers = list(etfs_data.keys())
+    # the tracks get binned down to the pixel width of the chart at this resolution
+    show_figure(
+        render_key('holdings_tracks', backend_option, etf_tickers, dbc.today, theme=THEME, ordered=True, dpi=200),
+        lambda: figure_to_png(
+            plot_holdings_tracks(etfs_data, holdings_matrix=holdings_matrix, dpi=200),
+            dpi = 200,
+            bbox_inches = 'tight'
+        ),
+        use_column_width = True
+    )
     
     logger.info(f'Processed data for: {user_input}')
 
@@ -76,6 +128,20 @@ def run(user_input: str) -> None:
 
     logger.info(f'Calculating similarities between: {user_input}')
 
+    # only needed to render the heatmaps missing from the render cache
+    all_similarities = []
+    def show_similarity(i: int, measure: str, distance_measure: Union[str,Callable], **plot_kwargs) -> None:
+        def render() -> bytes:
+            if len(all_similarities) == 0:
+                all_similarities.extend(load_similarities(etfs_data, holdings_matrix))
+            return figure_to_png(plot_similarity(
+                etfs_data, 
+                distance_measure = distance_measure,
+                similarities = all_similarities[i],
+                **plot_kwargs
+            ))
+        show_figure(render_key('similarity', backend_option, etf_tickers, dbc.today, measure, THEME), render)
+
     # plot the similarity matrices
     col1, col2 = st.columns([5,5])
     with col1:
@@ -83,61 +149,44 @@ def run(user_input: str) -> None:
             "<h4 style='text-align: center; color: white;'>Weighted Jaccard Similarity</h4>", 
             unsafe_allow_html = True
         )
-        # plot the similarity matrix
-        fig = plot_similarity(etfs_data, distance_measure='weighted_jaccard')
-        buf = BytesIO()
-        fig.savefig(buf, format="png")#, figsize=(4,4))
-        st.image(buf)
+        show_similarity(0, 'weighted_jaccard', 'weighted_jaccard')
     with col2:
         st.markdown(
             "<h4 style='text-align: center; color: white;'>Jaccard Similarity</h4>", 
             unsafe_allow_html = True
         )
-        # plot the similarity matrix
-        fig = plot_similarity(etfs_data, distance_measure='jaccard')
-        buf = BytesIO()
-        fig.savefig(buf, format="png")#, figsize=(4,4))
-        st.image(buf)
+        show_similarity(1, 'jaccard', 'jaccard')
     col1, col2 = st.columns([5,5])
     with col1:
         st.markdown(
             "<h4 style='text-align: center; color: white;'>Asymmetric Coverage<br>(|A∩B|/|A|)</h4>", 
             unsafe_allow_html = True
         )
-        # plot the similarity matrix
-        fig = plot_similarity(
-            etfs_data, 
-            distance_measure=partial(asymmetric_coverage_overlap, swap_vectors=False),
-            xlabel="A",
-            ylabel="B"
+        show_similarity(
+            2,
+            'asymmetric_coverage_overlap',
+            partial(asymmetric_coverage_overlap, swap_vectors=False),
+            xlabel = "A",
+            ylabel = "B"
         )
-        buf = BytesIO()
-        fig.savefig(buf, format="png")#, figsize=(4,4))
-        st.image(buf)
     with col2:
         st.markdown(
             "<h4 style='text-align: center; color: white;'>Asymmetric Coverage<br>(|B∩A|/|B|)</h4>", 
             unsafe_allow_html = True
         )
-        # plot the similarity matrix
-        fig = plot_similarity(
-            etfs_data, 
-            distance_measure=partial(asymmetric_coverage_overlap, swap_vectors=True),
-            xlabel="A",
-            ylabel="B"
+        show_similarity(
+            3,
+            'asymmetric_coverage_overlap_swapped',
+            partial(asymmetric_coverage_overlap, swap_vectors=True),
+            xlabel = "A",
+            ylabel = "B"
         )
-        buf = BytesIO()
-        fig.savefig(buf, format="png")#, figsize=(4,4))
-        st.image(buf)
     
     logger.info(f'Calculated similarities between: {user_input}')
     logger.info(f'Re-fetching data for: {user_input}')
     logger.info(f'Calculated similarities between: {user_input}')
     logger.info(f'Re-fetching data for: {user_input}')
-    data = get_etf_holding_weight_vectors(
-        etfs_data, 
-        as_df = True
-    )
+    data = holdings_matrix.to_dataframe()
     logger.info(f'Re-fetched data for: {user_input}')
     
     st.subheader("Data")
@@ -151,6 +200,31 @@ def run(user_input: str) -> None:
             key='download-csv'
         )
         st.dataframe(data)
+
+    logger.info(f'Searching for the ETFs nearest to and farthest from: {user_input}')
+    # `st.cache` can't hash the database clients, so the index lives in `src.search` across reruns
+    index = get_etf_index(dbc, backend_option)
+    st.subheader(f"Comparison against all {len(index)} known ETFs")
+    col1, col2 = st.columns([5,5])
+    with col1:
+        st.markdown(
+            "<h4 style='text-align: center; color: white;'>Most similar ETFs</h4>", 
+            unsafe_allow_html = True
+        )
+        st.table(pd.DataFrame(
+            find_k_nearest(index, etfs_data, k=k),
+            columns = ["ETF", "Weighted Jaccard Similarity"]
+        ))
+    with col2:
+        st.markdown(
+            "<h4 style='text-align: center; color: white;'>Most different ETFs</h4>", 
+            unsafe_allow_html = True
+        )
+        st.table(pd.DataFrame(
+            find_k_farthest(index, etfs_data, k=k),
+            columns = ["ETF", "Weighted Jaccard Similarity"]
+        ))
+    logger.info(f'Searched for the ETFs nearest to and farthest from: {user_input}')
     
 st.subheader("Specify up to 10 ETFs to compare")
 
@@ -161,7 +235,13 @@ with st.form(key='my_form'):
         maxtags = 10,
         suggestions = dbc.get_known_etfs()
     )
+    k = st.slider(
+        "Number of similar/different ETFs to list",
+        min_value = 1,
+        max_value = 20,
+        value = 5
+    )
     submit_button = st.form_submit_button(label='Launch')
 
 if submit_button:
-    run(user_input)
\ No newline at end of file
+    run(user_input, k=k)
\ No newline at end of file
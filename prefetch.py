@@ -5,57 +5,50 @@ import time
 import logging
 
 from datetime import datetime, date
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # external dependencies
 
 # local dependencies
 from src.dbms.PostgresDatabaseClient import PostgresDatabaseClient
+from src.scraping import scrape_etf_holdings_many, get_fund_url, ResponseStore, NotModified
 
-def prefetch_etf_data(etf: str) -> bool:
-    """Convenience function that creates a PostgresDatabaseClient
-    and calls its `.get_holdings_and_weights_for_etf` method to
-    scrape and insert the latest holdings data for the provided etf.
+def get_latest_update() -> date:
+    """Convenience function to fetch the latest date with holdings data
+    in the Postgres database (see `SQLDatabaseClient.get_latest_holdings_date`).
 
     Parameters
     ----------
-    etf : str
-        Ticker for the etf of interest.
+    None
 
     Returns
     -------
-    bool : Boolean confirming whether the operation has been executed
-           successfully (True) or not (False).
-    
+    date : latest date with holdings data in the Postgres database.
     """
-    logging.info(f"Pre-fetching data for {etf}")
+    logging.info(f"Getting latest update date")
     pdc = PostgresDatabaseClient("aws_credentials.json")
-    try:
-        _ = pdc.get_holdings_and_weights_for_etf(etf.upper())
-    except Exception as e:
-        logging.error(f"Got an exception when pre-fetching data for {etf}: {e}")
-        return False
-    else:
-        logging.info(f"Successfully pre-fetched data for {etf}")
-        return True
+    latest = pdc.get_latest_holdings_date()
+    logging.info(f"Latest update date: {latest}")
+    return latest
 
-def get_latest_update() -> date:
-    """Convenience function to fetch the latest date present in the 
-    `etf_holdings_table` table of the Postgres database.
-
-    Parameters
-    ----------
-    None
+def update_similarities() -> int:
+    """Convenience function that updates the `etf_similarity_table` table of 
+    the Postgres database with today's similarities between all known ETFs
+    (see `SQLDatabaseClient.update_similarity_table`).
 
     Returns
     -------
-    date : latest date present in the `etf_holdings_table` table of the Postgres database.
+    int : The number of recomputed rows (-1 if the update failed).
     """
-    logging.info(f"Getting latest update date")
+    logging.info("Updating the similarities between all known ETFs")
     pdc = PostgresDatabaseClient("aws_credentials.json")
-    latest = pdc.execute_query("SELECT MAX(Date) FROM etf_holdings_table;")[0][0]
-    logging.info(f"Latest update date: {latest}")
-    return latest
+    try:
+        n_rows = pdc.update_similarity_table()
+    except Exception as e:
+        logging.error(f"Got an exception when updating the similarities: {e}")
+        return -1
+    else:
+        logging.info(f"Recomputed {n_rows} rows of the similarity table")
+        return n_rows
 
 def prefetch(hibernation_seconds: int = 60*60) -> None:
     """Function that continuously checks the need to fetch
@@ -75,6 +68,8 @@ def prefetch(hibernation_seconds: int = 60*60) -> None:
     None
     """
     hibernation_seconds = max(60*60, hibernation_seconds)
+    # create the missing tables and indexes (see `SQLDatabaseClient.migrate`)
+    PostgresDatabaseClient("aws_credentials.json").setup()
     last_update = get_latest_update()
     while True:
         day = datetime.now().day
@@ -84,18 +79,37 @@ def prefetch(hibernation_seconds: int = 60*60) -> None:
             # get known etfs
             pdc = PostgresDatabaseClient("aws_credentials.json")
             known_etfs = pdc.get_known_etfs()
-            logging.info(f"Pre-fetching data for {len(known_etfs)} ETFs")
-            with ThreadPoolExecutor(max_workers=8) as pool:
-                future_to_outcome = {pool.submit(prefetch_etf_data, etf): etf for etf in known_etfs}
-                for future in as_completed(future_to_outcome):
-                    etf = future_to_outcome[future]
-                    try:
-                        data = future.result()
-                        assert data
-                    except (Exception, AssertionError) as e:
-                        logging.error(f'Pre-fetching data for {etf} generated an exception: {e}')
-                    else:
-                        logging.info(f'Prefetch operation for {etf} concluded successfully: {data}')
+            stored = pdc.get_holdings_snapshot(pdc.today, known_etfs)
+            missing_etfs = [ etf for etf in known_etfs if etf.upper() not in stored ]
+            logging.info(f"Pre-fetching data for {len(missing_etfs)}/{len(known_etfs)} ETFs")
+            # downloads from each host share their connections (see `src.scraping.scrape_etf_holdings_many`),
+            # and provider files that haven't changed since the last download aren't transferred again
+            store = ResponseStore()
+            etfs_holdings, errors = scrape_etf_holdings_many(missing_etfs, store=store)
+            unchanged_etfs = [ etf for etf, e in errors.items() if isinstance(e, NotModified) ]
+            for etf, e in errors.items():
+                if not isinstance(e, NotModified):
+                    logging.error(f'Pre-fetching data for {etf} generated an exception: {e}')
+            # unchanged ETFs keep their latest holdings, copied to today's date
+            copied = pdc.copy_holdings_forward(unchanged_etfs)
+            stale_etfs = [ etf for etf in unchanged_etfs if etf.upper() not in copied ]
+            if stale_etfs:
+                # no earlier holdings to copy: download those files in full
+                for etf in stale_etfs:
+                    store.forget(get_fund_url(etf))
+                stale_holdings, stale_errors = scrape_etf_holdings_many(stale_etfs)
+                etfs_holdings.update(stale_holdings)
+                for etf, e in stale_errors.items():
+                    logging.error(f'Pre-fetching data for {etf} generated an exception: {e}')
+            inserted = pdc.insert_etfs_holding_data(etfs_holdings)
+            # the files are only recorded as fetched once their holdings are stored, so that
+            # the files whose holdings couldn't be stored get downloaded in full on the next run
+            for etf in etfs_holdings:
+                if etf.upper() in inserted:
+                    store.commit(get_fund_url(etf))
+            logging.info(f"Copied the unchanged holdings of {len(copied)}/{len(missing_etfs)} ETFs")
+            logging.info(f"Inserted the holdings of {len(inserted)}/{len(missing_etfs)} ETFs")
+            update_similarities()
             logging.info("Concluded prefetch operations for all {len(known_etfs)} known etfs; hibernating for 1 hour.")
         else:
             logging.info("No need for prefetching as of now; hibernating for 1 hour.")
@@ -0,0 +1,697 @@
+# cache.py
+
+# standard library dependencies
+import io
+import os
+import abc
+import sys
+import json
+import time
+import struct
+import hashlib
+import logging
+logger = logging.getLogger(f"mainLogger.cache")
+import tempfile
+import threading
+from functools import wraps
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Hashable, Iterable, List, Mapping, Tuple, Union
+
+# external dependencies
+import numpy as np
+
+
+def estimate_nbytes(value: Any) -> int:
+    """Rough estimate of the memory footprint (in bytes) of `value`,
+    including the containers (dicts, lists, tuples and sets) it holds."""
+    nbytes = sys.getsizeof(value)
+    if isinstance(value, Mapping):
+        nbytes += sum( estimate_nbytes(key) + estimate_nbytes(item) for key, item in value.items() )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        nbytes += sum( estimate_nbytes(item) for item in value )
+    return nbytes
+
+
+def get_ttl(date_: Any, today_ttl_seconds: float, ttl_seconds: float) -> float:
+    """Returns the number of seconds for which a value derived from the holdings of `date_` can be cached:
+    `today_ttl_seconds` for the current date, whose holdings can still be (re-)written by other processes
+    (e.g. `prefetch.py`), and `ttl_seconds` otherwise.
+
+    Examples
+    --------
+    >>> assert get_ttl('2022-01-03', 60, float('inf')) == float('inf')
+    >>> assert get_ttl(datetime.now().date(), 60, float('inf')) == 60
+    """
+    return today_ttl_seconds if str(date_) >= str(datetime.now().date()) else ttl_seconds
+
+
+class HoldingsCache:
+    """Thread-safe, bounded cache of ETF holdings data keyed by (ETF ticker, date).
+
+    The least recently used entries are evicted once the cache holds more than `max_entries`
+    entries or more than (an estimate of) `max_bytes` bytes. Holdings of past dates never change,
+    so they only get evicted by these bounds; holdings of the current date can still be (re-)written
+    by other processes (e.g. `prefetch.py`), so they expire after `today_ttl_seconds` seconds.
+
+    Examples
+    --------
+    >>> cache = HoldingsCache(max_entries=2)
+    >>> cache.put('spy', '2022-01-03', {'AAPL': {'weight': 0.07}})
+    >>> assert cache.get('SPY', '2022-01-03') == {'AAPL': {'weight': 0.07}}
+    >>> assert cache.get('SPY', '2022-01-04') is None
+    >>> cache.put('QQQ', '2022-01-03', {'MSFT': {'weight': 0.1}})
+    >>> cache.put('DIA', '2022-01-03', {'UNH': {'weight': 0.09}})
+    >>> assert cache.get('SPY', '2022-01-03') is None
+    >>> assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2 and cache.stats()['evictions'] == 1
+    >>> cache.invalidate('QQQ')
+    >>> assert len(cache) == 1
+    """
+    def __init__(   self,
+                    max_entries: int = 4096,
+                    max_bytes: int = 64 * 1024 * 1024,
+                    today_ttl_seconds: float = 15 * 60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.today_ttl_seconds = today_ttl_seconds
+        self.__lock = threading.Lock()
+        # (ETF ticker, date) -> (value, size estimate, expiry time)
+        self.__entries: "OrderedDict[Tuple[str, str], Tuple[Any, int, float]]" = OrderedDict()
+        self.__nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(etf_ticker: str, date_: Any) -> Tuple[str, str]:
+        return (etf_ticker.upper(), str(date_))
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated number of bytes held by the cached values."""
+        return self.__nbytes
+
+    def _pop(self, key: Tuple[str, str]) -> None:
+        _, nbytes, _ = self.__entries.pop(key)
+        self.__nbytes -= nbytes
+
+    def get(self, etf_ticker: str, date_: Any, default: Any = None) -> Any:
+        """Returns the cached holdings of `etf_ticker` on `date_`, or `default` on a miss."""
+        key = self.key(etf_ticker, date_)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, etf_ticker: str, date_: Any, value: Any) -> None:
+        """Caches `value` as the holdings of `etf_ticker` on `date_`, evicting the
+        least recently used entries if needed."""
+        key = self.key(etf_ticker, date_)
+        nbytes = estimate_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        expires_at = time.monotonic() + get_ttl(key[1], self.today_ttl_seconds, float('inf'))
+        with self.__lock:
+            if key in self.__entries:
+                self._pop(key)
+            self.__entries[key] = (value, nbytes, expires_at)
+            self.__nbytes += nbytes
+            while len(self.__entries) > self.max_entries or self.__nbytes > self.max_bytes:
+                self._pop(next(iter(self.__entries)))
+                self.evictions += 1
+
+    def invalidate(self, etf_ticker: str = None, date_: Any = None) -> None:
+        """Drops the cached holdings of `etf_ticker` (all ETFs if None) on `date_` (all dates if None)."""
+        with self.__lock:
+            for key in list(self.__entries.keys()):
+                if (etf_ticker is None or key[0] == etf_ticker.upper()) and (date_ is None or key[1] == str(date_)):
+                    self._pop(key)
+
+    def clear(self) -> None:
+        self.invalidate()
+
+    def stats(self) -> Mapping[str, int]:
+        """Returns the cache's hit/miss/eviction counters and current size."""
+        with self.__lock:
+            return dict(
+                hits = self.hits,
+                misses = self.misses,
+                evictions = self.evictions,
+                entries = len(self.__entries),
+                nbytes = self.__nbytes
+            )
+
+
+# process-wide caches, one per database
+_holdings_caches: Mapping[Hashable, HoldingsCache] = dict()
+_holdings_caches_lock = threading.Lock()
+
+def get_holdings_cache(database_key: Hashable = None) -> HoldingsCache:
+    """Returns the process-wide `HoldingsCache` of the database identified by `database_key`
+    (a new, unshared cache if `database_key` is None)."""
+    if database_key is None:
+        return HoldingsCache()
+    with _holdings_caches_lock:
+        if database_key not in _holdings_caches:
+            _holdings_caches[database_key] = HoldingsCache()
+        return _holdings_caches[database_key]
+
+def cached_holdings(method: Callable) -> Callable:
+    """Decorator caching the results of a database client's `get_holdings_and_weights_for_etf(etf_ticker, date_=None)`
+    method in the client's `holdings_cache`, keyed on the ticker and on the resolved date
+    (i.e. `date_=None` is replaced by the client's `today`, so cached results don't outlive their day).
+    Empty results and exceptions aren't cached."""
+    @wraps(method)
+    def wrapper(self, etf_ticker: str, date_: Any = None) -> Any:
+        if date_ is None:
+            date_ = self.today
+        holdings = self.holdings_cache.get(etf_ticker, date_)
+        if holdings is None:
+            holdings = method(self, etf_ticker, date_)
+            if holdings:
+                self.holdings_cache.put(etf_ticker, date_, holdings)
+        return holdings
+    return wrapper
+
+
+class CacheBackend(abc.ABC):
+    """Key-value store of serialized values shared by the processes using the same backend
+    (see `get_shared_cache`); expired values behave as missing ones."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Union[None, bytes]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, value: bytes, ttl_seconds: float = None) -> None:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+class InMemoryCacheBackend(CacheBackend):
+    """Process-local stand-in for a shared backend (e.g. for tests or single-process deployments).
+
+    The least recently used values are evicted once the backend holds more than `max_entries`
+    values or more than `max_bytes` bytes, so that it stays as bounded as `HoldingsCache`.
+
+    Examples
+    --------
+    >>> backend = InMemoryCacheBackend(max_entries=2)
+    >>> for key in ('a', 'b', 'c'):
+    ...     backend.set(key, b'value')
+    >>> assert backend.get('a') is None and backend.get('c') == b'value' and len(backend) == 2
+    """
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        # key -> (value, expiry time)
+        self.__values: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.__nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.__nbytes
+
+    def _pop(self, key: str) -> None:
+        value, _ = self.__values.pop(key)
+        self.__nbytes -= len(value)
+
+    def get(self, key: str) -> Union[None, bytes]:
+        with self.__lock:
+            entry = self.__values.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                self._pop(key)
+                return None
+            self.__values.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: bytes, ttl_seconds: float = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self.__lock:
+            if key in self.__values:
+                self._pop(key)
+            self.__values[key] = (value, float('inf') if ttl_seconds is None else time.time() + ttl_seconds)
+            self.__nbytes += len(value)
+            while len(self.__values) > self.max_entries or self.__nbytes > self.max_bytes:
+                self._pop(next(iter(self.__values)))
+
+    def delete(self, key: str) -> None:
+        with self.__lock:
+            if key in self.__values:
+                self._pop(key)
+
+class DiskCacheBackend(CacheBackend):
+    """Stores each value in its own file under `directory`, so that all the processes 
+    of a host (e.g. Streamlit workers, the REST API and `prefetch.py`) share them.
+    Files are replaced atomically, so readers never see partially written values.
+
+    Writes sweep the directory at most every `sweep_interval_seconds` seconds (see `sweep`),
+    deleting the expired files and, past `max_bytes` bytes, the least recently written ones."""
+    _header = struct.Struct('<d')
+    # prefix of the files being written, which sweeps leave alone
+    _temporary_prefix = '.tmp-'
+
+    def __init__(   self, 
+                    directory: str,
+                    max_bytes: int = 256 * 1024 * 1024,
+                    sweep_interval_seconds: float = 10 * 60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.__last_sweep = time.monotonic()
+        self.__sweep_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest())
+
+    def get(self, key: str) -> Union[None, bytes]:
+        try:
+            with open(self.path(key), 'rb') as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return None
+        (expires_at,) = self._header.unpack_from(data)
+        if expires_at < time.time():
+            self.delete(key)
+            return None
+        return data[self._header.size:]
+
+    def set(self, key: str, value: bytes, ttl_seconds: float = None) -> None:
+        expires_at = float('inf') if ttl_seconds is None else time.time() + ttl_seconds
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory, prefix=self._temporary_prefix)
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(self._header.pack(expires_at))
+                handle.write(value)
+            os.replace(temporary_path, self.path(key))
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+        if time.monotonic() - self.__last_sweep >= self.sweep_interval_seconds:
+            self.sweep()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self) -> int:
+        """Deletes the expired files, then the least recently written ones until the directory
+        holds at most `max_bytes` bytes. Returns the number of deleted files."""
+        if not self.__sweep_lock.acquire(blocking=False):
+            return 0
+        try:
+            self.__last_sweep = time.monotonic()
+            now = time.time()
+            # (modification time, size, path) of the files that are kept
+            kept: List[Tuple[float, int, str]] = []
+            n_deleted = 0
+            for entry in os.scandir(self.directory):
+                if entry.name.startswith(self._temporary_prefix) or not entry.is_file():
+                    continue
+                try:
+                    with open(entry.path, 'rb') as handle:
+                        (expires_at,) = self._header.unpack(handle.read(self._header.size))
+                    stat = entry.stat()
+                    if expires_at < now:
+                        os.remove(entry.path)
+                        n_deleted += 1
+                    else:
+                        kept.append((stat.st_mtime, stat.st_size, entry.path))
+                except (OSError, struct.error):
+                    # deleted (or being replaced) by another process
+                    continue
+            nbytes = sum( size for _, size, _ in kept )
+            for _, size, path in sorted(kept):
+                if nbytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    n_deleted += 1
+                except FileNotFoundError:
+                    pass
+                nbytes -= size
+            return n_deleted
+        finally:
+            self.__sweep_lock.release()
+
+class RedisCacheBackend(CacheBackend):
+    """Stores the values in a Redis (or Redis-compatible) server at `url`, e.g. 'redis://localhost:6379/0',
+    so that processes on different hosts share them. Requires the `redis` package."""
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Union[None, bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl_seconds: float = None) -> None:
+        self.client.set(key, value, ex=None if ttl_seconds is None else max(1, int(ttl_seconds)))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+def get_cache_backend(url: str) -> CacheBackend:
+    """Instantiates the cache backend described by `url`: 'memory://', 'file://<directory>' or 'redis://...'.
+
+    Examples
+    --------
+    >>> assert isinstance(get_cache_backend('memory://'), InMemoryCacheBackend)
+    """
+    if url.startswith('memory://'):
+        return InMemoryCacheBackend()
+    if url.startswith('file://'):
+        return DiskCacheBackend(url[len('file://'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCacheBackend(url)
+    raise ValueError(f"Unsupported cache backend URL: {url}")
+
+
+class SharedCache:
+    """Serializes holdings snapshots (keyed by ETF ticker and date) and similarity matrices
+    (keyed by ETF tickers, distance measure and date) into a `CacheBackend`. 
+    
+    Errors raised by the backend are logged and treated as misses, so an unavailable
+    backend only makes reads fall back to the database.
+
+    Examples
+    --------
+    >>> cache = SharedCache(InMemoryCacheBackend())
+    >>> cache.put_holdings('spy', '2022-01-03', {'AAPL': {'weight': 0.07}})
+    >>> assert cache.get_holdings('SPY', '2022-01-03') == {'AAPL': {'weight': 0.07}}
+    >>> cache.put_similarity_matrix(['SPY', 'QQQ'], 'jaccard', '2022-01-03', np.eye(2))
+    >>> assert cache.get_similarity_matrix(['SPY', 'QQQ'], 'jaccard', '2022-01-03').tolist() == [[1.0, 0.0], [0.0, 1.0]]
+    >>> assert cache.get_similarity_matrix(['QQQ', 'SPY'], 'jaccard', '2022-01-03') is None
+    >>> version = cache.invalidate_similarities('2022-01-03')
+    >>> assert cache.get_similarity_matrix(['SPY', 'QQQ'], 'jaccard', '2022-01-03') is None
+    """
+    def __init__(   self, 
+                    backend: CacheBackend,
+                    namespace: str = "",
+                    today_ttl_seconds: float = 15 * 60,
+                    ttl_seconds: float = 7 * 24 * 60 * 60):
+        self.backend = backend
+        # keeps the values of different databases apart
+        self.namespace = namespace
+        # values of the current date can still be (re-)written by `prefetch.py`
+        self.today_ttl_seconds = today_ttl_seconds
+        self.ttl_seconds = ttl_seconds
+
+    def _ttl(self, date_: Any) -> float:
+        return get_ttl(date_, self.today_ttl_seconds, self.ttl_seconds)
+
+    def holdings_key(self, etf_ticker: str, date_: Any) -> str:
+        return f"{self.namespace}:holdings:{etf_ticker.upper()}:{date_}"
+
+    def similarity_version_key(self, date_: Any) -> str:
+        return f"{self.namespace}:similarity_version:{date_}"
+
+    def similarity_version(self, date_: Any) -> str:
+        """Returns the version of the similarity matrices of `date_`, which is part of their keys
+        (see `invalidate_similarities`). A missing version (e.g. evicted by the backend) is replaced 
+        by a new one, such that the matrices cached under the previous versions are never read again."""
+        version = self._get(self.similarity_version_key(date_))
+        if version is not None:
+            return version.decode('utf-8')
+        return self.invalidate_similarities(date_)
+
+    def similarity_key(self, etf_tickers: Iterable[str], distance_measure: str, date_: Any) -> str:
+        tickers = hashlib.blake2b(",".join( etf_ticker.upper() for etf_ticker in etf_tickers ).encode('utf-8'), digest_size=16)
+        return f"{self.namespace}:similarity:{distance_measure}:{date_}:{self.similarity_version(date_)}:{tickers.hexdigest()}"
+
+    def _get(self, key: str) -> Union[None, bytes]:
+        try:
+            return self.backend.get(key)
+        except Exception as backend_error:
+            logger.warning(f"Unable to read {key} from the shared cache: {backend_error}")
+            return None
+
+    def _set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        try:
+            self.backend.set(key, value, ttl_seconds)
+        except Exception as backend_error:
+            logger.warning(f"Unable to write {key} to the shared cache: {backend_error}")
+
+    def get_holdings(self, etf_ticker: str, date_: Any) -> Union[None, Mapping[str, Mapping]]:
+        """Returns the cached holdings (formatted like the values of `get_holdings_and_weights_for_etfs`'s
+        output) of `etf_ticker` on `date_`, or None."""
+        data = self._get(self.holdings_key(etf_ticker, date_))
+        if data is None:
+            return None
+        return { holding: dict(weight=weight) for holding, weight in json.loads(data) }
+
+    def put_holdings(self, etf_ticker: str, date_: Any, holdings: Mapping[str, Mapping]) -> None:
+        data = json.dumps([ (holding, metadata['weight']) for holding, metadata in holdings.items() ])
+        self._set(self.holdings_key(etf_ticker, date_), data.encode('utf-8'), self._ttl(date_))
+
+    def invalidate_holdings(self, etf_ticker: str, date_: Any) -> None:
+        try:
+            self.backend.delete(self.holdings_key(etf_ticker, date_))
+        except Exception as backend_error:
+            logger.warning(f"Unable to invalidate {etf_ticker}'s holdings in the shared cache: {backend_error}")
+
+    def invalidate_similarities(self, date_: Any) -> str:
+        """Makes the similarity matrices cached for `date_` unreachable (they're left to expire) by 
+        starting a new version of the matrices of `date_`, e.g. once they're recomputed; returns the new version."""
+        version = os.urandom(8).hex()
+        # the version must outlive the matrices it keys
+        self._set(self.similarity_version_key(date_), version.encode('utf-8'), None)
+        return version
+
+    def get_similarity_matrix(  self, 
+                                etf_tickers: Iterable[str], 
+                                distance_measure: str, 
+                                date_: Any) -> Union[None, np.ndarray]:
+        """Returns the cached similarity matrix between `etf_tickers` (in this order), or None."""
+        data = self._get(self.similarity_key(etf_tickers, distance_measure, date_))
+        if data is None:
+            return None
+        return np.load(io.BytesIO(data), allow_pickle=False)
+
+    def put_similarity_matrix(  self, 
+                                etf_tickers: Iterable[str], 
+                                distance_measure: str, 
+                                date_: Any,
+                                matrix: np.ndarray) -> None:
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(matrix, dtype=float), allow_pickle=False)
+        self._set(self.similarity_key(etf_tickers, distance_measure, date_), buffer.getvalue(), self._ttl(date_))
+
+
+_cache_backend: CacheBackend = None
+_cache_backend_lock = threading.Lock()
+
+def get_shared_cache(namespace: str = "") -> SharedCache:
+    """Returns a `SharedCache` over the process-wide backend described by the
+    `ETF_COMPARER_CACHE_URL` environment variable (see `get_cache_backend`),
+    which defaults to a process-local 'memory://' backend."""
+    global _cache_backend
+    with _cache_backend_lock:
+        if _cache_backend is None:
+            url = os.environ.get("ETF_COMPARER_CACHE_URL", "memory://")
+            logger.info(f"Using the shared cache backend at {url}")
+            _cache_backend = get_cache_backend(url)
+    return SharedCache(_cache_backend, namespace=namespace)
+
+
+def render_key( kind: str,
+                backend: str,
+                etf_tickers: Iterable[str],
+                date_: Any,
+                measure: str = None,
+                theme: str = None,
+                ordered: bool = False,
+                **options: Any) -> str:
+    """Content address of a rendered figure: the digest of everything the image depends on.
+
+    Parameters
+    ----------
+    kind : str
+        Kind of figure (e.g. 'similarity' or 'holdings_tracks').
+    backend : str
+        Name of the database the plotted holdings come from (e.g. 'TinyDB'), whose data can differ
+        from the other databases'.
+    etf_tickers : Iterable[str]
+        Tickers of the plotted ETFs; sorted unless `ordered` is True (i.e. unless the figure
+        depends on their order).
+    date_ : Any
+        Date of the plotted holdings.
+    measure : str, optional
+        Distance measure, by default None.
+    theme : str, optional
+        Identifier of the plotting style, by default None.
+    options : Any
+        Any other (JSON-serializable) parameter of the figure, e.g. its DPI.
+
+    Examples
+    --------
+    >>> key = render_key('similarity', 'TinyDB', ['spy', 'QQQ'], '2022-01-03', 'jaccard', 'dark')
+    >>> assert key == render_key('similarity', 'TinyDB', ['QQQ', 'SPY'], '2022-01-03', 'jaccard', 'dark')
+    >>> assert key != render_key('similarity', 'TinyDB', ['QQQ', 'SPY'], '2022-01-04', 'jaccard', 'dark')
+    >>> assert key != render_key('similarity', 'SQLite3', ['QQQ', 'SPY'], '2022-01-03', 'jaccard', 'dark')
+    >>> assert render_key('holdings_tracks', 'TinyDB', ['A', 'B'], '2022-01-03', ordered=True) != render_key('holdings_tracks', 'TinyDB', ['B', 'A'], '2022-01-03', ordered=True)
+    """
+    etf_tickers = [ etf_ticker.upper() for etf_ticker in etf_tickers ]
+    if not ordered:
+        etf_tickers = sorted(etf_tickers)
+    description = json.dumps(
+        [kind, backend, etf_tickers, str(date_), measure, theme, options],
+        sort_keys = True,
+        default = str
+    )
+    return hashlib.blake2b(description.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class RenderCache:
+    """Thread-safe cache of rendered figures (PNG bytes) keyed by their content address (see `render_key`),
+    kept in a bounded in-memory LRU in front of an optional on-disk store (of at most `max_disk_bytes` bytes, 
+    see `DiskCacheBackend.sweep`) shared by all the processes of a host. Images expire as per `get_ttl`.
+
+    Examples
+    --------
+    >>> cache = RenderCache(max_entries=1)
+    >>> key = render_key('similarity', 'TinyDB', ['SPY', 'QQQ'], '2022-01-03', 'jaccard')
+    >>> assert cache.get_or_render(key, '2022-01-03', lambda: b'png') == b'png'
+    >>> assert cache.get_or_render(key, '2022-01-03', lambda: b'other png') == b'png'
+    >>> assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    """
+    def __init__(   self,
+                    directory: str = None,
+                    max_entries: int = 256,
+                    max_bytes: int = 64 * 1024 * 1024,
+                    max_disk_bytes: int = 256 * 1024 * 1024,
+                    today_ttl_seconds: float = 15 * 60,
+                    ttl_seconds: float = 7 * 24 * 60 * 60):
+        self.disk = None if directory is None else DiskCacheBackend(directory, max_bytes=max_disk_bytes)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.today_ttl_seconds = today_ttl_seconds
+        self.ttl_seconds = ttl_seconds
+        self.__lock = threading.Lock()
+        # key -> (PNG bytes, expiry time)
+        self.__entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self.__nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def _pop(self, key: str) -> None:
+        image, _ = self.__entries.pop(key)
+        self.__nbytes -= len(image)
+
+    def _remember(self, key: str, image: bytes, ttl_seconds: float) -> None:
+        if len(image) > self.max_bytes:
+            return
+        with self.__lock:
+            if key in self.__entries:
+                self._pop(key)
+            self.__entries[key] = (image, time.time() + ttl_seconds)
+            self.__nbytes += len(image)
+            while len(self.__entries) > self.max_entries or self.__nbytes > self.max_bytes:
+                self._pop(next(iter(self.__entries)))
+                self.evictions += 1
+
+    def get(self, key: str) -> Union[None, bytes]:
+        """Returns the image cached under `key` (from memory, else from disk), or None."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[1] < time.time():
+                self._pop(key)
+                entry = None
+            if entry is not None:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        image = None
+        if self.disk is not None:
+            try:
+                image = self.disk.get(key)
+            except Exception as disk_error:
+                logger.warning(f"Unable to read the rendered figure {key} from disk: {disk_error}")
+        with self.__lock:
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # the on-disk copy expires on its own; the in-memory one can't outlive the shortest TTL
+        self._remember(key, image, min(self.today_ttl_seconds, self.ttl_seconds))
+        return image
+
+    def put(self, key: str, date_: Any, image: bytes) -> None:
+        """Caches the `image` of a figure of the holdings on `date_` under `key`."""
+        ttl_seconds = get_ttl(date_, self.today_ttl_seconds, self.ttl_seconds)
+        self._remember(key, image, ttl_seconds)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, image, ttl_seconds)
+            except Exception as disk_error:
+                logger.warning(f"Unable to write the rendered figure {key} to disk: {disk_error}")
+
+    def get_or_render(self, key: str, date_: Any, render: Callable[[], bytes]) -> bytes:
+        """Returns the image cached under `key`, rendering (see `src.plotting.figure_to_png`)
+        and caching it on a miss."""
+        image = self.get(key)
+        if image is None:
+            image = render()
+            self.put(key, date_, image)
+        return image
+
+    def clear(self) -> None:
+        """Drops the in-memory images (the on-disk ones expire on their own)."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__nbytes = 0
+
+    def stats(self) -> Mapping[str, int]:
+        """Returns the cache's hit/miss/eviction counters and current (in-memory) size."""
+        with self.__lock:
+            return dict(
+                hits = self.hits,
+                misses = self.misses,
+                evictions = self.evictions,
+                entries = len(self.__entries),
+                nbytes = self.__nbytes
+            )
+
+
+_render_cache: RenderCache = None
+_render_cache_lock = threading.Lock()
+
+def get_render_cache() -> RenderCache:
+    """Returns the process-wide `RenderCache`, storing its images in the directory given by the
+    `ETF_COMPARER_RENDER_CACHE_DIR` environment variable (by default, 'data/renders'; an empty value
+    keeps the images in memory only)."""
+    global _render_cache
+    with _render_cache_lock:
+        if _render_cache is None:
+            directory = os.environ.get(
+                "ETF_COMPARER_RENDER_CACHE_DIR",
+                os.path.join("data", "renders")
+            )
+            logger.info(f"Caching the rendered figures in {directory or 'memory'}")
+            _render_cache = RenderCache(directory or None)
+    return _render_cache
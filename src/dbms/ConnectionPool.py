@@ -0,0 +1,251 @@
+# standard library dependencies
+import os
+import time
+import logging
+logger = logging.getLogger(f"mainLogger.ConnectionPool")
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Iterator, List, Mapping, Tuple
+
+# external dependencies
+import boto3
+import psycopg2
+
+
+class ConnectionPool:
+    """Thread-safe pool of database connections.
+
+    At most `max_connections` connections are handed out at once (`acquire` blocks
+    until one is released), and up to `min_connections` idle connections are kept open
+    between uses. Connections that have been idle for more than `health_check_interval`
+    seconds are checked with `SELECT 1` before being handed out, and replaced if broken.
+
+    Parameters
+    ----------
+    connect : Callable[[], Any]
+        Function opening a new DB-API connection.
+    min_connections : int, optional
+        Number of idle connections kept open between uses, by default 1.
+    max_connections : int, optional
+        Maximal number of connections open at once, by default 10.
+    health_check_interval : float, optional
+        Idle time (in seconds) after which a connection is checked before being reused, by default 30.
+    max_idle_seconds : float, optional
+        Idle time (in seconds) after which connections beyond `min_connections` are closed, by default 300.
+
+    Examples
+    --------
+    >>> import sqlite3
+    >>> pool = ConnectionPool(lambda: sqlite3.connect(":memory:", check_same_thread=False), max_connections=2)
+    >>> with pool.connection() as conn:
+    ...     assert conn.execute("SELECT 1;").fetchall() == [(1,)]
+    >>> assert pool.size == 1
+    >>> pool.close()
+    """
+    def __init__(   self,
+                    connect: Callable[[], Any],
+                    min_connections: int = 1,
+                    max_connections: int = 10,
+                    health_check_interval: float = 30.0,
+                    max_idle_seconds: float = 300.0):
+        assert 0 <= min_connections <= max_connections and max_connections > 0, \
+            f"Invalid pool size: min_connections={min_connections}, max_connections={max_connections}"
+        self.connect = connect
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.health_check_interval = health_check_interval
+        self.max_idle_seconds = max_idle_seconds
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(max_connections)
+        # (connection, time at which it was released) pairs, most recently released last
+        self.__idle: Deque[Tuple[Any, float]] = deque()
+        self.__size = 0
+
+    @property
+    def size(self) -> int:
+        """Number of currently open connections (idle or in use)."""
+        return self.__size
+
+    def is_healthy(self, conn: Any) -> bool:
+        """Returns whether `conn` can still execute queries."""
+        if getattr(conn, "closed", False):
+            return False
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.fetchall()
+            conn.rollback()
+        except Exception as broken_connection:
+            logger.warning(f"Discarding broken connection: {broken_connection}")
+            return False
+        return True
+
+    def _close(self, conn: Any) -> None:
+        with self.__lock:
+            self.__size -= 1
+        try:
+            conn.close()
+        except Exception as already_closed:
+            logger.debug(already_closed)
+
+    def acquire(self, timeout: float = None) -> Any:
+        """Returns a connection from the pool, opening a new one if none is idle.
+
+        Raises
+        ------
+        TimeoutError
+            If no connection got released within `timeout` seconds.
+        """
+        if not self.__slots.acquire(timeout=-1 if timeout is None else timeout):
+            raise TimeoutError(f"No connection was released within {timeout} seconds")
+        try:
+            while True:
+                with self.__lock:
+                    if len(self.__idle) == 0:
+                        break
+                    conn, released_at = self.__idle.pop()
+                if time.monotonic() - released_at < self.health_check_interval or self.is_healthy(conn):
+                    return conn
+                self._close(conn)
+            conn = self.connect()
+            with self.__lock:
+                self.__size += 1
+            return conn
+        except BaseException:
+            self.__slots.release()
+            raise
+
+    def release(self, conn: Any, discard: bool = False) -> None:
+        """Returns `conn` to the pool; broken (or `discard`ed) connections are closed."""
+        now = time.monotonic()
+        stale: List[Any] = []
+        try:
+            with self.__lock:
+                if not discard and not getattr(conn, "closed", False):
+                    self.__idle.append((conn, now))
+                    conn = None
+                # close the connections beyond `min_connections` that haven't been used in a while
+                while len(self.__idle) > self.min_connections and now - self.__idle[0][1] > self.max_idle_seconds:
+                    stale.append(self.__idle.popleft()[0])
+            if conn is not None:
+                self._close(conn)
+            for stale_conn in stale:
+                self._close(stale_conn)
+        finally:
+            self.__slots.release()
+
+    @contextmanager
+    def connection(self, timeout: float = None) -> Iterator[Any]:
+        """Context manager handing out a connection and committing (or rolling back,
+        if an exception is raised) its transaction before releasing it."""
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            # connections whose transaction can't be rolled back are broken
+            self.release(conn, discard=discard)
+
+    def close(self) -> None:
+        """Closes all idle connections."""
+        with self.__lock:
+            idle = [ conn for conn, _ in self.__idle ]
+            self.__idle.clear()
+        for conn in idle:
+            self._close(conn)
+
+
+class RDSAuthTokenProvider:
+    """Generates (and caches) IAM authentication tokens for an RDS instance;
+    tokens are valid for 15 minutes and get regenerated `refresh_margin` seconds before they expire.
+
+    Parameters
+    ----------
+    credentials : Mapping[str, str]
+        Credentials (see `load_credentials`) holding the AWS keys, region, endpoint, port and user.
+    refresh_margin : float, optional
+        Number of seconds before expiry at which the token gets regenerated, by default 300.
+    """
+    token_lifetime: float = 15 * 60
+
+    def __init__(   self,
+                    credentials: Mapping[str, str],
+                    refresh_margin: float = 5 * 60):
+        self.__credentials = credentials
+        self.refresh_margin = refresh_margin
+        self.__lock = threading.Lock()
+        self.__token: str = None
+        self.__expires_at: float = 0.0
+
+    def _generate_token(self) -> str:
+        session = boto3.Session(
+            aws_access_key_id=self.__credentials['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=self.__credentials['AWS_SECRET_ACCESS_KEY']
+        )
+        client = session.client(
+            'rds',
+            region_name=self.__credentials['REGION']
+        )
+        return client.generate_db_auth_token(
+            DBHostname=self.__credentials['ENDPOINT'],
+            Port=self.__credentials['PORT'],
+            DBUsername=self.__credentials['USER'],
+            Region=self.__credentials['REGION']
+        )
+
+    @property
+    def token(self) -> str:
+        with self.__lock:
+            if self.__token is None or time.monotonic() >= self.__expires_at - self.refresh_margin:
+                logger.info("Generating a new RDS authentication token")
+                generated_at = time.monotonic()
+                self.__token = self._generate_token()
+                self.__expires_at = generated_at + self.token_lifetime
+            return self.__token
+
+
+# process-wide pools, keyed by the (absolute) path of their credentials file
+_postgres_connection_pools: Mapping[str, ConnectionPool] = dict()
+_postgres_connection_pools_lock = threading.Lock()
+
+def get_postgres_connection_pool(   credentials_filepath: str,
+                                    credentials: Mapping[str, str],
+                                    min_connections: int = 1,
+                                    max_connections: int = 10) -> ConnectionPool:
+    """Returns the process-wide connection pool for the Postgres database described by `credentials`,
+    creating it on first use; the pool sizes only apply to that first call.
+
+    Connections authenticate with `credentials['PASSWORD']` if set, and with an
+    IAM authentication token (see `RDSAuthTokenProvider`) otherwise.
+    """
+    key = os.path.abspath(credentials_filepath)
+    with _postgres_connection_pools_lock:
+        if key not in _postgres_connection_pools:
+            token_provider = RDSAuthTokenProvider(credentials)
+
+            def connect() -> Any:
+                # https://www.psycopg.org/docs/usage.html#with-statement
+                return psycopg2.connect(
+                    host=credentials['ENDPOINT'],
+                    port=credentials['PORT'],
+                    database=credentials['DBNAME'],
+                    user=credentials['USER'],
+                    password=credentials.get('PASSWORD') or token_provider.token,
+                    sslrootcert="SSLCERTIFICATE"
+                )
+
+            logger.info(f"Creating a pool of {min_connections} to {max_connections} Postgres connections")
+            _postgres_connection_pools[key] = ConnectionPool(
+                connect,
+                min_connections = min_connections,
+                max_connections = max_connections
+            )
+        return _postgres_connection_pools[key]
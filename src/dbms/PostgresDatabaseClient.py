@@ -2,18 +2,23 @@
 import json
 import logging
 logger = logging.getLogger(f"mainLogger.PostgresDatabaseClient")
+import csv
 import datetime
+from io import StringIO
 from datetime import date
-from functools import lru_cache
-from typing import List, Tuple, Any, Iterable, Union, Mapping
+from contextlib import contextmanager
+from typing import List, Tuple, Any, Iterable, Iterator, Union, Mapping
 
 # external dependencies
-import boto3
 import psycopg2
+from psycopg2.errors import UndefinedTable
+from psycopg2.extras import execute_values
 
 # local dependencies
 from .SQLDatabaseClient import SQLDatabaseClient
+from .ConnectionPool import get_postgres_connection_pool
 from ..scraping import scrape_etf_holdings
+from ..cache import cached_holdings
 
 
 def load_credentials(credentials_filepath: str) -> Mapping[str,str]:
@@ -25,10 +30,28 @@ def load_credentials(credentials_filepath: str) -> Mapping[str,str]:
 class PostgresDatabaseClient(SQLDatabaseClient):
 
     def __init__(   self, 
-                    credentials_filepath: str):
-        super().__init__(dbms = "postgres")
-        self.__credentials = load_credentials(credentials_filepath)
+                    credentials_filepath: str,
+                    min_connections: int = 1,
+                    max_connections: int = 10):
+        credentials = load_credentials(credentials_filepath)
+        # identifies the database across processes and hosts
+        super().__init__(
+            dbms = "postgres", 
+            database_key = f"postgres://{credentials['ENDPOINT']}:{credentials['PORT']}/{credentials['DBNAME']}"
+        )
+        self.__credentials = credentials
         self.__placeholder = '%s'
+        # connections are shared by all the clients of the process that use the same credentials
+        self.__pool = get_postgres_connection_pool(
+            credentials_filepath, 
+            self.__credentials,
+            min_connections = min_connections,
+            max_connections = max_connections
+        )
+        try:
+            self.load_holdings_history()
+        except UndefinedTable:
+            logger.info("The database isn't set up yet (see `setup`); its holdings history mode wasn't loaded.")
 
     @property
     def holdings_table_creation_query(self) -> str:
@@ -61,168 +84,194 @@ class PostgresDatabaseClient(SQLDatabaseClient):
         FOREIGN KEY (Holding_ID) REFERENCES holdings_table (Holding_ID)
         );
         '''
+
+    @property
+    def minhash_table_creation_query(self) -> str:
+        """Postgres query to create the `etf_minhash_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_minhash_table(
+            Date DATE,
+            ETF_ticker_ID integer,
+            Weighted integer,
+            Signature bytea,
+        PRIMARY KEY (Date, ETF_ticker_ID, Weighted),
+        FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def lsh_bucket_table_creation_query(self) -> str:
+        """Postgres query to create the `etf_lsh_bucket_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_lsh_bucket_table(
+            Date DATE,
+            Weighted integer,
+            Band integer,
+            Bucket varchar(16),
+            ETF_ticker_ID integer,
+        PRIMARY KEY (Date, Weighted, Band, Bucket, ETF_ticker_ID),
+        FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def similarity_table_creation_query(self) -> str:
+        """Postgres query to create the `etf_similarity_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_similarity_table(
+            Date DATE,
+            ETF_ticker_ID_1 integer,
+            ETF_ticker_ID_2 integer,
+            Measure varchar(32),
+            Similarity real,
+        PRIMARY KEY (Date, Measure, ETF_ticker_ID_1, ETF_ticker_ID_2),
+        FOREIGN KEY (ETF_ticker_ID_1) REFERENCES etf_ticker_table (ETF_ticker_ID),
+        FOREIGN KEY (ETF_ticker_ID_2) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def schema_migrations_table_creation_query(self) -> str:
+        """Postgres query to create the `schema_migrations_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS schema_migrations_table(
+            Version integer PRIMARY KEY,
+            Description varchar(255),
+            Applied_At timestamp DEFAULT CURRENT_TIMESTAMP
+        );
+        '''
+
+    @property
+    def schema_migrations(self) -> List[Tuple[int, str, List[str]]]:
+        """Postgres schema migrations (see `SQLDatabaseClient.migrate`)"""
+        return [
+            (1, "Index etf_holdings_table by ETF and date", [
+                # the unique index can only be created once duplicated rows are gone
+                '''DELETE FROM etf_holdings_table WHERE Row_ID NOT IN (
+                    SELECT MIN(Row_ID) FROM etf_holdings_table GROUP BY ETF_ticker_ID, Date, Holding_ID
+                );''',
+                # serves the per-ETF reads of `get_holdings_and_weights_for_etf` with index-only scans
+                '''CREATE UNIQUE INDEX IF NOT EXISTS etf_holdings_etf_date_holding_idx 
+                ON etf_holdings_table (ETF_ticker_ID, Date, Holding_ID) INCLUDE (Holding_Weight);''',
+                # covers the by-date reads (`MAX(Date)`, `get_holdings_snapshot`) without touching the table
+                '''CREATE INDEX IF NOT EXISTS etf_holdings_date_etf_idx 
+                ON etf_holdings_table (Date, ETF_ticker_ID) INCLUDE (Holding_ID, Holding_Weight);''',
+                "ANALYZE etf_holdings_table;",
+            ]),
+            (2, "Add the tables of the 'intervals' holdings history", [
+                '''CREATE TABLE IF NOT EXISTS etf_snapshot_dates_table(
+                    Date DATE,
+                    ETF_ticker_ID integer,
+                PRIMARY KEY (ETF_ticker_ID, Date),
+                FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+                );''',
+                # `Valid_To` is exclusive, and null while the holding keeps its weight
+                '''CREATE TABLE IF NOT EXISTS etf_holding_intervals_table(
+                    ETF_ticker_ID integer,
+                    Holding_ID integer,
+                    Holding_Weight real,
+                    Valid_From DATE,
+                    Valid_To DATE,
+                PRIMARY KEY (ETF_ticker_ID, Holding_ID, Valid_From),
+                FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID),
+                FOREIGN KEY (Holding_ID) REFERENCES holdings_table (Holding_ID)
+                );''',
+                # serves the reconstruction of the holdings on a date (see `SQLDatabaseClient.holdings_records_query`)
+                '''CREATE INDEX IF NOT EXISTS etf_holding_intervals_etf_validity_idx 
+                ON etf_holding_intervals_table (ETF_ticker_ID, Valid_From, Valid_To) INCLUDE (Holding_ID, Holding_Weight);''',
+                "CREATE INDEX IF NOT EXISTS etf_snapshot_dates_date_idx ON etf_snapshot_dates_table (Date);",
+            ]),
+            (3, "Add the settings table shared by the clients of the database", [
+                # e.g. the 'holdings_history' mode (see `SQLDatabaseClient.load_holdings_history`)
+                '''CREATE TABLE IF NOT EXISTS settings_table(
+                    Setting varchar(255) PRIMARY KEY,
+                    Value varchar(255)
+                );''',
+            ]),
+        ]
     
     def execute_query(  self, 
                         query: str, 
                         *args) -> Union[None,List[Any]]:
-        session = boto3.Session(
-            aws_access_key_id=self.__credentials['AWS_ACCESS_KEY_ID'], 
-            aws_secret_access_key=self.__credentials['AWS_SECRET_ACCESS_KEY']
-        )
-        client = session.client(
-            'rds', 
-            region_name=self.__credentials['REGION']
-        )
-        token = client.generate_db_auth_token(
-            DBHostname=self.__credentials['ENDPOINT'], 
-            Port=self.__credentials['PORT'], 
-            DBUsername=self.__credentials['USER'], 
-            Region=self.__credentials['REGION']
-        )
-        # https://www.psycopg.org/psycopg3/docs/basic/usage.html#connection-context
-        with psycopg2.connect(
-            host=self.__credentials['ENDPOINT'], 
-            port=self.__credentials['PORT'], 
-            database=self.__credentials['DBNAME'], 
-            user=self.__credentials['USER'], 
-            password=self.__credentials['PASSWORD'], 
-            sslrootcert="SSLCERTIFICATE") as conn:
-
+        with self.__pool.connection() as conn:
             cur = conn.cursor()
             cur.execute(query, *args)
-        try:
-            return cur.fetchall()
-        except Exception:
-            return None   
+            try:
+                return cur.fetchall()
+            except psycopg2.ProgrammingError:
+                # the query didn't return any rows
+                return None   
     
     def execute_query_over_many_arguments(  self, 
                                             query: str, 
                                             args: Iterable[Any],
                                             get_results: bool = False) -> Union[None,List[Any]]:
-        session = boto3.Session(
-            aws_access_key_id=self.__credentials['AWS_ACCESS_KEY_ID'], 
-            aws_secret_access_key=self.__credentials['AWS_SECRET_ACCESS_KEY']
-        )
-        client = session.client(
-            'rds', 
-            region_name=self.__credentials['REGION']
-        )
-        token = client.generate_db_auth_token(
-            DBHostname=self.__credentials['ENDPOINT'], 
-            Port=self.__credentials['PORT'], 
-            DBUsername=self.__credentials['USER'], 
-            Region=self.__credentials['REGION']
-        )
-        # https://www.psycopg.org/psycopg3/docs/basic/usage.html#connection-context
-        # https://stackoverflow.com/questions/8134602/psycopg2-insert-multiple-rows-with-one-query
-        results: List[Any] = []
-        for arg in args:
-            with psycopg2.connect(
-                host=self.__credentials['ENDPOINT'], 
-                port=self.__credentials['PORT'], 
-                database=self.__credentials['DBNAME'], 
-                user=self.__credentials['USER'], 
-                password=self.__credentials['PASSWORD'], 
-                sslrootcert="SSLCERTIFICATE") as conn:
-
-                cur = conn.cursor()
+        # all the rows are sent over the same connection, within a single transaction
+        with self.__pool.connection() as conn:
+            cur = conn.cursor()
+            if not get_results:
+                cur.executemany(query, args)
+                return None
+            results: List[Any] = []
+            for arg in args:
                 cur.execute(query, arg)
-                if get_results:
-                    results.append(cur.fetchall())
-        return results if get_results else None
+                results.append(cur.fetchall())
+            return results
 
-    def insert_etf_holding_data(self,
-                                etf_ticker: str,
-                                etf_holdings: Mapping[str, Mapping[str, float]]) -> Union[None,List[Tuple[datetime.date, str, str, float]]]:
-        """Method handling everything required to handle the data
-        scraped for the specified ETF and insert it into the database.
+    @contextmanager
+    def transaction(self) -> Iterator[Any]:
+        with self.__pool.connection() as conn:
+            # the pool commits, or rolls back on exceptions
+            yield conn.cursor()
 
-        Parameters
-        ----------
-        etf_ticker : str
-            ETF of interest.
-        etf_holdings: Mapping[str, Mapping[str, float]]
-            The holdings data that was scraped for the ETF.
-        
-        Returns
-        -------
-        Union[None,List[Tuple[datetime.date, str, str, float]]]
-            Either None (if no scraping data was provided) or the
-            list of holdings records for the ETF.
-        """
-        try:
-            assert len(etf_holdings) > 0
-        except AssertionError as ae:
-            logger.warning("PostgresDatabaseClient.insert_data was given an empty mapping; No updates to be made.")
-            return None
-            
-        etf_ticker = etf_ticker.upper()
-
-        # make sure the holdings we scraped are included in `holdings_table`
-        # NOTE: this insertion operation doesn't require cleanup if the method
-        #       raises an exception afterwards; having more holding tickers in 
-        #       `holdings_table` is actually advantageous 
-        holding_tickers = [ (holding, ) for holding in etf_holdings.keys() ]
-
-        try:
-            logger.info("Inserting holding tickers.")
-            self.execute_query_over_many_arguments(
-                f"INSERT INTO holdings_table (Holding) VALUES ({self.__placeholder}) ON CONFLICT (Holding) DO NOTHING;",
-                holding_tickers
+    def insert_and_fetch_holding_ids(   self, 
+                                        cur: Any, 
+                                        holding_tickers: List[str]) -> Mapping[str, int]:
+        """Inserts the `holding_tickers` missing from `holdings_table` (returning their new IDs)
+        and fetches the IDs of the ones that were already present."""
+        holding_ids: Mapping[str, int] = dict(execute_values(
+            cur,
+            "INSERT INTO holdings_table (Holding) VALUES %s ON CONFLICT (Holding) DO NOTHING RETURNING Holding, Holding_ID;",
+            [ (holding_ticker,) for holding_ticker in holding_tickers ],
+            page_size = len(holding_tickers),
+            fetch = True
+        ))
+        existing_tickers = [ holding_ticker for holding_ticker in holding_tickers if holding_ticker not in holding_ids ]
+        if len(existing_tickers) > 0:
+            cur.execute(
+                f"SELECT Holding, Holding_ID FROM holdings_table WHERE Holding = ANY({self.__placeholder});",
+                (existing_tickers,)
             )
-            logger.info("Inserted holding tickers.")
-        except Exception as already_exists:
-            logger.warning(already_exists)
+            holding_ids.update(cur.fetchall())
+        return holding_ids
 
-        for (holding_ticker,) in holding_tickers:
-            holding_id: int = self.get_holding_id_for_ticker(holding_ticker)
-            # keeping `holding_ticker` and `holding_ticker_id` together is
-            # useful for future reference
-            etf_holdings[holding_ticker]['holding_ticker_id'] = holding_id
+    def insert_etf_ticker(self, cur: Any, etf_ticker: str) -> int:
+        """Inserts `etf_ticker` into `etf_ticker_table` (unless already present) and returns
+        its `ETF_ticker_ID`, using the cursor `cur`."""
+        cur.execute(
+            f"INSERT INTO etf_ticker_table (ETF_ticker) VALUES ({self.__placeholder}) ON CONFLICT (ETF_ticker) DO NOTHING;",
+            (etf_ticker,)
+        )
+        cur.execute(
+            f"SELECT ETF_ticker_ID FROM etf_ticker_table WHERE ETF_ticker = {self.__placeholder};",
+            (etf_ticker,)
+        )
+        return cur.fetchall()[0][0]
 
-        # then we insert `etf_ticker` into `etf_ticker_table`
-        # NOTE: if this raises an exception, we stop immediately
-        try:
-            logger.info("Inserting etf ticker.")
-            self.execute_query(
-                f"INSERT INTO etf_ticker_table (ETF_ticker) VALUES ({self.__placeholder}) ON CONFLICT (ETF_ticker) DO NOTHING;",
-                (etf_ticker,)
-            )
-            logger.info(f"Successfully inserted {etf_ticker} into etf_ticker_table")
-            etf_ticker_id = self.get_etf_id_for_ticker(etf_ticker)
-        except Exception as error:
-            raise error
-        
-        holdings = [
-            (self.today, etf_ticker_id, holding_dict['holding_ticker_id'], holding_dict['weight'])
-            for holding_dict in etf_holdings.values()
-        ]
-        try:
-            logger.info("Inserting into etf_holdings_table.")
-            # parameters to insert the scraped data into `etf_holdings_table`
-            self.execute_query_over_many_arguments(
-                f"""INSERT INTO etf_holdings_table 
-                (Date, ETF_ticker_ID, Holding_ID, Holding_Weight)
-                VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
-                """,
-                holdings
-            )
-            logger.info("Inserted into etf_holdings_table.")
-        except Exception as e:
-            logger.warning(e)
-            # TODO: consider replacing this with a rollback 
-            self.execute_query(
-                f"DELETE FROM etf_ticker_table WHERE ETF_ticker = {self.__placeholder};",
-                etf_ticker
-            )
-        finally:
-            return holdings
+    def insert_holdings_records(self, cur: Any, holdings: List[Tuple[date, int, int, float]]) -> None:
+        """Streams the `(Date, ETF_ticker_ID, Holding_ID, Holding_Weight)` records in `holdings`
+        into `etf_holdings_table` with `COPY ... FROM STDIN`, using the cursor `cur`."""
+        buffer = StringIO()
+        csv.writer(buffer).writerows(holdings)
+        buffer.seek(0)
+        cur.copy_expert(
+            """COPY etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight) 
+            FROM STDIN WITH (FORMAT csv);
+            """,
+            buffer
+        )
 
-    @lru_cache(maxsize = None)
+    @cached_holdings
     def get_holdings_and_weights_for_etf(   self, 
                                             etf_ticker: str,
                                             date_: date = None) -> List[Tuple[datetime.date, str, str, float]]:  
-        """LRU-cached method to fetch holding and weights data for the 
+        """Cached (see `src.cache.cached_holdings`) method to fetch holding and weights data for the 
         ETF specified by the `etf_name` ticker from the TinyDB database. 
         If no data for said ETF is present, this function will attempt to scrape
         (see `..scraping.scrape_etf_holdings`) and insert it into the TinyDB database.
@@ -245,8 +294,7 @@ class PostgresDatabaseClient(SQLDatabaseClient):
 
         query = f"""SELECT major.Date, minor.ETF_ticker, other.Holding, major.Holding_Weight 
         FROM (
-            select etf_holdings_table.* from etf_holdings_table where ETF_ticker_ID = {self.__placeholder} 
-            and Date = {self.__placeholder} 
+            {self.holdings_records_query(per_etf=True)}
         ) as major 
         INNER JOIN etf_ticker_table as minor on major.ETF_ticker_ID = minor.ETF_ticker_ID 
         LEFT JOIN holdings_table as other on major.Holding_ID = other.Holding_ID;
@@ -281,7 +329,7 @@ class PostgresDatabaseClient(SQLDatabaseClient):
         else:
             holdings: List[Tuple[datetime.date, str, str, float]] = self.execute_query(
                 query, 
-                (etf_ticker_id, date_)
+                (date_, etf_ticker_id)
             )
             try:
                 assert len(holdings) > 0
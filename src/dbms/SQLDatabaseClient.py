@@ -1,22 +1,109 @@
 
 # standard library dependencies
+import os
 import abc
+import math
+import logging
+import threading
+logger = logging.getLogger(f"mainLogger.SQLDatabaseClient")
 from datetime import datetime, date
 from functools import lru_cache
-from typing import List, Union, Tuple, Mapping, Any, Iterable
+from typing import List, Union, Tuple, Mapping, Any, Iterable, ContextManager, Set
+
+# external dependencies
+import numpy as np
 
 # local dependencies
-from ..scraping import scrape_etf_holdings
+from ..scraping import scrape_etf_holdings, scrape_etfs_holdings
+from ..holdings import HoldingsMatrix, HoldingsHistory
+from ..cache import get_holdings_cache, get_shared_cache
+from ..utils import SUPPORTED_DISTANCE_MEASURES, get_similarity_matrices, get_run_boundaries
+from ..minhash import (
+    MinHasher,
+    WeightedMinHasher,
+    optimal_bands,
+    band_buckets,
+    estimate_similarity,
+    signature_to_bytes,
+    signature_from_bytes
+)
+
+# process-wide caches mapping holding tickers to their `Holding_ID`, one per database;
+# IDs never change once committed, so the caches never need to be invalidated
+_holding_id_caches: Mapping[str, Mapping[str, int]] = dict()
+_holding_id_caches_lock = threading.Lock()
+
+def get_holding_id_cache(database_key: str = None) -> Mapping[str, int]:
+    """Returns the process-wide holding ticker -> ID cache for the database identified by 
+    `database_key` (a new, unshared cache if `database_key` is None)."""
+    if database_key is None:
+        return dict()
+    with _holding_id_caches_lock:
+        return _holding_id_caches.setdefault(database_key, dict())
+
+def changed_holdings(   current: Mapping[int, float],
+                        new: Mapping[int, float],
+                        rel_tol: float = 1e-6) -> Tuple[Set[int], Set[int]]:
+    """Compares two holdings (mapping `Holding_ID` to weight) of the same ETF.
+
+    Returns
+    -------
+    Tuple[Set[int], Set[int]]
+        The IDs of the `current` holdings that were removed from `new` or whose weight changed 
+        (by more than `rel_tol`), and the IDs of the `new` holdings that were added or whose weight changed.
+
+    Examples
+    --------
+    >>> changed_holdings({1: 0.5, 2: 0.5}, {1: 0.5, 3: 0.25, 2: 0.25})
+    ({2}, {2, 3})
+    >>> changed_holdings({1: 0.5}, {1: 0.5 + 1e-9})
+    (set(), set())
+    """
+    closed = { 
+        holding_id for holding_id, weight in current.items() 
+        if holding_id not in new or not math.isclose(weight, new[holding_id], rel_tol=rel_tol)
+    }
+    opened = { holding_id for holding_id in new.keys() if holding_id not in current or holding_id in closed }
+    return closed, opened
 
 
 class SQLDatabaseClient(abc.ABC):
     """Base class for SQL-based database management system client classes"""
-    def __init__(self, dbms: str = "sqlite3"):
+    # number of permutations used by the MinHash signatures; 
+    # larger values make the similarity estimates more accurate (and the signatures larger)
+    minhash_num_perm: int = 128
+    # similarity threshold around which the LSH banding is tuned
+    lsh_threshold: float = 0.5
+    # maximal number of values bound to the `IN (...)` list of a single query
+    # (SQLite3 builds prior to 3.32 cap the number of parameters at 999)
+    max_query_parameters: int = 500
+    # how the daily holdings are stored, which must be the same for all the clients of a database:
+    # 'snapshots' stores every holding of every ETF every day in `etf_holdings_table`, while
+    # 'intervals' stores one row per holding and period of constant weight in `etf_holding_intervals_table`,
+    # plus one row per ETF and date in `etf_snapshot_dates_table` (see `compact_holdings_history`).
+    # This is only the default of new databases: the mode stored in the database wins (see `load_holdings_history`)
+    holdings_history: str = "snapshots"
+    # relative weight changes below which a holding is considered unchanged in 'intervals' mode
+    # (Postgres `real` columns only keep about 7 significant digits anyway)
+    weight_rel_tol: float = 1e-6
+
+    def __init__(self, dbms: str = "sqlite3", database_key: str = None):
         dbms = dbms.lower()
         assert dbms in ("postgres", "sqlite3"), \
             f"SQLDatabaseClient only supports 'postgres' and 'sqlite3'; {dbms} is unsupported at the moment."
         self.__dbms = dbms
         self.__placeholder = '%s' if self.__dbms == 'postgres' else '?'
+        assert self.holdings_history in ("snapshots", "intervals"), \
+            f"holdings_history should be either 'snapshots' or 'intervals', not {self.holdings_history}"
+        self.minhasher = MinHasher(num_perm=self.minhash_num_perm)
+        self.weighted_minhasher = WeightedMinHasher(num_perm=self.minhash_num_perm)
+        self.lsh_bands, self.lsh_rows = optimal_bands(self.minhash_num_perm, self.lsh_threshold)
+        # holding ticker -> `Holding_ID`, shared by the clients of the same database
+        self.holding_ids: Mapping[str, int] = get_holding_id_cache(database_key)
+        # holdings of each (ETF, date), see `src.cache.cached_holdings`
+        self.holdings_cache = get_holdings_cache(database_key)
+        # holdings snapshots and similarity matrices shared with the other processes, see `src.cache.SharedCache`
+        self.shared_cache = get_shared_cache(database_key or dbms)
 
     @property
     def today(self) -> datetime.date:
@@ -29,6 +116,30 @@ class SQLDatabaseClient(abc.ABC):
     @abc.abstractclassmethod
     def execute_query_over_many_arguments(self, query: str, args: Iterable[Any]):
         pass
+
+    @abc.abstractmethod
+    def transaction(self) -> ContextManager[Any]:
+        """Context manager yielding a cursor whose queries are committed together 
+        when the context exits, or rolled back if it exits with an exception."""
+        pass
+
+    @abc.abstractmethod
+    def insert_and_fetch_holding_ids(self, cur: Any, holding_tickers: List[str]) -> Mapping[str, int]:
+        """Inserts the (distinct) `holding_tickers` missing from `holdings_table` and returns
+        the `Holding_ID` of every ticker in `holding_tickers`, using the cursor `cur`."""
+        pass
+
+    @abc.abstractmethod
+    def insert_etf_ticker(self, cur: Any, etf_ticker: str) -> int:
+        """Inserts `etf_ticker` into `etf_ticker_table` (unless already present) and returns
+        its `ETF_ticker_ID`, using the cursor `cur`."""
+        pass
+
+    @abc.abstractmethod
+    def insert_holdings_records(self, cur: Any, holdings: List[Tuple[date, int, int, float]]) -> None:
+        """Inserts the `(Date, ETF_ticker_ID, Holding_ID, Holding_Weight)` records in `holdings`
+        into `etf_holdings_table`, using the cursor `cur`."""
+        pass
     
     @abc.abstractproperty
     def holdings_table_creation_query(self) -> str:
@@ -41,6 +152,28 @@ class SQLDatabaseClient(abc.ABC):
     @abc.abstractproperty
     def etf_table_creation_query(self) -> str:
         pass
+
+    @abc.abstractproperty
+    def minhash_table_creation_query(self) -> str:
+        pass
+
+    @abc.abstractproperty
+    def lsh_bucket_table_creation_query(self) -> str:
+        pass
+
+    @abc.abstractproperty
+    def similarity_table_creation_query(self) -> str:
+        pass
+
+    @abc.abstractproperty
+    def schema_migrations_table_creation_query(self) -> str:
+        pass
+
+    @abc.abstractproperty
+    def schema_migrations(self) -> List[Tuple[int, str, List[str]]]:
+        """Ordered list of (version, description, queries) tuples upgrading the 
+        schema of existing databases (see `migrate`); versions must never be reused."""
+        pass
     
     def create_holdings_table(self) -> None:
         self.execute_query(self.holdings_table_creation_query)
@@ -51,11 +184,136 @@ class SQLDatabaseClient(abc.ABC):
     def create_etf_table(self) -> None:
         self.execute_query(self.etf_table_creation_query)
 
+    def create_minhash_tables(self) -> None:
+        self.execute_query(self.minhash_table_creation_query)
+        self.execute_query(self.lsh_bucket_table_creation_query)
+
+    def create_similarity_table(self) -> None:
+        self.execute_query(self.similarity_table_creation_query)
+
     def setup(self) -> None:
         """Convenience method to setup the database and required tables"""
         self.create_holdings_table()
         self.create_etf_ticker_table()
         self.create_etf_table()
+        self.create_minhash_tables()
+        self.create_similarity_table()
+        self.migrate()
+        self.load_holdings_history()
+
+    def get_applied_migrations(self) -> List[int]:
+        """Returns the versions of the schema migrations applied to the database."""
+        return sorted( version for (version,) in self.execute_query("SELECT Version FROM schema_migrations_table;") )
+
+    def migrate(self) -> List[int]:
+        """Applies the schema migrations (see `schema_migrations`) that haven't been applied 
+        to the database yet, each within its own transaction, and records them in `schema_migrations_table`.
+
+        Returns
+        -------
+        List[int]
+            The versions of the migrations applied by this call.
+        """
+        self.execute_query(self.schema_migrations_table_creation_query)
+        applied_migrations = set(self.get_applied_migrations())
+        newly_applied: List[int] = []
+        for version, description, queries in self.schema_migrations:
+            if version in applied_migrations:
+                continue
+            logger.info(f"Applying schema migration {version}: {description}")
+            try:
+                with self.transaction() as cur:
+                    for query in queries:
+                        cur.execute(query)
+                    cur.execute(
+                        f"INSERT INTO schema_migrations_table (Version, Description) VALUES ({self.__placeholder}, {self.__placeholder});",
+                        (version, description)
+                    )
+            except Exception as error_in_migration:
+                # another process may have applied the same migration concurrently
+                if version in self.get_applied_migrations():
+                    logger.info(f"Schema migration {version} was applied concurrently")
+                    continue
+                raise error_in_migration
+            newly_applied.append(version)
+        return newly_applied
+
+    def get_setting(self, setting: str) -> Union[str, None]:
+        """Returns the value of `setting` stored in `settings_table`, or None if it isn't set."""
+        rows = self.execute_query(f"SELECT Value FROM settings_table WHERE Setting = {self.__placeholder};", (setting,))
+        return rows[0][0] if rows else None
+
+    def set_setting(self, cur: Any, setting: str, value: str, overwrite: bool = True) -> None:
+        """Stores the `value` of `setting` in `settings_table` using the cursor `cur`,
+        leaving an existing value untouched unless `overwrite`."""
+        cur.execute(
+            f"""INSERT INTO settings_table (Setting, Value) VALUES ({self.__placeholder}, {self.__placeholder})
+            ON CONFLICT (Setting) DO {"UPDATE SET Value = excluded.Value" if overwrite else "NOTHING"};
+            """,
+            (setting, value)
+        )
+
+    def load_holdings_history(self) -> str:
+        """Switches the client to the `holdings_history` mode stored in the database, such that 
+        all of its clients read and write the holdings the same way whatever their class default.
+        Databases without a stored mode get the one their holdings were written in, or the 
+        client's own if they don't have any holdings yet.
+
+        Returns
+        -------
+        str
+            The holdings history mode of the database.
+        """
+        holdings_history = self.get_setting("holdings_history")
+        if holdings_history is None:
+            if self.execute_query("SELECT 1 FROM etf_snapshot_dates_table LIMIT 1;"):
+                holdings_history = "intervals"
+            elif self.execute_query("SELECT 1 FROM etf_holdings_table LIMIT 1;"):
+                holdings_history = "snapshots"
+            else:
+                holdings_history = self.holdings_history
+            with self.transaction() as cur:
+                # another client may have stored its mode concurrently
+                self.set_setting(cur, "holdings_history", holdings_history, overwrite=False)
+            holdings_history = self.get_setting("holdings_history")
+        if holdings_history != self.holdings_history:
+            logger.warning(
+                f"The database stores its holdings as {holdings_history}, not {self.holdings_history}; "
+                "see `compact_holdings_history` to convert snapshots into intervals."
+            )
+            self.holdings_history = holdings_history
+        return holdings_history
+
+    def holdings_records_query(self, per_etf: bool = False, date_range: bool = False) -> str:
+        """Returns the query selecting the `(Date, ETF_ticker_ID, Holding_ID, Holding_Weight)` records
+        of all ETFs on the date bound to its first placeholder (or between the dates bound to its first two 
+        placeholders if `date_range`), or only those of the ETF whose ID is bound to the next placeholder 
+        if `per_etf`. The records are reconstructed from the intervals in 'intervals' mode (see `holdings_history`)."""
+        date_condition = f"between {self.__placeholder} and {self.__placeholder}" if date_range else f"= {self.__placeholder}"
+        if self.holdings_history == "snapshots":
+            query = f"""select etf_holdings_table.Date, etf_holdings_table.ETF_ticker_ID, 
+            etf_holdings_table.Holding_ID, etf_holdings_table.Holding_Weight 
+            from etf_holdings_table where Date {date_condition}"""
+            return f"{query} and ETF_ticker_ID = {self.__placeholder}" if per_etf else query
+        query = f"""select dates.Date, dates.ETF_ticker_ID, intervals.Holding_ID, intervals.Holding_Weight 
+            from etf_snapshot_dates_table as dates 
+            inner join etf_holding_intervals_table as intervals on intervals.ETF_ticker_ID = dates.ETF_ticker_ID 
+            and intervals.Valid_From <= dates.Date and (intervals.Valid_To is null or intervals.Valid_To > dates.Date) 
+            where dates.Date {date_condition}"""
+        return f"{query} and dates.ETF_ticker_ID = {self.__placeholder}" if per_etf else query
+
+    def get_latest_holdings_date(self, before: date = None) -> Union[None, date]:
+        """Returns the latest date with holdings data in the database, or only among the dates
+        strictly earlier than `before` (None if there isn't any)."""
+        table = "etf_holdings_table" if self.holdings_history == "snapshots" else "etf_snapshot_dates_table"
+        if before is None:
+            latest = self.execute_query(f"SELECT MAX(Date) FROM {table};")[0][0]
+        else:
+            latest = self.execute_query(f"SELECT MAX(Date) FROM {table} WHERE Date < {self.__placeholder};", (before,))[0][0]
+        if isinstance(latest, str):
+            # SQLite3 doesn't parse the result of aggregate functions
+            latest = date.fromisoformat(latest)
+        return latest
 
     def get_known_etfs(self) -> List[str]:
         """Returns the list of known ETFs in the database."""
@@ -114,22 +372,852 @@ class SQLDatabaseClient(abc.ABC):
             Numerical ID associated with `holding_ticker`
         """
         holding_ticker = holding_ticker.upper()
+        return self.resolve_holding_ids([holding_ticker])[holding_ticker]
+
+    def resolve_holding_ids(self,
+                            holding_tickers: Iterable[str],
+                            cur: Any = None) -> Mapping[str, int]:
+        """Returns the numerical IDs associated with all the provided `holding_tickers`, 
+        inserting the ones missing from `holdings_table` in bulk (see `insert_and_fetch_holding_ids`).
+        Tickers whose ID is already in `holding_ids` don't hit the database at all.
+
+        Parameters
+        ----------
+        holding_tickers : Iterable[str]
+            Tickers for the holdings of interest.
+        cur : Any, optional
+            Cursor of an ongoing transaction (see `transaction`) to run the queries with. 
+            By default None, in which case the queries run in (and get committed by) their own transaction.
+            Since the transaction of `cur` could still be rolled back, the IDs it resolves 
+            are only cached once the caller adds them to `holding_ids` after committing.
+
+        Returns
+        -------
+        Mapping[str, int]
+            Dictionary mapping each of the `holding_tickers` to its numerical ID.
+        """
+        holding_tickers = list(dict.fromkeys(holding_tickers))
+        holding_ids = { 
+            holding_ticker: self.holding_ids[holding_ticker]
+            for holding_ticker in holding_tickers
+            if holding_ticker in self.holding_ids 
+        }
+        missing_tickers = [ holding_ticker for holding_ticker in holding_tickers if holding_ticker not in holding_ids ]
+        if len(missing_tickers) == 0:
+            return holding_ids
+        if cur is not None:
+            holding_ids.update(self.insert_and_fetch_holding_ids(cur, missing_tickers))
+            return holding_ids
+        with self.transaction() as cur:
+            fetched_ids = self.insert_and_fetch_holding_ids(cur, missing_tickers)
+        self.holding_ids.update(fetched_ids)
+        holding_ids.update(fetched_ids)
+        return holding_ids
+
+    def insert_etfs_holding_data(   self,
+                                    etfs_holdings: Mapping[str, Mapping[str, Mapping[str, float]]],
+                                    date_: date = None) -> Mapping[str, List[Tuple[datetime.date, int, int, float]]]:
+        """Method handling everything required to handle the data scraped for 
+        several ETFs and insert it into the database as today's holdings (or `date_`'s).
+        The holding tickers of all ETFs are resolved at once (see `resolve_holding_ids`) and 
+        everything, including the MinHash signatures (see `insert_minhash_signatures`), 
+        is inserted within a single transaction. If that transaction fails, 
+        the ETFs are inserted one by one so that one bad ETF doesn't discard the others.
+
+        Parameters
+        ----------
+        etfs_holdings : Mapping[str, Mapping[str, Mapping[str, float]]]
+            Dictionary mapping ETF tickers to the holdings data that was scraped for them
+            (see `..scraping.scrape_etfs_holdings`).
+        date_ : date, optional
+            `datetime.date` object representing the date of the holdings.
+            Defaults None, which gets replaced by today's date. In 'intervals' mode (see `holdings_history`),
+            dates must be inserted in increasing order.
+
+        Returns
+        -------
+        Mapping[str, List[Tuple[datetime.date, int, int, float]]]
+            Dictionary mapping the (upper-case) tickers of the ETFs that were inserted 
+            to their list of holdings records.
+        """
+        if date_ is None:
+            date_ = self.today
+        etfs_holdings = { etf_ticker.upper(): etf_holdings for etf_ticker, etf_holdings in etfs_holdings.items() }
+        for etf_ticker in [ etf_ticker for etf_ticker, etf_holdings in etfs_holdings.items() if len(etf_holdings) == 0 ]:
+            logger.warning(f"No holdings were given for {etf_ticker}; No updates to be made.")
+            del etfs_holdings[etf_ticker]
+        if len(etfs_holdings) == 0:
+            return dict()
+
+        etf_ticker_ids: Mapping[str, int] = dict()
+        inserted: Mapping[str, List[Tuple[datetime.date, int, int, float]]] = dict()
         try:
-            holding_id: int = self.execute_query(
-                f"SELECT Holding_ID from holdings_table where Holding = {self.__placeholder};",
-                (holding_ticker,)
-            )[0][0]
-            return holding_id
-        except Exception as not_in_table_yet:
-            self.execute_query(
-                f"INSERT INTO holdings_table (Holding) VALUES ({self.__placeholder});",
-                (holding_ticker,)
+            # computed up front, such that the signatures are stored (or rolled back) along with the holdings
+            signatures = { etf_ticker: self.compute_minhash_signatures(etf_holdings) for etf_ticker, etf_holdings in etfs_holdings.items() }
+            with self.transaction() as cur:
+                logger.info("Inserting holding tickers.")
+                holding_ids = self.resolve_holding_ids(
+                    [ holding_ticker for etf_holdings in etfs_holdings.values() for holding_ticker in etf_holdings.keys() ],
+                    cur
+                )
+                for etf_ticker, etf_holdings in etfs_holdings.items():
+                    for holding_ticker, holding_dict in etf_holdings.items():
+                        # keeping `holding_ticker` and `holding_ticker_id` together is
+                        # useful for future reference
+                        holding_dict['holding_ticker_id'] = holding_ids[holding_ticker]
+                    etf_ticker_ids[etf_ticker] = self.insert_etf_ticker(cur, etf_ticker)
+                    inserted[etf_ticker] = [
+                        (date_, etf_ticker_ids[etf_ticker], holding_dict['holding_ticker_id'], holding_dict['weight'])
+                        for holding_dict in etf_holdings.values()
+                    ]
+                    if self.holdings_history == "snapshots":
+                        logger.info("Inserting into etf_holdings_table.")
+                        self.insert_holdings_records(cur, inserted[etf_ticker])
+                    else:
+                        self.update_holdings_intervals(cur, etf_ticker_ids[etf_ticker], inserted[etf_ticker], date_)
+                self.insert_minhash_signatures(
+                    cur, 
+                    { etf_ticker_ids[etf_ticker]: etf_signatures for etf_ticker, etf_signatures in signatures.items() }, 
+                    date_
+                )
+            logger.info(f"Inserted {sum(map(len, inserted.values()))} holdings for {len(inserted)} ETFs.")
+        except Exception as error_in_insertion:
+            logger.warning(f"Caught error in inserting {', '.join(etfs_holdings.keys())}; rolled back: {error_in_insertion}")
+            if len(etfs_holdings) == 1:
+                return dict()
+            inserted = dict()
+            for etf_ticker, etf_holdings in etfs_holdings.items():
+                inserted.update(self.insert_etfs_holding_data({ etf_ticker: etf_holdings }, date_))
+            return inserted
+        # the new IDs are only cached once committed
+        self.holding_ids.update(holding_ids)
+        for etf_ticker, etf_holdings in etfs_holdings.items():
+            self.holdings_cache.invalidate(etf_ticker, date_)
+            self.shared_cache.invalidate_holdings(etf_ticker, date_)
+        return inserted
+
+    def insert_etf_holding_data(self,
+                                etf_ticker: str,
+                                etf_holdings: Mapping[str, Mapping[str, float]]) -> Union[None,List[Tuple[datetime.date, int, int, float]]]:
+        """Method handling everything required to handle the data
+        scraped for the specified ETF and insert it into the database
+        (see `insert_etfs_holding_data`).
+
+        Parameters
+        ----------
+        etf_ticker : str
+            ETF of interest.
+        etf_holdings: Mapping[str, Mapping[str, float]]
+            The holdings data that was scraped for the ETF.
+        
+        Returns
+        -------
+        Union[None,List[Tuple[datetime.date, int, int, float]]]
+            Either None (if no scraping data was provided or the insertion failed) 
+            or the list of holdings records for the ETF.
+        """
+        return self.insert_etfs_holding_data({ etf_ticker: etf_holdings }).get(etf_ticker.upper())
+
+    def update_holdings_intervals(  self,
+                                    cur: Any,
+                                    etf_ticker_id: int,
+                                    holdings: List[Tuple[date, int, int, float]],
+                                    date_: date = None) -> None:
+        """Records today's (or `date_`'s) `(Date, ETF_ticker_ID, Holding_ID, Holding_Weight)` records in `holdings` 
+        in 'intervals' mode (see `holdings_history`), using the cursor `cur`: the open intervals of the holdings 
+        that were removed or whose weight changed are closed, new intervals are opened for the holdings that were
+        added or whose weight changed, and the date is added to the ETF's dates in `etf_snapshot_dates_table`.
+        Unchanged holdings don't write anything."""
+        if date_ is None:
+            date_ = self.today
+        cur.execute(
+            f"""SELECT Holding_ID, Holding_Weight, Valid_From FROM etf_holding_intervals_table 
+            WHERE ETF_ticker_ID = {self.__placeholder} AND Valid_To IS NULL;
+            """,
+            (etf_ticker_id,)
+        )
+        open_intervals = { holding_id: (holding_weight, valid_from) for holding_id, holding_weight, valid_from in cur.fetchall() }
+        new = { holding_id: holding_weight for (_, _, holding_id, holding_weight) in holdings }
+        closed, opened = changed_holdings(
+            { holding_id: holding_weight for holding_id, (holding_weight, _) in open_intervals.items() }, 
+            new, 
+            self.weight_rel_tol
+        )
+        # intervals opened on the same date (i.e. the ETF is inserted again) are replaced rather than closed
+        replaced = [ holding_id for holding_id in closed if open_intervals[holding_id][1] == date_ ]
+        cur.executemany(
+            f"""DELETE FROM etf_holding_intervals_table 
+            WHERE ETF_ticker_ID = {self.__placeholder} AND Holding_ID = {self.__placeholder} AND Valid_From = {self.__placeholder};
+            """,
+            [ (etf_ticker_id, holding_id, date_) for holding_id in replaced ]
+        )
+        cur.executemany(
+            f"""UPDATE etf_holding_intervals_table SET Valid_To = {self.__placeholder} 
+            WHERE ETF_ticker_ID = {self.__placeholder} AND Holding_ID = {self.__placeholder} AND Valid_To IS NULL;
+            """,
+            [ (date_, etf_ticker_id, holding_id) for holding_id in closed.difference(replaced) ]
+        )
+        cur.executemany(
+            f"""INSERT INTO etf_holding_intervals_table (ETF_ticker_ID, Holding_ID, Holding_Weight, Valid_From)
+            VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
+            """,
+            [ (etf_ticker_id, holding_id, new[holding_id], date_) for holding_id in sorted(opened) ]
+        )
+        cur.execute(
+            f"DELETE FROM etf_snapshot_dates_table WHERE Date = {self.__placeholder} AND ETF_ticker_ID = {self.__placeholder};",
+            (date_, etf_ticker_id)
+        )
+        cur.execute(
+            f"INSERT INTO etf_snapshot_dates_table (Date, ETF_ticker_ID) VALUES ({self.__placeholder}, {self.__placeholder});",
+            (date_, etf_ticker_id)
+        )
+        logger.info(f"Closed {len(closed)} and opened {len(opened)} holdings intervals for ETF ID {etf_ticker_id}.")
+
+    def compact_holdings_history(self) -> int:
+        """Converts the daily snapshots stored in `etf_holdings_table` into intervals 
+        (see `holdings_history`), one ETF (and transaction) at a time, and deletes them.
+        Meant to be run once, when switching an existing database to 'intervals' mode;
+        ETFs that already have intervals are left untouched. The database (and this client) 
+        are switched to 'intervals' mode first, such that its other clients read the intervals 
+        once they're reloaded (see `load_holdings_history`).
+
+        Returns
+        -------
+        int
+            The number of intervals inserted.
+        """
+        with self.transaction() as cur:
+            self.set_setting(cur, "holdings_history", "intervals")
+        self.holdings_history = "intervals"
+        n_intervals = 0
+        etf_ticker_ids = self.execute_query("SELECT DISTINCT ETF_ticker_ID FROM etf_holdings_table;")
+        for (etf_ticker_id,) in etf_ticker_ids:
+            with self.transaction() as cur:
+                cur.execute(
+                    f"SELECT COUNT(*) FROM etf_snapshot_dates_table WHERE ETF_ticker_ID = {self.__placeholder};",
+                    (etf_ticker_id,)
+                )
+                if cur.fetchall()[0][0] > 0:
+                    logger.warning(f"ETF ID {etf_ticker_id} already has intervals; its snapshots were not compacted.")
+                    continue
+                cur.execute(
+                    f"""SELECT Date, Holding_ID, Holding_Weight FROM etf_holdings_table 
+                    WHERE ETF_ticker_ID = {self.__placeholder} ORDER BY Date;
+                    """,
+                    (etf_ticker_id,)
+                )
+                snapshots: Mapping[date, Mapping[int, float]] = dict()
+                for date_, holding_id, holding_weight in cur.fetchall():
+                    snapshots.setdefault(date_, dict())[holding_id] = holding_weight
+                open_intervals: Mapping[int, Tuple[float, date]] = dict()
+                intervals: List[Tuple[int, int, float, date, date]] = []
+                for date_, snapshot in snapshots.items():
+                    closed, opened = changed_holdings(
+                        { holding_id: holding_weight for holding_id, (holding_weight, _) in open_intervals.items() },
+                        snapshot,
+                        self.weight_rel_tol
+                    )
+                    for holding_id in closed:
+                        holding_weight, valid_from = open_intervals.pop(holding_id)
+                        intervals.append((etf_ticker_id, holding_id, holding_weight, valid_from, date_))
+                    for holding_id in opened:
+                        open_intervals[holding_id] = (snapshot[holding_id], date_)
+                intervals.extend(
+                    (etf_ticker_id, holding_id, holding_weight, valid_from, None) 
+                    for holding_id, (holding_weight, valid_from) in open_intervals.items()
+                )
+                cur.executemany(
+                    f"""INSERT INTO etf_holding_intervals_table (ETF_ticker_ID, Holding_ID, Holding_Weight, Valid_From, Valid_To)
+                    VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
+                    """,
+                    intervals
+                )
+                cur.executemany(
+                    f"INSERT INTO etf_snapshot_dates_table (Date, ETF_ticker_ID) VALUES ({self.__placeholder}, {self.__placeholder});",
+                    [ (date_, etf_ticker_id) for date_ in snapshots.keys() ]
+                )
+                cur.execute(
+                    f"DELETE FROM etf_holdings_table WHERE ETF_ticker_ID = {self.__placeholder};",
+                    (etf_ticker_id,)
+                )
+            n_intervals += len(intervals)
+        logger.info(f"Compacted the snapshots of {len(etf_ticker_ids)} ETFs into {n_intervals} intervals.")
+        return n_intervals
+
+    def copy_holdings_forward(  self,
+                                etf_tickers: Iterable[str]) -> List[str]:
+        """Copies the latest holdings (and MinHash signatures) stored for each of `etf_tickers`
+        to today's date, for ETFs whose provider file hasn't changed (see `..scraping.ResponseStore`).
+        The rows are copied within the database with one `INSERT ... SELECT` per table 
+        (and batch of `max_query_parameters` tickers), in a single transaction.
+        In 'intervals' mode (see `holdings_history`), only today's date is added for each ETF.
+
+        Parameters
+        ----------
+        etf_tickers : Iterable[str]
+            Tickers for the ETFs of interest.
+
+        Returns
+        -------
+        List[str]
+            The (upper-case) tickers of the ETFs that have holdings for today's date afterwards;
+            the others had no holdings stored before today.
+        """
+        etf_tickers = sorted(set( etf_ticker.upper() for etf_ticker in etf_tickers ))
+        copied: List[str] = []
+        dates_table, holdings_columns = (
+            ("etf_holdings_table", ["Holding_ID", "Holding_Weight"]) if self.holdings_history == "snapshots" 
+            else ("etf_snapshot_dates_table", [])
+        )
+        with self.transaction() as cur:
+            for start in range(0, len(etf_tickers), self.max_query_parameters):
+                batch = etf_tickers[start:start + self.max_query_parameters]
+                ticker_placeholders = ", ".join([self.__placeholder] * len(batch))
+                for table, columns in (
+                    (dates_table, holdings_columns),
+                    ("etf_minhash_table", ["Weighted", "Signature"]),
+                    ("etf_lsh_bucket_table", ["Weighted", "Band", "Bucket"]),
+                ):
+                    cur.execute(
+                        f"""INSERT INTO {table} ({", ".join(["Date", "ETF_ticker_ID", *columns])})
+                        SELECT {", ".join([self.__placeholder, "major.ETF_ticker_ID", *( f"major.{column}" for column in columns )])}
+                        FROM {table} AS major
+                        INNER JOIN etf_ticker_table AS minor ON major.ETF_ticker_ID = minor.ETF_ticker_ID
+                        WHERE minor.ETF_ticker IN ({ticker_placeholders})
+                        AND major.Date = (
+                            SELECT MAX(latest.Date) FROM {table} AS latest 
+                            WHERE latest.ETF_ticker_ID = major.ETF_ticker_ID AND latest.Date < {self.__placeholder}
+                        )
+                        AND NOT EXISTS (
+                            SELECT 1 FROM {table} AS existing 
+                            WHERE existing.ETF_ticker_ID = major.ETF_ticker_ID AND existing.Date = {self.__placeholder}
+                        );
+                        """,
+                        (self.today, *batch, self.today, self.today)
+                    )
+                cur.execute(
+                    f"""SELECT DISTINCT minor.ETF_ticker
+                    FROM {dates_table} AS major
+                    INNER JOIN etf_ticker_table AS minor ON major.ETF_ticker_ID = minor.ETF_ticker_ID
+                    WHERE major.Date = {self.__placeholder} AND minor.ETF_ticker IN ({ticker_placeholders});
+                    """,
+                    (self.today, *batch)
+                )
+                copied.extend( etf_ticker for (etf_ticker,) in cur.fetchall() )
+        for etf_ticker in copied:
+            self.holdings_cache.invalidate(etf_ticker, self.today)
+            self.shared_cache.invalidate_holdings(etf_ticker, self.today)
+        logger.info(f"Copied the latest holdings of {len(copied)}/{len(etf_tickers)} unchanged ETFs to {self.today}.")
+        return sorted(copied)
+
+    def compute_minhash_signatures( self,
+                                    etf_holdings: Mapping[str, Mapping[str, float]]) -> Mapping[bool, np.ndarray]:
+        """Returns the unweighted (key: False) and weighted (key: True) MinHash signatures
+        of the holdings in `etf_holdings`."""
+        return {
+            False: self.minhasher.signature(etf_holdings.keys()),
+            True: self.weighted_minhasher.signature({
+                holding: holding_dict['weight'] 
+                for holding, holding_dict in etf_holdings.items()
+            })
+        }
+
+    def insert_minhash_signatures(  self,
+                                    cur: Any,
+                                    signatures: Mapping[int, Mapping[bool, np.ndarray]],
+                                    date_: date) -> None:
+        """Replaces the MinHash signatures (along with their LSH buckets) stored in `etf_minhash_table` 
+        and `etf_lsh_bucket_table` for `date_` by `signatures`, using the cursor `cur`: one batch of 
+        `DELETE` statements (of `max_query_parameters` ETFs) and one `executemany` per table.
+
+        Parameters
+        ----------
+        cur : Any
+            Cursor of the transaction inserting the corresponding holdings.
+        signatures : Mapping[int, Mapping[bool, np.ndarray]]
+            Signatures of each ETF (see `compute_minhash_signatures`), keyed by `ETF_ticker_ID`.
+        date_ : date
+            `datetime.date` object representing the date of the holdings.
+        """
+        etf_ticker_ids = sorted(signatures.keys())
+        for start in range(0, len(etf_ticker_ids), self.max_query_parameters):
+            batch = etf_ticker_ids[start:start + self.max_query_parameters]
+            for table in ("etf_minhash_table", "etf_lsh_bucket_table"):
+                cur.execute(
+                    f"""DELETE FROM {table} WHERE Date = {self.__placeholder} 
+                    AND ETF_ticker_ID IN ({", ".join([self.__placeholder] * len(batch))});
+                    """,
+                    (date_, *batch)
+                )
+        cur.executemany(
+            f"""INSERT INTO etf_minhash_table (Date, ETF_ticker_ID, Weighted, Signature)
+            VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
+            """,
+            [
+                (date_, etf_ticker_id, int(weighted), signature_to_bytes(signature))
+                for etf_ticker_id in etf_ticker_ids
+                for weighted, signature in signatures[etf_ticker_id].items()
+            ]
+        )
+        cur.executemany(
+            f"""INSERT INTO etf_lsh_bucket_table (Date, Weighted, Band, Bucket, ETF_ticker_ID)
+            VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
+            """,
+            [
+                (date_, int(weighted), band, bucket, etf_ticker_id)
+                for etf_ticker_id in etf_ticker_ids
+                for weighted, signature in signatures[etf_ticker_id].items()
+                for band, bucket in enumerate(band_buckets(signature, self.lsh_bands, self.lsh_rows))
+            ]
+        )
+
+    def find_similar_etfs(  self,
+                            etf_ticker: str,
+                            threshold: float = 0.8,
+                            date_: date = None,
+                            weighted: bool = False) -> List[Tuple[str, float]]:
+        """Approximate, sub-linear lookup of the ETFs whose (weighted) Jaccard similarity 
+        with `etf_ticker` is estimated to be >= `threshold`, using the LSH buckets 
+        stored in `etf_lsh_bucket_table`.
+
+        Parameters
+        ----------
+        etf_ticker : str
+            ETF ticker of interest.
+        threshold : float, optional
+            Minimal estimated similarity of the returned ETFs, by default 0.8.
+            Thresholds well below `lsh_threshold` will miss some ETFs.
+        date_ : date, optional
+            `datetime.date` object representing the date of interest.
+            Defaults None, which gets replaced by today's date.
+        weighted : bool, optional
+            Whether to estimate the weighted Jaccard similarity (True) or the Jaccard similarity (False).
+            By default False.
+
+        Returns
+        -------
+        List[Tuple[str, float]]
+            List of (ETF ticker, estimated similarity) tuples sorted by decreasing similarity
+            (`etf_ticker` itself is excluded).
+        """
+        if date_ is None:
+            date_ = self.today
+        etf_ticker = etf_ticker.upper()
+        etf_ticker_id = self.get_etf_id_for_ticker(etf_ticker)
+        stored_signatures = self.execute_query(
+            f"""SELECT Signature FROM etf_minhash_table 
+            WHERE Date = {self.__placeholder} AND ETF_ticker_ID = {self.__placeholder} AND Weighted = {self.__placeholder};
+            """,
+            (date_, etf_ticker_id, int(weighted))
+        )
+        if len(stored_signatures) > 0:
+            signature = signature_from_bytes(stored_signatures[0][0])
+        else:
+            holdings = self.get_holdings_and_weights_for_etf(etf_ticker, date_)
+            signature = self.compute_minhash_signatures({
+                holding_ticker: dict(weight=holding_weight)
+                for (_, _, holding_ticker, holding_weight) in holdings
+            })[weighted]
+
+        buckets = band_buckets(signature, self.lsh_bands, self.lsh_rows)
+        band_conditions = " OR ".join(
+            [f"(Band = {self.__placeholder} AND Bucket = {self.__placeholder})"] * len(buckets)
+        )
+        candidates = self.execute_query(
+            f"""SELECT minor.ETF_ticker, major.Signature
+            FROM etf_minhash_table AS major
+            INNER JOIN etf_ticker_table AS minor ON major.ETF_ticker_ID = minor.ETF_ticker_ID
+            WHERE major.Date = {self.__placeholder} AND major.Weighted = {self.__placeholder} 
+            AND major.ETF_ticker_ID != {self.__placeholder}
+            AND major.ETF_ticker_ID IN (
+                SELECT DISTINCT ETF_ticker_ID FROM etf_lsh_bucket_table
+                WHERE Date = {self.__placeholder} AND Weighted = {self.__placeholder} AND ({band_conditions})
+            );
+            """,
+            (
+                date_, int(weighted), etf_ticker_id, date_, int(weighted),
+                *[ value for band, bucket in enumerate(buckets) for value in (band, bucket) ]
+            )
+        )
+        similar_etfs = [
+            (candidate_ticker, estimate_similarity(signature, signature_from_bytes(candidate_signature)))
+            for candidate_ticker, candidate_signature in candidates
+        ]
+        return sorted(
+            [ (ticker, similarity) for ticker, similarity in similar_etfs if similarity >= threshold ],
+            key = lambda item: item[1],
+            reverse = True
+        )
+
+    def get_holdings_snapshot(  self, 
+                                date_: date,
+                                etf_tickers: Iterable[str] = None) -> Mapping[str, Mapping[str, Mapping]]:
+        """Returns the holdings data stored for all ETFs (or only for `etf_tickers`)
+        on `date_`, without scraping anything.
+
+        Parameters
+        ----------
+        date_ : date
+            `datetime.date` object representing the date of interest.
+        etf_tickers : Iterable[str], optional
+            Tickers for the ETFs of interest; by default None, which selects all ETFs.
+            The tickers are sent in batches of `max_query_parameters` per `WHERE ETF_ticker IN (...)` query.
+
+        Returns
+        -------
+        Mapping[str, Mapping[str, Mapping]]
+            Dictionary mapping an (upper-cased) ETF ticker (strings) to a sub-dictionary
+            mapping the ETF's holdings (strings) to metadata (e.g. the holding's weight 
+            w.r.t. the ETF); see `get_holdings_and_weights_for_etfs`.
+            ETFs without data on `date_` are absent from the dictionary.
+        """
+        query = f"""SELECT minor.ETF_ticker, other.Holding, major.Holding_Weight 
+            FROM (
+                {self.holdings_records_query()}
+            ) as major 
+            INNER JOIN etf_ticker_table as minor on major.ETF_ticker_ID = minor.ETF_ticker_ID 
+            LEFT JOIN holdings_table as other on major.Holding_ID = other.Holding_ID"""
+        if etf_tickers is None:
+            records = self.execute_query(f"{query};", (date_,))
+        else:
+            etf_tickers = list(dict.fromkeys( etf_ticker.upper() for etf_ticker in etf_tickers ))
+            records = []
+            for start in range(0, len(etf_tickers), self.max_query_parameters):
+                batch = etf_tickers[start:start + self.max_query_parameters]
+                records.extend(self.execute_query(
+                    f"{query} WHERE minor.ETF_ticker IN ({', '.join([self.__placeholder] * len(batch))});",
+                    (date_, *batch)
+                ))
+        snapshot: Mapping[str, Mapping[str, Mapping]] = dict()
+        for etf_ticker, holding_ticker, holding_weight in records:
+            snapshot.setdefault(etf_ticker, dict())[holding_ticker] = dict(weight=holding_weight)
+        return snapshot
+
+    def get_holdings_history(   self,
+                                etf_ticker: str,
+                                start: date,
+                                end: date = None) -> HoldingsHistory:
+        """Returns the holdings stored for `etf_ticker` on every date between `start` and `end` (inclusive)
+        with a single query served by the (ETF, date) indexes, without scraping anything.
+
+        Parameters
+        ----------
+        etf_ticker : str
+            Ticker for the ETF of interest.
+        start : date
+            `datetime.date` object representing the first date of interest.
+        end : date, optional
+            `datetime.date` object representing the last date of interest.
+            Defaults None, which gets replaced by today's date.
+
+        Returns
+        -------
+        HoldingsHistory
+            The (dates x holdings) array of the ETF's holding weights, with one row per date with data.
+
+        Raises
+        ------
+        ValueError
+            If the `etf_ticker` is not present in `etf_ticker_table`.
+        """
+        if end is None:
+            end = self.today
+        etf_ticker = etf_ticker.upper()
+        etf_ticker_id = self.get_etf_id_for_ticker(etf_ticker)
+        records = self.execute_query(
+            f"""SELECT major.Date, other.Holding, major.Holding_Weight 
+            FROM (
+                {self.holdings_records_query(per_etf=True, date_range=True)}
+            ) as major 
+            LEFT JOIN holdings_table as other on major.Holding_ID = other.Holding_ID;
+            """,
+            (start, end, etf_ticker_id)
+        )
+        return HoldingsHistory.from_records(etf_ticker, records)
+
+    def export_holdings(self,
+                        directory: str,
+                        start: date = None,
+                        end: date = None) -> int:
+        """Exports the holdings stored on every date between `start` and `end` (inclusive) to Parquet files
+        partitioned by date, i.e. `<directory>/Date=<yyyy-mm-dd>/part-0.parquet`, with one query per date. 
+        Each file has the dictionary-encoded `ETF_ticker` and `Holding` columns and the `Holding_Weight` column,
+        so that the export can be read back (e.g. with `pyarrow.dataset.dataset(directory, partitioning="hive")`)
+        without the database, and loaded into a fresh one (see `import_holdings`). Requires the `pyarrow` package.
+
+        Parameters
+        ----------
+        directory : str
+            Path to the directory of the export; existing partitions for the exported dates are replaced.
+        start : date, optional
+            `datetime.date` object representing the first date to export; by default None, i.e. the first stored date.
+        end : date, optional
+            `datetime.date` object representing the last date to export; by default None, i.e. today.
+
+        Returns
+        -------
+        int
+            The number of exported holdings records.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        dates_table = "etf_holdings_table" if self.holdings_history == "snapshots" else "etf_snapshot_dates_table"
+        dates = [
+            date_ for (date_,) in self.execute_query(
+                f"SELECT DISTINCT Date FROM {dates_table} WHERE Date BETWEEN {self.__placeholder} AND {self.__placeholder} ORDER BY Date;",
+                (date.min if start is None else start, self.today if end is None else end)
             )
-            holding_id: int = self.execute_query(
-                f"SELECT Holding_ID from holdings_table where Holding = {self.__placeholder};",
-                (holding_ticker,)
-            )[0][0]
-            return holding_id
+        ]
+        n_records = 0
+        for date_ in dates:
+            records = self.execute_query(
+                f"""SELECT minor.ETF_ticker, other.Holding, major.Holding_Weight 
+                FROM (
+                    {self.holdings_records_query()}
+                ) as major 
+                INNER JOIN etf_ticker_table as minor on major.ETF_ticker_ID = minor.ETF_ticker_ID 
+                LEFT JOIN holdings_table as other on major.Holding_ID = other.Holding_ID
+                ORDER BY minor.ETF_ticker;
+                """,
+                (date_,)
+            )
+            etf_tickers, holdings, holding_weights = zip(*records) if len(records) > 0 else ((), (), ())
+            table = pa.table({
+                "ETF_ticker": pa.array(etf_tickers, pa.string()).dictionary_encode(),
+                "Holding": pa.array(holdings, pa.string()).dictionary_encode(),
+                "Holding_Weight": pa.array(holding_weights, pa.float64()),
+            })
+            partition = os.path.join(directory, f"Date={date_}")
+            os.makedirs(partition, exist_ok=True)
+            # readers never see partially written files (Arrow ignores files starting with '.')
+            pq.write_table(table, os.path.join(partition, ".part-0.parquet"))
+            os.replace(os.path.join(partition, ".part-0.parquet"), os.path.join(partition, "part-0.parquet"))
+            n_records += len(records)
+        logger.info(f"Exported {n_records} holdings records over {len(dates)} dates to {directory}.")
+        return n_records
+
+    def import_holdings(self, directory: str) -> int:
+        """Loads the holdings exported by `export_holdings` into the database, one date 
+        (and transaction, see `insert_etfs_holding_data`) at a time in increasing order, along with their MinHash signatures.
+        Meant to bootstrap a fresh database: holdings already stored for a date are not replaced. 
+        Requires the `pyarrow` package.
+
+        Parameters
+        ----------
+        directory : str
+            Path to the directory of the export.
+
+        Returns
+        -------
+        int
+            The number of imported holdings records.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        partitions = sorted( name for name in os.listdir(directory) if name.startswith("Date=") )
+        n_records = 0
+        for partition in partitions:
+            date_ = date.fromisoformat(partition[len("Date="):])
+            table = pq.read_table(os.path.join(directory, partition), columns=["ETF_ticker", "Holding", "Holding_Weight"])
+            if table.num_rows == 0:
+                continue
+            # Group the rows by ETF on the dictionary codes of `ETF_ticker`, converting each column once
+            etf_tickers = table.column("ETF_ticker").cast(pa.string()).combine_chunks().dictionary_encode()
+            codes = etf_tickers.indices.to_numpy(zero_copy_only=False)
+            order = np.argsort(codes, kind="stable")
+            boundaries = get_run_boundaries(codes[order])
+            tickers = etf_tickers.dictionary.to_pylist()
+            holdings = table.column("Holding").cast(pa.string()).to_numpy()[order]
+            weights = table.column("Holding_Weight").to_numpy()[order]
+            etfs_holdings: Mapping[str, Mapping[str, Mapping[str, float]]] = {
+                tickers[codes[order[start]]]: {
+                    holding: dict(weight=weight)
+                    for holding, weight in zip(holdings[start:stop].tolist(), weights[start:stop].tolist())
+                }
+                for start, stop in zip(boundaries[:-1], boundaries[1:])
+            }
+            inserted = self.insert_etfs_holding_data(etfs_holdings, date_)
+            n_records += sum(map(len, inserted.values()))
+        logger.info(f"Imported {n_records} holdings records over {len(partitions)} dates from {directory}.")
+        return n_records
+
+    def update_similarity_table(self, date_: date = None) -> int:
+        """Computes and stores the similarity between all pairs of ETFs with holdings data on `date_`
+        in `etf_similarity_table`, for each of the supported distance measures. 
+        
+        Rows involving ETFs whose holdings didn't change since the previous date present in 
+        `etf_similarity_table` are carried over from that date; only the rows of the ETFs whose 
+        holdings changed (or which are new) are recomputed.
+
+        Symmetric measures are stored once per pair (with `ETF_ticker_ID_1 < ETF_ticker_ID_2`), 
+        while 'asymmetric_coverage_overlap' is stored for both orderings of each pair, such that
+        `Similarity == 1 - asymmetric_coverage_overlap(ETF_1, ETF_2)` (see `src.utils.get_similarity`).
+
+        Parameters
+        ----------
+        date_ : date, optional
+            `datetime.date` object representing the date of interest.
+            Defaults None, which gets replaced by today's date.
+
+        Returns
+        -------
+        int
+            The number of recomputed rows.
+        """
+        if date_ is None:
+            date_ = self.today
+        current = self.get_holdings_snapshot(date_)
+        etf_ids: Mapping[str, int] = {
+            etf_ticker: etf_ticker_id
+            for (etf_ticker, etf_ticker_id) in self.execute_query(
+                "SELECT ETF_ticker, ETF_ticker_ID FROM etf_ticker_table;"
+            )
+        }
+        previous_date = self.execute_query(
+            f"SELECT MAX(Date) FROM etf_similarity_table WHERE Date < {self.__placeholder};",
+            (date_,)
+        )[0][0]
+        if isinstance(previous_date, str):
+            # SQLite3 doesn't parse the result of aggregate functions
+            previous_date = date.fromisoformat(previous_date)
+        previous = self.get_holdings_snapshot(previous_date) if previous_date is not None else dict()
+        unchanged = [ etf for etf in current.keys() if previous.get(etf) == current[etf] ]
+        logger.info(f"{len(current) - len(unchanged)}/{len(current)} ETFs changed between {previous_date} and {date_}")
+
+        holdings_matrix = HoldingsMatrix.from_query_output(current)
+        unchanged_indices = { holdings_matrix.etf_index[etf] for etf in unchanged }
+        changed_indices = [ i for i in range(len(holdings_matrix.etfs)) if i not in unchanged_indices ]
+        changed_index_set = set(changed_indices)
+        rows: List[Tuple[date, int, int, str, float]] = []
+        if len(changed_indices) > 0:
+            blocks = get_similarity_matrices(
+                holdings_matrix.weights,
+                distance_measures = SUPPORTED_DISTANCE_MEASURES,
+                etf_indices = changed_indices
+            )
+            # number of holdings with positive weights, which is 0 for ETFs whose holdings all weigh 0.0 (e.g. cash lines)
+            counts = np.asarray((holdings_matrix.weights > 0).sum(axis=0)).ravel()
+            ids = [ etf_ids[etf] for etf in holdings_matrix.etfs ]
+            for row, i in enumerate(changed_indices):
+                for j in range(len(ids)):
+                    # pairs of changed ETFs are handled from the row of the ETF with the smallest index
+                    if j == i or (j in changed_index_set and j < i):
+                        continue
+                    for measure in ('jaccard', 'weighted_jaccard'):
+                        rows.append((date_, min(ids[i], ids[j]), max(ids[i], ids[j]), measure, float(blocks[measure][row, j])))
+                    coverage = blocks['asymmetric_coverage_overlap'][row, j]
+                    # |i∩j| = (1 - coverage) * |i|, so the reverse coverage follows from the holding counts
+                    # (an ETF without holdings covers nothing, see `src.utils.get_similarity_matrices`)
+                    intersection = (1.0 - coverage) * counts[i]
+                    reverse_coverage = 1.0 - intersection / counts[j] if counts[j] > 0 else 1.0
+                    rows.append((date_, ids[i], ids[j], 'asymmetric_coverage_overlap', float(coverage)))
+                    rows.append((date_, ids[j], ids[i], 'asymmetric_coverage_overlap', float(reverse_coverage)))
+
+        # readers see either the previous rows of `date_` or all of the new ones
+        with self.transaction() as cur:
+            cur.execute(
+                f"DELETE FROM etf_similarity_table WHERE Date = {self.__placeholder};",
+                (date_,)
+            )
+            if len(unchanged) > 1:
+                unchanged_ids = ", ".join( str(int(etf_ids[etf])) for etf in unchanged )
+                cur.execute(
+                    f"""INSERT INTO etf_similarity_table 
+                    (Date, ETF_ticker_ID_1, ETF_ticker_ID_2, Measure, Similarity)
+                    SELECT {self.__placeholder}, ETF_ticker_ID_1, ETF_ticker_ID_2, Measure, Similarity 
+                    FROM etf_similarity_table
+                    WHERE Date = {self.__placeholder} 
+                    AND ETF_ticker_ID_1 IN ({unchanged_ids}) AND ETF_ticker_ID_2 IN ({unchanged_ids});
+                    """,
+                    (date_, previous_date)
+                )
+            cur.executemany(
+                f"""INSERT INTO etf_similarity_table 
+                (Date, ETF_ticker_ID_1, ETF_ticker_ID_2, Measure, Similarity)
+                VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
+                """,
+                rows
+            )
+        # the matrices read before the update are stale
+        self.shared_cache.invalidate_similarities(date_)
+        return len(rows)
+
+    def get_stored_similarities(self,
+                                etf_tickers: Iterable[str],
+                                distance_measure: str = 'jaccard',
+                                date_: date = None,
+                                swap_vectors: bool = False) -> Union[None, Mapping[Tuple[str,str], float]]:
+        """Reads the precomputed similarities between `etf_tickers` from `etf_similarity_table`
+        (see `update_similarity_table`).
+
+        Parameters
+        ----------
+        etf_tickers : Iterable[str]
+            Tickers for the ETFs of interest.
+        distance_measure : str, optional
+            One of ('jaccard', 'weighted_jaccard', 'asymmetric_coverage_overlap'), by default 'jaccard'.
+        date_ : date, optional
+            `datetime.date` object representing the date of interest.
+            Defaults None, which gets replaced by today's date.
+        swap_vectors : bool, optional
+            Only relevant for 'asymmetric_coverage_overlap'; see `src.utils.asymmetric_coverage_overlap`.
+            By default False.
+
+        Returns
+        -------
+        Union[None, Mapping[Tuple[str,str], float]]
+            None if some of the pairs of ETFs are missing from `etf_similarity_table`, or
+            a dictionary formatted like the output of `src.utils.get_similarity`.
+        """
+        if date_ is None:
+            date_ = self.today
+        distance_measure = distance_measure.lower()
+        assert distance_measure in SUPPORTED_DISTANCE_MEASURES, \
+            f"{distance_measure} is not among the supported distance measures {SUPPORTED_DISTANCE_MEASURES}"
+        etf_tickers = sorted(set( etf_ticker.upper() for etf_ticker in etf_tickers ))
+        if len(etf_tickers) < 2:
+            return dict()
+        cache_measure = f"{distance_measure}:swapped" if distance_measure == 'asymmetric_coverage_overlap' and swap_vectors else distance_measure
+        matrix = self.shared_cache.get_similarity_matrix(etf_tickers, cache_measure, date_)
+        if matrix is not None:
+            return {
+                (etf1, etf2): float(matrix[i, i+1+j])
+                for i, etf1 in enumerate(etf_tickers)
+                for j, etf2 in enumerate(etf_tickers[i+1:])
+            }
+        ticker_placeholders = ", ".join([self.__placeholder] * len(etf_tickers))
+        records = self.execute_query(
+            f"""SELECT first.ETF_ticker, second.ETF_ticker, major.Similarity
+            FROM etf_similarity_table AS major
+            INNER JOIN etf_ticker_table AS first ON major.ETF_ticker_ID_1 = first.ETF_ticker_ID
+            INNER JOIN etf_ticker_table AS second ON major.ETF_ticker_ID_2 = second.ETF_ticker_ID
+            WHERE major.Date = {self.__placeholder} AND major.Measure = {self.__placeholder}
+            AND first.ETF_ticker IN ({ticker_placeholders}) AND second.ETF_ticker IN ({ticker_placeholders});
+            """,
+            (date_, distance_measure, *etf_tickers, *etf_tickers)
+        )
+        stored: Mapping[Tuple[str,str], float] = dict()
+        for etf1, etf2, similarity in records:
+            if distance_measure == 'asymmetric_coverage_overlap':
+                stored[(etf2, etf1) if swap_vectors else (etf1, etf2)] = similarity
+            else:
+                stored[(etf1, etf2)] = stored[(etf2, etf1)] = similarity
+        try:
+            similarities = {
+                (etf1, etf2): stored[(etf1, etf2)]
+                for i, etf1 in enumerate(etf_tickers)
+                for etf2 in etf_tickers[i+1:]
+            }
+        except KeyError:
+            return None
+        matrix = np.full((len(etf_tickers), len(etf_tickers)), np.nan)
+        for i, etf1 in enumerate(etf_tickers):
+            for j, etf2 in enumerate(etf_tickers[i+1:], start=i+1):
+                matrix[i, j] = similarities[(etf1, etf2)]
+        self.shared_cache.put_similarity_matrix(etf_tickers, cache_measure, date_, matrix)
+        return similarities
 
     @abc.abstractmethod
     def get_holdings_and_weights_for_etf(   self, 
@@ -140,7 +1228,11 @@ class SQLDatabaseClient(abc.ABC):
     def get_holdings_and_weights_for_etfs(  self, 
                                             etf_tickers: List[str],
                                             date_: date = None) -> Mapping[str, Mapping[str, Mapping]]:
-        """Wrapper to execute `get_holdings_and_weights_for_etf` over all ETF tickers provided in `etfs`. 
+        """Fetches the holdings data of all ETF tickers provided in `etf_tickers`. 
+        Snapshots found in the shared cache (see `src.cache.SharedCache`) are used as is, the rest of the data
+        already stored in the database is read with a single query (see `get_holdings_snapshot`), and
+        only the ETFs missing from it get scraped (concurrently, see `..scraping.scrape_etfs_holdings`) 
+        and inserted (in a single batch, see `insert_etfs_holding_data`).
 
         Parameters
         ----------
@@ -163,18 +1255,40 @@ class SQLDatabaseClient(abc.ABC):
             date_ = self.today
         if date_ > self.today:
             raise ValueError(f"Unable to fetch data from {date_}; Functionality to look into the future is not supported yet.")
-            
+
+        upper_tickers: Mapping[str, str] = { etf_ticker: etf_ticker.upper() for etf_ticker in etf_tickers }
+        # snapshots fetched by other processes are read from the shared cache first
+        stored: Mapping[str, Mapping[str, Mapping]] = dict()
+        for upper_ticker in set(upper_tickers.values()):
+            holdings = self.shared_cache.get_holdings(upper_ticker, date_)
+            if holdings is not None:
+                stored[upper_ticker] = holdings
+        uncached_tickers = [ upper_ticker for upper_ticker in upper_tickers.values() if upper_ticker not in stored ]
+        if len(uncached_tickers) > 0:
+            snapshot = self.get_holdings_snapshot(date_, uncached_tickers)
+            for upper_ticker, holdings in snapshot.items():
+                self.shared_cache.put_holdings(upper_ticker, date_, holdings)
+            stored.update(snapshot)
+        missing_etfs = [ etf_ticker for etf_ticker, upper_ticker in upper_tickers.items() if upper_ticker not in stored ]
+        # past data can't be scraped
+        if len(missing_etfs) > 0 and date_ == self.today:
+            logger.info(f"No stored data for {len(missing_etfs)}/{len(upper_tickers)} ETFs on {date_}; fetching it now.")
+            # the ETFs are scraped concurrently, then inserted in a single batch
+            scraped, errors = scrape_etfs_holdings( upper_tickers[etf_ticker] for etf_ticker in missing_etfs )
+            for etf_ticker, etf_is_unfetchable in errors.items():
+                logger.warning(f"Unable to fetch data for ETF {etf_ticker} on {date_}: {etf_is_unfetchable}")
+            self.insert_etfs_holding_data(scraped)
+            # read back whatever got inserted so that holdings are reported by ticker
+            snapshot = self.get_holdings_snapshot(date_, [ upper_tickers[etf_ticker] for etf_ticker in missing_etfs ])
+            for upper_ticker, holdings in snapshot.items():
+                self.shared_cache.put_holdings(upper_ticker, date_, holdings)
+            stored.update(snapshot)
+
         results: Mapping[str, Mapping[str, Mapping]] = dict()
         unavailable_etfs: List[str] = []
-        for etf_ticker in etf_tickers:
-            try:
-                etf_ticker_holdings: List[Tuple[datetime.date, str, str, float]] = self.get_holdings_and_weights_for_etf(etf_ticker)
-            except AssertionError as etf_is_unfetchable:
-                unavailable_etfs.append(etf_ticker)
+        for etf_ticker, upper_ticker in upper_tickers.items():
+            if upper_ticker in stored:
+                results[etf_ticker] = stored[upper_ticker]
             else:
-                results[etf_ticker] = {
-                    holding_ticker: dict(weight=holding_weight)
-                    for (date, etf_ticker_id, holding_ticker, holding_weight)
-                    in etf_ticker_holdings
-                }
-        return results, unavailable_etfs                                          
\ No newline at end of file
+                unavailable_etfs.append(etf_ticker)
+        return results, unavailable_etfs
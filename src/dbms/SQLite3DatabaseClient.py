@@ -1,23 +1,110 @@
 # standard library dependencies
+import os
 import sqlite3
 import logging 
 logger = logging.getLogger(f"mainLogger.SQLite3DatabaseClient")
 import datetime
+import threading
 from datetime import date
-from functools import lru_cache
-from typing import List, Any, Iterable, Union, Tuple, Mapping
+from contextlib import contextmanager
+from typing import List, Any, Iterable, Iterator, Union, Tuple, Mapping
 
 # local dependencies
 from .SQLDatabaseClient import SQLDatabaseClient
 from ..scraping import scrape_etf_holdings
+from ..cache import cached_holdings
+
+
+class SQLite3ConnectionManager:
+    """Hands out one long-lived connection per thread to the SQLite3 database at `connection_str`.
+
+    Reusing connections avoids re-opening the database (and re-parsing its schema) for every 
+    statement, and lets `sqlite3` reuse its prepared statements (up to `cached_statements` per connection).
+    Connections are configured with the `pragmas`, e.g. `journal_mode = WAL`, which lets readers 
+    proceed while a writer is inserting data. A thread's connection is closed when the thread exits.
+    """
+    def __init__(   self,
+                    connection_str: str,
+                    pragmas: Mapping[str, Any],
+                    timeout: float = 5.0,
+                    cached_statements: int = 256):
+        self.connection_str = connection_str
+        self.pragmas = dict(pragmas)
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.__local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection, opening it on first use."""
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.connection_str, 
+                detect_types = sqlite3.PARSE_DECLTYPES,
+                timeout = self.timeout,
+                cached_statements = self.cached_statements
+            )
+            for pragma, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {pragma} = {value};")
+            self.__local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        """Closes the calling thread's connection (if any)."""
+        conn = getattr(self.__local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.__local.conn = None
+
+
+# process-wide connection managers, keyed by the (absolute) path of their database
+_sqlite3_connection_managers: Mapping[str, SQLite3ConnectionManager] = dict()
+_sqlite3_connection_managers_lock = threading.Lock()
+
+def get_sqlite3_connection_manager( connection_str: str, 
+                                    pragmas: Mapping[str, Any]) -> SQLite3ConnectionManager:
+    """Returns the process-wide connection manager for the database at `connection_str`,
+    creating it on first use; the `pragmas` only apply to that first call."""
+    key = os.path.abspath(connection_str)
+    with _sqlite3_connection_managers_lock:
+        if key not in _sqlite3_connection_managers:
+            _sqlite3_connection_managers[key] = SQLite3ConnectionManager(connection_str, pragmas)
+        return _sqlite3_connection_managers[key]
+
 
 class SQLite3DatabaseClient(SQLDatabaseClient):
+    # write-ahead logging lets readers proceed concurrently with a writer, 
+    # and only needs to sync at checkpoints with `synchronous = NORMAL`
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
 
     def __init__(   self, 
-                    connection_str: str = "data/etf.sqlite"):
-        super().__init__(dbms = "sqlite3")
+                    connection_str: str = "data/etf.sqlite",
+                    mmap_size: int = 256 * 1024 * 1024,
+                    cache_size: int = -64 * 1024):
+        """
+        Parameters
+        ----------
+        connection_str : str, optional
+            Path to the SQLite3 database, by default "data/etf.sqlite".
+        mmap_size : int, optional
+            Maximal number of bytes of the database file to memory-map, by default 256MiB.
+        cache_size : int, optional
+            Page cache size of each connection, in pages if positive or in KiB if negative 
+            (see SQLite3's `PRAGMA cache_size`), by default -64 * 1024 (i.e. 64MiB).
+        """
+        super().__init__(dbms = "sqlite3", database_key = os.path.abspath(connection_str))
         self.__connection_str = connection_str 
         self.__placeholder = '?'
+        self.__connections = get_sqlite3_connection_manager(
+            connection_str,
+            dict(
+                journal_mode = self.journal_mode,
+                synchronous = self.synchronous,
+                mmap_size = int(mmap_size),
+                cache_size = int(cache_size)
+            )
+        )
         self.setup()
     
     @property
@@ -51,122 +138,185 @@ class SQLite3DatabaseClient(SQLDatabaseClient):
         FOREIGN KEY (Holding_ID) REFERENCES holdings_table (Holding_ID)
         );
         '''
+
+    @property
+    def minhash_table_creation_query(self) -> str:
+        """SQLite3 query to create the `etf_minhash_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_minhash_table(
+            Date DATE,
+            ETF_ticker_ID integer,
+            Weighted integer,
+            Signature BLOB,
+        PRIMARY KEY (Date, ETF_ticker_ID, Weighted),
+        FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def lsh_bucket_table_creation_query(self) -> str:
+        """SQLite3 query to create the `etf_lsh_bucket_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_lsh_bucket_table(
+            Date DATE,
+            Weighted integer,
+            Band integer,
+            Bucket varchar(16),
+            ETF_ticker_ID integer,
+        PRIMARY KEY (Date, Weighted, Band, Bucket, ETF_ticker_ID),
+        FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def similarity_table_creation_query(self) -> str:
+        """SQLite3 query to create the `etf_similarity_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_similarity_table(
+            Date DATE,
+            ETF_ticker_ID_1 integer,
+            ETF_ticker_ID_2 integer,
+            Measure varchar(32),
+            Similarity real,
+        PRIMARY KEY (Date, Measure, ETF_ticker_ID_1, ETF_ticker_ID_2),
+        FOREIGN KEY (ETF_ticker_ID_1) REFERENCES etf_ticker_table (ETF_ticker_ID),
+        FOREIGN KEY (ETF_ticker_ID_2) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def schema_migrations_table_creation_query(self) -> str:
+        """SQLite3 query to create the `schema_migrations_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS schema_migrations_table(
+            Version integer PRIMARY KEY,
+            Description varchar(255),
+            Applied_At timestamp DEFAULT CURRENT_TIMESTAMP
+        );
+        '''
+
+    @property
+    def schema_migrations(self) -> List[Tuple[int, str, List[str]]]:
+        """SQLite3 schema migrations (see `SQLDatabaseClient.migrate`)"""
+        return [
+            (1, "Index etf_holdings_table by ETF and date", [
+                # the unique index can only be created once duplicated rows are gone
+                '''DELETE FROM etf_holdings_table WHERE Row_ID NOT IN (
+                    SELECT MIN(Row_ID) FROM etf_holdings_table GROUP BY ETF_ticker_ID, Date, Holding_ID
+                );''',
+                # serves the per-ETF reads of `get_holdings_and_weights_for_etf`
+                '''CREATE UNIQUE INDEX IF NOT EXISTS etf_holdings_etf_date_holding_idx 
+                ON etf_holdings_table (ETF_ticker_ID, Date, Holding_ID);''',
+                # covers the by-date reads (`MAX(Date)`, `get_holdings_snapshot`) without touching the table
+                '''CREATE INDEX IF NOT EXISTS etf_holdings_date_etf_idx 
+                ON etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight);''',
+            ]),
+            (2, "Add the tables of the 'intervals' holdings history", [
+                '''CREATE TABLE IF NOT EXISTS etf_snapshot_dates_table(
+                    Date DATE,
+                    ETF_ticker_ID integer,
+                PRIMARY KEY (ETF_ticker_ID, Date),
+                FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+                );''',
+                # `Valid_To` is exclusive, and null while the holding keeps its weight
+                '''CREATE TABLE IF NOT EXISTS etf_holding_intervals_table(
+                    ETF_ticker_ID integer,
+                    Holding_ID integer,
+                    Holding_Weight real,
+                    Valid_From DATE,
+                    Valid_To DATE,
+                PRIMARY KEY (ETF_ticker_ID, Holding_ID, Valid_From),
+                FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID),
+                FOREIGN KEY (Holding_ID) REFERENCES holdings_table (Holding_ID)
+                );''',
+                # serves the reconstruction of the holdings on a date (see `SQLDatabaseClient.holdings_records_query`)
+                '''CREATE INDEX IF NOT EXISTS etf_holding_intervals_etf_validity_idx 
+                ON etf_holding_intervals_table (ETF_ticker_ID, Valid_From, Valid_To, Holding_ID, Holding_Weight);''',
+                "CREATE INDEX IF NOT EXISTS etf_snapshot_dates_date_idx ON etf_snapshot_dates_table (Date);",
+            ]),
+            (3, "Add the settings table shared by the clients of the database", [
+                # e.g. the 'holdings_history' mode (see `SQLDatabaseClient.load_holdings_history`)
+                '''CREATE TABLE IF NOT EXISTS settings_table(
+                    Setting varchar(255) PRIMARY KEY,
+                    Value varchar(255)
+                );''',
+            ]),
+        ]
     
     def execute_query(  self, 
                         query: str, 
                         *args) -> Union[None,List[Any]]:
-        with sqlite3.connect(self.__connection_str, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
-            cur = conn.execute(query, *args)
-        return cur.fetchall()
+        # the connection's context manager commits, or rolls back on exceptions
+        with self.__connections.connection() as conn:
+            return conn.execute(query, *args).fetchall()
     
     def execute_query_over_many_arguments(  self, 
                                             query: str, 
                                             args: Iterable[Any]) -> Union[None,List[Any]]:
-        with sqlite3.connect(self.__connection_str, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
-            cur = conn.executemany(
+        with self.__connections.connection() as conn:
+            return conn.executemany(
                 query, 
                 args
-            )
-        return cur.fetchall()
+            ).fetchall()
 
-    def insert_etf_holding_data(self,
-                                etf_ticker: str,
-                                etf_holdings: Mapping[str, Mapping[str, float]]) -> Union[None,List[Tuple[datetime.date, str, str, float]]]:
-        """Method handling everything required to handle the data
-        scraped for the specified ETF and insert it into the database.
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        # NOTE: the connection is shared by everything running on the thread, 
+        #       so no other query should be executed (i.e. committed) until the transaction ends
+        with self.__connections.connection() as conn:
+            yield conn.cursor()
 
-        Parameters
-        ----------
-        etf_ticker : str
-            ETF of interest.
-        etf_holdings: Mapping[str, Mapping[str, float]]
-            The holdings data that was scraped for the ETF.
-        
-        Returns
-        -------
-        Union[None,List[Tuple[datetime.date, str, str, float]]]
-            Either None (if no scraping data was provided) or the
-            list of holdings records for the ETF.
-        """
-        try:
-            assert len(etf_holdings) > 0
-        except AssertionError as ae:
-            logger.warning("SQLite3DatabaseClient.insert_data was given an empty mapping; No updates to be made.")
-            return None
-        
-        etf_ticker = etf_ticker.upper()
-        holding_tickers = [ (holding, ) for holding in etf_holdings.keys() ]
-        
-        # NOTE: this insertion operation doesn't require cleanup if the method
-        #       raises an exception afterwards; having more holding tickers in 
-        #       `holding_table` is actually advantageous
-        try:
-            logger.info("Inserting holding tickers.")
-            self.execute_query_over_many_arguments(
-                f"INSERT INTO holdings_table (Holding) VALUES ({self.__placeholder} );",
-                holding_tickers
-            )
-            logger.info("Inserted holding tickers.")
-        except Exception as already_exists:
-            logger.warning(already_exists)
-            
-        # OK we can't use executemany for `select` queries like
-        # holding_tickers_and_id = self.execute_query_over_many_arguments(
-        #     "select * from holdings_table where Holding = (%s)",
-        #     holding_tickers
-        # )
-        # so we'll need to loop over them
-        for (holding_ticker, ) in holding_tickers:
-            holding_id: int = self.get_holding_id_for_ticker(holding_ticker)
-            # keeping `holding_ticker` and `holding_ticker_id` together is
-            # useful for future reference
-            etf_holdings[holding_ticker]['holding_ticker_id'] = holding_id
-
-        try:
-            logger.info("Inserting etf ticker.")
-            self.execute_query(
-                #"insert or ignore into etf_ticker_table (ETF_ticker) values (%s);",
-                f"INSERT INTO etf_ticker_table (ETF_ticker) VALUES ({self.__placeholder});",
-                (etf_ticker,)
-            )
-            logger.info(f"Successfully inserted {etf_ticker} into etf_ticker_table")
-        except Exception as already_exists:
-            # NOTE: we can't use ON CONFLICT IGNORE with SQLite3
-            #       so we just log the exception
-            logger.warning(already_exists)
+    def close(self) -> None:
+        """Closes the calling thread's connection to the database; 
+        it gets re-opened by the next query."""
+        self.__connections.close()
 
-        etf_ticker_id = self.get_etf_id_for_ticker(etf_ticker)
+    def insert_and_fetch_holding_ids(   self, 
+                                        cur: sqlite3.Cursor, 
+                                        holding_tickers: List[str]) -> Mapping[str, int]:
+        """Inserts the `holding_tickers` missing from `holdings_table` and fetches the
+        IDs of all of them by joining `holdings_table` against a temporary table of the tickers."""
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS holding_tickers_tmp (Holding varchar(255) PRIMARY KEY);")
+        cur.execute("DELETE FROM holding_tickers_tmp;")
+        cur.executemany(
+            f"INSERT OR IGNORE INTO holding_tickers_tmp (Holding) VALUES ({self.__placeholder});",
+            [ (holding_ticker,) for holding_ticker in holding_tickers ]
+        )
+        cur.execute("INSERT OR IGNORE INTO holdings_table (Holding) SELECT Holding FROM holding_tickers_tmp;")
+        cur.execute(
+            """SELECT major.Holding, major.Holding_ID FROM holdings_table AS major 
+            INNER JOIN holding_tickers_tmp AS minor ON major.Holding = minor.Holding;
+            """
+        )
+        holding_ids = dict(cur.fetchall())
+        cur.execute("DELETE FROM holding_tickers_tmp;")
+        return holding_ids
 
-        holdings = [
-            (self.today, etf_ticker_id, holding_dict['holding_ticker_id'], holding_dict['weight'])
-            for holding_dict in etf_holdings.values()
-        ]
-        try:
-            logger.info("Inserting into etf_holdings_table.")
-            self.execute_query_over_many_arguments(
-                f"""INSERT INTO etf_holdings_table 
-                (Date, ETF_ticker_ID, Holding_ID, Holding_Weight)
-                VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
-                """,
-                holdings
-            )
-            logger.info("Inserted into etf_holdings_table.")
-        except Exception as error_in_insertion:
-            self.execute_query(
-                f"DELETE FROM etf_ticker_table WHERE ETF_ticker = %{self.__placeholder};",
-                (etf_ticker,)
-            )
-            logger.warning(f"Caught error in inserting {etf_ticker} in `etf_holdings_table`: {error_in_insertion}")
-
-        finally:
-            return holdings
+    def insert_etf_ticker(self, cur: sqlite3.Cursor, etf_ticker: str) -> int:
+        """Inserts `etf_ticker` into `etf_ticker_table` (unless already present) and returns
+        its `ETF_ticker_ID`, using the cursor `cur`."""
+        cur.execute(
+            f"INSERT OR IGNORE INTO etf_ticker_table (ETF_ticker) VALUES ({self.__placeholder});",
+            (etf_ticker,)
+        )
+        cur.execute(
+            f"SELECT ETF_ticker_ID FROM etf_ticker_table WHERE ETF_ticker = {self.__placeholder};",
+            (etf_ticker,)
+        )
+        return cur.fetchall()[0][0]
 
+    def insert_holdings_records(self, cur: sqlite3.Cursor, holdings: List[Tuple[date, int, int, float]]) -> None:
+        """Inserts the `(Date, ETF_ticker_ID, Holding_ID, Holding_Weight)` records in `holdings`
+        into `etf_holdings_table` with a single `executemany`, using the cursor `cur`."""
+        cur.executemany(
+            f"""INSERT INTO etf_holdings_table 
+            (Date, ETF_ticker_ID, Holding_ID, Holding_Weight)
+            VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
+            """,
+            holdings
+        )
 
-    @lru_cache(maxsize = None)
+    @cached_holdings
     def get_holdings_and_weights_for_etf(   self, 
                                             etf_ticker: str,
                                             date_: date = None) -> List[Tuple[datetime.date, str, str, float]]:  
-        """LRU-cached method to fetch holding and weights data for the 
+        """Cached (see `src.cache.cached_holdings`) method to fetch holding and weights data for the 
         ETF specified by the `etf_name` ticker from the TinyDB database. 
         If no data for said ETF is present, this function will attempt to scrape
         (see `..scraping.scrape_etf_holdings`) and insert it into the TinyDB database.
@@ -189,8 +339,7 @@ class SQLite3DatabaseClient(SQLDatabaseClient):
 
         query = f"""SELECT major.Date, minor.ETF_ticker, other.Holding, major.Holding_Weight 
         FROM (
-            select etf_holdings_table.* from etf_holdings_table where ETF_ticker_ID = {self.__placeholder} 
-            and Date = {self.__placeholder} 
+            {self.holdings_records_query(per_etf=True)}
         ) as major 
         INNER JOIN etf_ticker_table as minor on major.ETF_ticker_ID = minor.ETF_ticker_ID 
         LEFT JOIN holdings_table as other on major.Holding_ID = other.Holding_ID;
@@ -205,7 +354,7 @@ class SQLite3DatabaseClient(SQLDatabaseClient):
             etf_id = self.get_etf_id_for_ticker(etf_ticker)
             holdings: List[Tuple[datetime.date, str, str, float]] = self.execute_query(
                 query, 
-                (etf_id, date_)
+                (date_, etf_id)
             )
             assert len(holdings) > 0
 
@@ -216,27 +365,10 @@ class SQLite3DatabaseClient(SQLDatabaseClient):
             if date_ != self.today:
                 raise ValueError(f"No data is available for {etf_ticker} on {date_}")
 
-            # this could happen if the process of inserting data
-            # on the ETF's holdings was interrupted
+            # NOTE: `insert_etf_holding_data` inserts everything within a single transaction,
+            #       so there are no partially inserted holdings to clean up here
             if isinstance(no_current_data_for_etf, AssertionError):
-                logger.warning(f"Holdings for ETF '{etf_ticker}' were incomplete; updating...")
-                
-                # do some database cleanup
-                # clean up etf_holdings_table before repeating the insertion process
-                self.execute_query(
-                    f"""DELETE from etf_holdings_table 
-                        WHERE ETF_ticker_ID = {self.__placeholder}
-                        and Date = {self.__placeholder};
-                    """,
-                    (etf_id, self.today)
-                )
-                # clean up etf_ticker_table before repeating the insertion process
-                self.execute_query(
-                    f"""DELETE from etf_ticker_table 
-                        WHERE ETF_ticker_ID = {self.__placeholder};
-                    """,
-                    (etf_id,)
-                )
+                logger.warning(f"No holdings for ETF '{etf_ticker}' on {date_} yet; updating...")
 
             # scrape today's data for the ETF's holdings
             holdings: Mapping[str, Mapping[str, float]] = self.insert_etf_holding_data(
@@ -1,21 +1,32 @@
 # standard library dependencies
+import os
 import logging
 logger = logging.getLogger(f"mainLogger.TinyDBDatabaseClient")
-from functools import lru_cache
 from datetime import datetime, date
-from typing import Iterable, Mapping, List, Tuple
+from typing import Iterable, Mapping, List, Tuple, Union
 
 # external dependencies
-from tinydb import TinyDB, Query
+from tinydb import TinyDB
 
 # local dependencies
-from ..scraping import scrape_etf_holdings
+from .TinyDBStorage import get_indexed_tinydb
+from ..scraping import scrape_etf_holdings, scrape_etfs_holdings
+from ..cache import cached_holdings, get_holdings_cache
+from ..holdings import HoldingsHistory
 
 class TinyDBDatabaseClient:
     """TinyDB database client.
     """
     def __init__(self, db_path: str = "data/etf_tinydb.json"):
-        self.db = TinyDB(db_path)
+        # records indexed by (name, date) and served from memory, shared by the clients of the same database
+        self.store = get_indexed_tinydb(db_path)
+        # shared by the clients of the same database
+        self.holdings_cache = get_holdings_cache(os.path.abspath(db_path))
+
+    @property
+    def db(self) -> TinyDB:
+        """The underlying TinyDB database (replaced whenever the store reloads its file)."""
+        return self.store.db
 
     @property
     def today(self) -> str:
@@ -25,7 +36,11 @@ class TinyDBDatabaseClient:
 
     def get_known_etfs(self) -> List[str]:
         """Returns the list of known ETFs in the database."""
-        return [c['name'] for c in self.db.all()]
+        return self.store.names()
+
+    def flush(self) -> None:
+        """Writes any pending write to the database file (inserts are written right away, see `TinyDBStorage.IndexedTinyDB`)."""
+        self.store.flush()
 
     def scrape_and_insert_etf_holding_data( self, 
                                             etf_name: str,
@@ -62,18 +77,52 @@ class TinyDBDatabaseClient:
             logger.warning(message)
             raise ValueError(message) from e
         else:
-            self.db.insert({
+            self.store.insert_multiple([{
                 "name": etf_name, 
                 "holdings": etf_holdings,
                 "date": date_
-            })
+            }])
+            self.holdings_cache.invalidate(etf_name, date_)
             return etf_holdings
 
-    @lru_cache(maxsize = None)
+    def scrape_and_insert_etfs_holding_data(self,
+                                            etf_names: Iterable[str]) -> Mapping[str, Mapping[str, Mapping]]:
+        """Function that scrapes today's holdings data for all the ETFs in `etf_names` concurrently
+        (see `..scraping.scrape_etfs_holdings`) and inserts it into the TinyDB database in a single batch.
+
+        Parameters
+        ----------
+        etf_names : Iterable[str]
+            Tickers for the ETFs of interest.
+        
+        Returns
+        -------
+        Mapping[str, Mapping[str, Mapping]]
+            Dictionary mapping the (upper-case) tickers of the ETFs that were scraped to a dictionary
+            mapping the ETF's holdings (strings) to metadata (e.g. the holding's weight 
+            w.r.t. the ETF).
+        """
+        date_ = self.today
+        etfs_holdings, errors = scrape_etfs_holdings(etf_names)
+        for etf_name, e in errors.items():
+            logger.warning(f"Unable to fetch data for {etf_name}; {e}")
+        self.store.insert_multiple([
+            {
+                "name": etf_name, 
+                "holdings": etf_holdings,
+                "date": date_
+            }
+            for etf_name, etf_holdings in etfs_holdings.items()
+        ])
+        for etf_name in etfs_holdings.keys():
+            self.holdings_cache.invalidate(etf_name, date_)
+        return etfs_holdings
+
+    @cached_holdings
     def get_holdings_and_weights_for_etf(   self, 
                                             etf_name: str,
                                             date_: str = None) -> Mapping[str, Mapping[str, Mapping]]:
-        """LRU-cached method to fetch holding and weights data for the 
+        """Cached (see `src.cache.cached_holdings`) method to fetch holding and weights data for the 
         ETF specified by the `etf_name` ticker from the TinyDB database. 
         If no data for said ETF is present, this function will attempt to scrape
         (see `..scraping.scrape_etf_holdings`) and insert it into the TinyDB database.
@@ -99,37 +148,60 @@ class TinyDBDatabaseClient:
             raise ValueError(f"Unable to fetch data from {date_}; Functionality to look into the future is not supported yet.")
         etf_name = etf_name.upper()
 
-        etf_holdings = self.db.search(
-            (Query().name == str(etf_name)) \
-            & (Query().date == date_)
-        )
-        if len(etf_holdings) == 0:
+        etf_holdings = self.store.get(etf_name, date_)
+        if etf_holdings is None or len(etf_holdings) == 0:
             if date_ != self.today:
                 raise ValueError(f"No data is available for {etf_name} on {date_}")
+            if etf_holdings is not None:
+                logger.info(f"Found incomplete data for {etf_name}")
             logger.info(f"Attempting to scrape and insert holdings data for {etf_name}")
             etf_holdings = self.scrape_and_insert_etf_holding_data(
                 etf_name,
                 date_ = date_
             )
-        else:
-            assert len(etf_holdings) == 1, \
-                f"Found {len(etf_holdings)} records in the database for the etf {etf_name}"
-            try:
-                assert len(etf_holdings[0]['holdings']) > 0
-            except (AssertionError, Exception) as ae_e:
-                logger.info(f"Found incomplete data for {etf_name}")
-                logger.info(f"Attempting to scrape and insert holdings data for {etf_name}")
-                etf_holdings = self.scrape_and_insert_etf_holding_data(
-                    etf_name,
-                    date_ = date_
-                )
-            etf_holdings = etf_holdings[0]['holdings']
         return etf_holdings
 
+    def get_holdings_history(   self,
+                                etf_name: str,
+                                start: str,
+                                end: str = None) -> HoldingsHistory:
+        """Returns the holdings stored for `etf_name` on every date between 
+        `start` and `end` (inclusive, `yyyy-mm-dd` formatted strings, `end` defaulting to today)
+        from the (name, date) index, without scraping anything (see `SQLDatabaseClient.get_holdings_history`)."""
+        if end is None:
+            end = self.today
+        etf_name = etf_name.upper()
+        return HoldingsHistory.from_records(
+            etf_name,
+            [
+                (date_, holding, metadata['weight'])
+                for date_, etf_holdings in self.store.search(etf_name, str(start), str(end))
+                for holding, metadata in etf_holdings.items()
+            ]
+        )
+
+    def get_latest_holdings_date(self, before: str = None) -> Union[None, date]:
+        """Returns the latest date with holdings data in the database, or only among the dates
+        strictly earlier than `before` (None if there isn't any)."""
+        latest = self.store.latest_date(None if before is None else str(before))
+        return None if latest is None else date.fromisoformat(latest)
+
+    def get_holdings_snapshot(  self,
+                                date_: str,
+                                etf_tickers: Iterable[str] = None) -> Mapping[str, Mapping[str, Mapping]]:
+        """Returns the holdings data stored for all ETFs (or only for `etf_tickers`)
+        on `date_`, without scraping anything (see `SQLDatabaseClient.get_holdings_snapshot`)."""
+        return self.store.snapshot(
+            str(date_),
+            None if etf_tickers is None else [ etf_ticker.upper() for etf_ticker in etf_tickers ]
+        )
+
     def get_holdings_and_weights_for_etfs(  self,
                                             etfs: Iterable[str],
                                             date_: str = None) -> Tuple[Mapping[str, Mapping[str, Mapping]], List[str]]:
-        """Wrapper to execute `get_holdings_and_weights_for_etf` over all ETF tickers provided in `etfs`. 
+        """Wrapper to execute `get_holdings_and_weights_for_etf` over all ETF tickers provided in `etfs`;
+        today's data for the ETFs missing from the database is scraped beforehand 
+        (see `scrape_and_insert_etfs_holding_data`). 
 
         Parameters
         ----------
@@ -156,7 +228,15 @@ class TinyDBDatabaseClient:
         etfs = list(set(etfs))
         etfs_holdings: Mapping[str, List[str]] = dict()
         unavailable_etfs: List[str] = []
+        if date_ == self.today:
+            # the ETFs missing from the database are scraped concurrently, then inserted in a single batch
+            missing_etfs = [ etf for etf in etfs if not self.store.contains(etf.upper(), date_) ]
+            if len(missing_etfs) > 0:
+                scraped = self.scrape_and_insert_etfs_holding_data(missing_etfs)
+                unavailable_etfs = [ etf for etf in missing_etfs if etf.upper() not in scraped ]
         for etf in etfs:
+            if etf in unavailable_etfs:
+                continue
             assert isinstance(etf, str)
             try:
                 data = self.get_holdings_and_weights_for_etf(
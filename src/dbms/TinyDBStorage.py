@@ -0,0 +1,204 @@
+# TinyDBStorage.py
+
+# standard library dependencies
+import os
+import json
+import logging
+logger = logging.getLogger(f"mainLogger.TinyDBStorage")
+import threading
+from typing import Any, Iterable, List, Mapping, Tuple, Union
+
+# external dependencies
+from tinydb import TinyDB
+from tinydb.storages import Storage, touch
+from tinydb.middlewares import CachingMiddleware
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(data: Any) -> bytes:
+    """Serializes `data` to compact JSON, with `orjson` if it's installed.
+
+    Examples
+    --------
+    >>> dumps({"_default": {"1": {"name": "ARKK", "date": "2022-01-03"}}})
+    b'{"_default":{"1":{"name":"ARKK","date":"2022-01-03"}}}'
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def loads(content: bytes) -> Any:
+    """Deserializes the JSON `content`, with `orjson` if it's installed."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content.decode("utf-8"))
+
+
+class CompactJSONStorage(Storage):
+    """TinyDB storage keeping the database in a compact JSON file (readable by TinyDB's `JSONStorage`),
+    (de)serialized with `orjson` when it's installed. Writes go to a temporary file that replaces
+    the database file once complete, so that a crash never leaves a truncated database behind.
+    """
+    def __init__(self, path: str, create_dirs: bool = False):
+        super().__init__()
+        self.path = path
+        touch(path, create_dirs=create_dirs)
+
+    def read(self) -> Union[None, Mapping[str, Mapping[str, Any]]]:
+        with open(self.path, "rb") as handle:
+            content = handle.read()
+        # TinyDB initializes empty files itself
+        return loads(content) if len(content) > 0 else None
+
+    def write(self, data: Mapping[str, Mapping[str, Any]]) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(dumps(data))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        pass
+
+
+class IndexedTinyDB:
+    """TinyDB database of `{"name": <ETF ticker>, "date": <yyyy-mm-dd>, "holdings": {...}}` records,
+    indexed by (name, date).
+
+    The database is read from disk once and then served from memory (see `tinydb.middlewares.CachingMiddleware`),
+    and the index maps each (name, date) to its document ID, so lookups never scan (nor deserialize) the documents.
+    Each batch of inserts is written to disk right away, in a single write. Other processes (e.g. `prefetch.py`) 
+    write to the same file, so the database and its index are reloaded whenever the file has changed on disk.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     store = IndexedTinyDB(os.path.join(directory, "db.json"))
+    ...     store.insert_multiple([{"name": "ARKK", "date": "2022-01-03", "holdings": {"TSLA": {"weight": 0.1}}}])
+    ...     other_store = IndexedTinyDB(os.path.join(directory, "db.json"))
+    ...     assert other_store.get("ARKK", "2022-01-03") == {"TSLA": {"weight": 0.1}}
+    ...     store.insert_multiple([{"name": "ARKW", "date": "2022-01-03", "holdings": {"TSLA": {"weight": 0.2}}}])
+    ...     assert other_store.names() == ["ARKK", "ARKW"]
+    ...     assert other_store.get("ARKK", "2022-01-04") is None
+    ...     store.close(); other_store.close()
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self._load()
+
+    def _file_signature(self) -> Union[None, Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.db_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _load(self) -> None:
+        """(Re-)reads the database file and rebuilds the index."""
+        self.db = TinyDB(self.db_path, storage=CachingMiddleware(CompactJSONStorage))
+        # name -> date -> document ID
+        self.index: Mapping[str, Mapping[str, int]] = dict()
+        for document in self.db.all():
+            dates = self.index.setdefault(document["name"], dict())
+            # the latest record of each (name, date) wins (see `insert_multiple`)
+            dates[document["date"]] = max(document.doc_id, dates.get(document["date"], 0))
+        self.file_signature = self._file_signature()
+
+    def _refresh(self) -> None:
+        """Reloads the database if another process has rewritten its file since it was last read or written."""
+        if self._file_signature() != self.file_signature:
+            logger.info(f"Reloading the TinyDB database {self.db_path}, which changed on disk")
+            self._load()
+
+    def names(self) -> List[str]:
+        """Returns the names of the ETFs with at least one record."""
+        with self.lock:
+            self._refresh()
+            return list(self.index.keys())
+
+    def contains(self, name: str, date_: str) -> bool:
+        with self.lock:
+            self._refresh()
+            return date_ in self.index.get(name, dict())
+
+    def get(self, name: str, date_: str) -> Union[None, Mapping[str, Mapping]]:
+        """Returns the holdings recorded for the ETF `name` on `date_` (None if there aren't any)."""
+        with self.lock:
+            self._refresh()
+            doc_id = self.index.get(name, dict()).get(date_)
+            if doc_id is None:
+                return None
+            return self.db.get(doc_id=doc_id)["holdings"]
+
+    def search(self, name: str, start: str, end: str) -> List[Tuple[str, Mapping[str, Mapping]]]:
+        """Returns the `(date, holdings)` recorded for the ETF `name` between `start` and `end` (inclusive), by date."""
+        with self.lock:
+            self._refresh()
+            dates = sorted( date_ for date_ in self.index.get(name, dict()).keys() if start <= date_ <= end )
+            return [ (date_, self.db.get(doc_id=self.index[name][date_])["holdings"]) for date_ in dates ]
+
+    def latest_date(self, before: str = None) -> Union[None, str]:
+        """Returns the latest date with at least one record (strictly earlier than `before` if provided)."""
+        with self.lock:
+            self._refresh()
+            dates = [
+                date_ for dates in self.index.values() for date_ in dates.keys()
+                if before is None or date_ < before
+            ]
+        return max(dates) if len(dates) > 0 else None
+
+    def snapshot(self, date_: str, names: Iterable[str] = None) -> Mapping[str, Mapping[str, Mapping]]:
+        """Returns the holdings recorded on `date_` for all ETFs (or only for `names`), by ETF name."""
+        with self.lock:
+            self._refresh()
+            names = self.index.keys() if names is None else names
+            return {
+                name: self.db.get(doc_id=self.index[name][date_])["holdings"]
+                for name in names
+                if date_ in self.index.get(name, dict())
+            }
+
+    def insert_multiple(self, records: Iterable[Mapping[str, Any]]) -> None:
+        """Inserts the `records` in a single write, replacing the records of the same (name, date)."""
+        records = list(records)
+        with self.lock:
+            self._refresh()
+            replaced = [
+                self.index[record["name"]][record["date"]] for record in records
+                if record["date"] in self.index.get(record["name"], dict())
+            ]
+            doc_ids = self.db.insert_multiple(records)
+            for record, doc_id in zip(records, doc_ids):
+                self.index.setdefault(record["name"], dict())[record["date"]] = doc_id
+            if len(replaced) > 0:
+                self.db.remove(doc_ids=replaced)
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the pending writes to disk."""
+        with self.lock:
+            self.db.storage.flush()
+            self.file_signature = self._file_signature()
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+# process-wide databases, one per database file, such that clients never
+# hold diverging in-memory copies of the same file
+_databases: Mapping[str, IndexedTinyDB] = dict()
+_databases_lock = threading.Lock()
+
+def get_indexed_tinydb(db_path: str) -> IndexedTinyDB:
+    """Returns the process-wide `IndexedTinyDB` of the database file at `db_path`."""
+    db_path = os.path.abspath(db_path)
+    with _databases_lock:
+        if db_path not in _databases:
+            _databases[db_path] = IndexedTinyDB(db_path)
+        return _databases[db_path]
@@ -1,9 +1,9 @@
 # standard library dependencies
 import json
 import datetime
-from functools import lru_cache
 from datetime import date
-from typing import List, Tuple, Any, Iterable, Union, Mapping
+from contextlib import contextmanager
+from typing import List, Tuple, Any, Iterable, Iterator, Union, Mapping
 
 # external dependencies
 import boto3
@@ -12,6 +12,7 @@ import psycopg2
 # local dependencies
 from .SQLDatabaseClient import SQLDatabaseClient
 from ..scraping import scrape_etf_holdings
+from ..cache import cached_holdings
 
 
 def load_credentials(credentials_filepath: str) -> Mapping[str,str]:
@@ -58,6 +59,107 @@ class PostgresDatabaseClient(SQLDatabaseClient):
         FOREIGN KEY (Holding_ID) REFERENCES holdings_table (Holding_ID)
         );
         '''
+
+    @property
+    def minhash_table_creation_query(self) -> str:
+        """Postgres query to create the `etf_minhash_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_minhash_table(
+            Date DATE,
+            ETF_ticker_ID integer,
+            Weighted integer,
+            Signature bytea,
+        PRIMARY KEY (Date, ETF_ticker_ID, Weighted),
+        FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def lsh_bucket_table_creation_query(self) -> str:
+        """Postgres query to create the `etf_lsh_bucket_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_lsh_bucket_table(
+            Date DATE,
+            Weighted integer,
+            Band integer,
+            Bucket varchar(16),
+            ETF_ticker_ID integer,
+        PRIMARY KEY (Date, Weighted, Band, Bucket, ETF_ticker_ID),
+        FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def similarity_table_creation_query(self) -> str:
+        """Postgres query to create the `etf_similarity_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS etf_similarity_table(
+            Date DATE,
+            ETF_ticker_ID_1 integer,
+            ETF_ticker_ID_2 integer,
+            Measure varchar(32),
+            Similarity real,
+        PRIMARY KEY (Date, Measure, ETF_ticker_ID_1, ETF_ticker_ID_2),
+        FOREIGN KEY (ETF_ticker_ID_1) REFERENCES etf_ticker_table (ETF_ticker_ID),
+        FOREIGN KEY (ETF_ticker_ID_2) REFERENCES etf_ticker_table (ETF_ticker_ID)
+        );
+        '''
+
+    @property
+    def schema_migrations_table_creation_query(self) -> str:
+        """Postgres query to create the `schema_migrations_table` table"""
+        return '''CREATE TABLE IF NOT EXISTS schema_migrations_table(
+            Version integer PRIMARY KEY,
+            Description varchar(255),
+            Applied_At timestamp DEFAULT CURRENT_TIMESTAMP
+        );
+        '''
+
+    @property
+    def schema_migrations(self) -> List[Tuple[int, str, List[str]]]:
+        """Postgres schema migrations (see `SQLDatabaseClient.migrate`)"""
+        return [
+            (1, "Index etf_holdings_table by ETF and date", [
+                # the unique index can only be created once duplicated rows are gone
+                '''DELETE FROM etf_holdings_table WHERE Row_ID NOT IN (
+                    SELECT MIN(Row_ID) FROM etf_holdings_table GROUP BY ETF_ticker_ID, Date, Holding_ID
+                );''',
+                # serves the per-ETF reads of `get_holdings_and_weights_for_etf` with index-only scans
+                '''CREATE UNIQUE INDEX IF NOT EXISTS etf_holdings_etf_date_holding_idx 
+                ON etf_holdings_table (ETF_ticker_ID, Date, Holding_ID) INCLUDE (Holding_Weight);''',
+                # covers the by-date reads (`MAX(Date)`, `get_holdings_snapshot`) without touching the table
+                '''CREATE INDEX IF NOT EXISTS etf_holdings_date_etf_idx 
+                ON etf_holdings_table (Date, ETF_ticker_ID) INCLUDE (Holding_ID, Holding_Weight);''',
+                "ANALYZE etf_holdings_table;",
+            ]),
+            (2, "Add the tables of the 'intervals' holdings history", [
+                '''CREATE TABLE IF NOT EXISTS etf_snapshot_dates_table(
+                    Date DATE,
+                    ETF_ticker_ID integer,
+                PRIMARY KEY (ETF_ticker_ID, Date),
+                FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID)
+                );''',
+                # `Valid_To` is exclusive, and null while the holding keeps its weight
+                '''CREATE TABLE IF NOT EXISTS etf_holding_intervals_table(
+                    ETF_ticker_ID integer,
+                    Holding_ID integer,
+                    Holding_Weight real,
+                    Valid_From DATE,
+                    Valid_To DATE,
+                PRIMARY KEY (ETF_ticker_ID, Holding_ID, Valid_From),
+                FOREIGN KEY (ETF_ticker_ID) REFERENCES etf_ticker_table (ETF_ticker_ID),
+                FOREIGN KEY (Holding_ID) REFERENCES holdings_table (Holding_ID)
+                );''',
+                # serves the reconstruction of the holdings on a date (see `SQLDatabaseClient.holdings_records_query`)
+                '''CREATE INDEX IF NOT EXISTS etf_holding_intervals_etf_validity_idx 
+                ON etf_holding_intervals_table (ETF_ticker_ID, Valid_From, Valid_To) INCLUDE (Holding_ID, Holding_Weight);''',
+                "CREATE INDEX IF NOT EXISTS etf_snapshot_dates_date_idx ON etf_snapshot_dates_table (Date);",
+            ]),
+            (3, "Add the settings table shared by the clients of the database", [
+                # e.g. the 'holdings_history' mode (see `SQLDatabaseClient.load_holdings_history`)
+                '''CREATE TABLE IF NOT EXISTS settings_table(
+                    Setting varchar(255) PRIMARY KEY,
+                    Value varchar(255)
+                );''',
+            ]),
+        ]
     
     def execute_query(  self, 
                         query: str, 
@@ -128,11 +230,56 @@ class PostgresDatabaseClient(SQLDatabaseClient):
                     results.append(cur.fetchall())
         return results if get_results else None
 
-    @lru_cache(maxsize = None)
+    @contextmanager
+    def transaction(self) -> Iterator[Any]:
+        conn = psycopg2.connect(
+            host=self.__credentials['ENDPOINT'], 
+            port=self.__credentials['PORT'], 
+            database=self.__credentials['DBNAME'], 
+            user=self.__credentials['USER'], 
+            password=self.__credentials['PASSWORD'], 
+            sslrootcert="SSLCERTIFICATE")
+        try:
+            with conn:
+                yield conn.cursor()
+        finally:
+            conn.close()
+
+    def insert_and_fetch_holding_ids(self, cur: Any, holding_tickers: List[str]) -> Mapping[str, int]:
+        cur.executemany(
+            f"INSERT INTO holdings_table (Holding) VALUES ({self.__placeholder}) ON CONFLICT (Holding) DO NOTHING;",
+            [ (holding_ticker,) for holding_ticker in holding_tickers ]
+        )
+        cur.execute(
+            f"SELECT Holding, Holding_ID FROM holdings_table WHERE Holding = ANY({self.__placeholder});",
+            (holding_tickers,)
+        )
+        return dict(cur.fetchall())
+
+    def insert_etf_ticker(self, cur: Any, etf_ticker: str) -> int:
+        cur.execute(
+            f"INSERT INTO etf_ticker_table (ETF_ticker) VALUES ({self.__placeholder}) ON CONFLICT (ETF_ticker) DO NOTHING;",
+            (etf_ticker,)
+        )
+        cur.execute(
+            f"SELECT ETF_ticker_ID FROM etf_ticker_table WHERE ETF_ticker = {self.__placeholder};",
+            (etf_ticker,)
+        )
+        return cur.fetchall()[0][0]
+
+    def insert_holdings_records(self, cur: Any, holdings: List[Tuple[date, int, int, float]]) -> None:
+        cur.executemany(
+            f"""INSERT INTO etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight)
+            VALUES ({self.__placeholder}, {self.__placeholder}, {self.__placeholder}, {self.__placeholder});
+            """,
+            holdings
+        )
+
+    @cached_holdings
     def get_holdings_and_weights_for_etf(   self, 
                                             etf_ticker: str,
                                             date_: date = None) -> List[Tuple[datetime.date, str, str, float]]:  
-        """LRU-cached method to fetch holding and weights data for the 
+        """Cached (see `src.cache.cached_holdings`) method to fetch holding and weights data for the 
         ETF specified by the `etf_name` ticker from the TinyDB database. 
         If no data for said ETF is present, this function will attempt to scrape
         (see `..scraping.scrape_etf_holdings`) and insert it into the TinyDB database.
@@ -155,8 +302,7 @@ class PostgresDatabaseClient(SQLDatabaseClient):
 
         query = f"""SELECT major.Date, minor.ETF_ticker, other.Holding, major.Holding_Weight 
         FROM (
-            select etf_holdings_table.* from etf_holdings_table where ETF_ticker_ID = {self.__placeholder} 
-            and Date = {self.__placeholder} 
+            {self.holdings_records_query(per_etf=True)}
         ) as major 
         INNER JOIN etf_ticker_table as minor on major.ETF_ticker_ID = minor.ETF_ticker_ID 
         LEFT JOIN holdings_table as other on major.Holding_ID = other.Holding_ID;
@@ -245,6 +391,6 @@ class PostgresDatabaseClient(SQLDatabaseClient):
         else:
             holdings: List[Tuple[datetime.date, str, str, float]] = self.execute_query(
                 query, 
-                (etf_ticker_id, self.today)
+                (self.today, etf_ticker_id)
             )
         return holdings
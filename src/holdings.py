@@ -0,0 +1,233 @@
+# holdings.py
+
+# standard library dependencies
+from datetime import date
+from typing import Mapping, List, Iterable, Union, Tuple, Any
+
+# external dependencies
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class HoldingsMatrix:
+    """Sparse (holdings x ETFs) matrix of holding weights.
+
+    `weights[h, e]` is the weight of the `h`th holding (see `holdings`)
+    in the `e`th ETF (see `etfs`); holdings that an ETF doesn't hold
+    aren't stored at all, so the memory footprint grows with the number
+    of (ETF, holding) pairs rather than with `len(holdings) * len(etfs)`.
+
+    Examples
+    --------
+    >>> query_output = {'etf1': {'A': {'weight': 0.2}, 'B': {'weight': 0.3}}, 'etf2': {'C': {'weight': 1.0}}}
+    >>> matrix = HoldingsMatrix.from_query_output(query_output)
+    >>> assert matrix.shape == (3, 2)
+    >>> assert matrix.holdings == ['A', 'B', 'C'] and matrix.etfs == ['etf1', 'etf2']
+    >>> assert matrix.column('etf2').tolist() == [0.0, 0.0, 1.0]
+    >>> assert matrix.to_dict() == {"etf1": [0.2, 0.3, 0.0], "etf2": [0.0, 0.0, 1.0]}
+    >>> assert matrix.subset(['etf2']).to_dict() == {"etf2": [0.0, 0.0, 1.0]}
+    """
+    def __init__(   self,
+                    weights: Union[np.ndarray, sparse.spmatrix],
+                    holdings: List[str],
+                    etfs: List[str]):
+        weights = sparse.csr_matrix(weights, dtype=float)
+        assert weights.shape == (len(holdings), len(etfs)), \
+            f"`weights` has shape {weights.shape}; expected {(len(holdings), len(etfs))}"
+        weights.eliminate_zeros()
+        self.weights: sparse.csr_matrix = weights
+        self.holdings: List[str] = list(holdings)
+        self.etfs: List[str] = list(etfs)
+        self.holding_index: Mapping[str, int] = { holding: i for i, holding in enumerate(self.holdings) }
+        self.etf_index: Mapping[str, int] = { etf: i for i, etf in enumerate(self.etfs) }
+
+    @classmethod
+    def from_query_output(  cls,
+                            query_output: Mapping[str, Mapping[str, Mapping]],
+                            holdings: List[str] = None) -> "HoldingsMatrix":
+        """Builds a `HoldingsMatrix` from the output of `get_holdings_and_weights_for_etfs`.
+
+        Parameters
+        ----------
+        query_output : Mapping[str, Mapping[str, Mapping]]
+            Dictionary mapping an ETF ticker (strings) to a sub-dictionary
+            mapping the ETF's holdings (strings) to metadata (e.g. the holding's weight
+            w.r.t. the ETF).
+            See the documentation for the `get_holdings_and_weights_for_etfs` method from
+            `src.dbms.SQLDatabaseClient` or `src.dbms.TinyDBDatabaseClient`.
+        holdings : List[str], optional
+            Holdings (rows) to consider, in order. Holdings absent from this list are ignored.
+            By default None, which gets replaced by the sorted list of all holdings in `query_output`.
+
+        Returns
+        -------
+        HoldingsMatrix
+            The (holdings x ETFs) matrix, with ETFs (columns) ordered as in `query_output`.
+        """
+        if holdings is None:
+            holdings = sorted({
+                holding
+                for etf_holdings_dict in query_output.values()
+                for holding in etf_holdings_dict.keys()
+            })
+        holding_index = { holding: i for i, holding in enumerate(holdings) }
+        rows: List[int] = []
+        columns: List[int] = []
+        data: List[float] = []
+        for j, etf_holdings_dict in enumerate(query_output.values()):
+            for holding, metadata in etf_holdings_dict.items():
+                i = holding_index.get(holding)
+                if i is None:
+                    continue
+                rows.append(i)
+                columns.append(j)
+                data.append(metadata['weight'])
+        weights = sparse.csr_matrix(
+            (np.array(data, dtype=float), (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64))),
+            shape = (len(holdings), len(query_output))
+        )
+        return cls(weights, holdings, list(query_output.keys()))
+
+    @property
+    def shape(self):
+        return self.weights.shape
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes used by the underlying sparse arrays."""
+        return self.weights.data.nbytes + self.weights.indices.nbytes + self.weights.indptr.nbytes
+
+    def __len__(self) -> int:
+        return len(self.etfs)
+
+    def __contains__(self, etf: str) -> bool:
+        return etf in self.etf_index
+
+    def presence(self) -> sparse.csr_matrix:
+        """Returns the boolean (holdings x ETFs) matrix indicating which ETFs hold which holdings."""
+        return self.weights > 0
+
+    def column(self, etf: str) -> np.ndarray:
+        """Returns the dense vector of holding weights for `etf`."""
+        return self.weights[:, self.etf_index[etf]].toarray().ravel()
+
+    def columns(self) -> Iterable[np.ndarray]:
+        """Iterates over the dense vectors of holding weights of each ETF (in the order of `etfs`)."""
+        weights = self.weights.tocsc()
+        for j in range(len(self.etfs)):
+            yield weights[:, j].toarray().ravel()
+
+    def subset(self, etfs: Iterable[str]) -> "HoldingsMatrix":
+        """Returns a new `HoldingsMatrix` restricted to (and ordered as) `etfs`."""
+        etfs = list(etfs)
+        return HoldingsMatrix(
+            self.weights[:, [ self.etf_index[etf] for etf in etfs ]],
+            self.holdings,
+            etfs
+        )
+
+    def to_dict(self) -> Mapping[str, List[float]]:
+        """Returns a dictionary mapping each ETF to its (dense) list of holding weights."""
+        return {
+            etf: vector.tolist()
+            for etf, vector in zip(self.etfs, self.columns())
+        }
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns the matrix as a (dense) Pandas DataFrame with holdings as the index and ETFs as columns."""
+        return pd.DataFrame(
+            self.weights.toarray(),
+            index = self.holdings,
+            columns = self.etfs
+        )
+
+
+class HoldingsHistory:
+    """Dense (dates x holdings) array of the holding weights of one ETF over time.
+
+    `weights[d, h]` is the weight of the `h`th holding (see `holdings`) in the ETF
+    on the `d`th date (see `dates`, sorted in increasing order); holdings that the ETF
+    didn't hold on a date have a weight of 0.0.
+
+    Examples
+    --------
+    >>> records = [('2022-01-04', 'B', 0.5), ('2022-01-03', 'A', 1.0), ('2022-01-04', 'A', 0.5)]
+    >>> history = HoldingsHistory.from_records('etf1', records)
+    >>> assert history.dates == ['2022-01-03', '2022-01-04'] and history.holdings == ['A', 'B']
+    >>> assert history.weights.tolist() == [[1.0, 0.0], [0.5, 0.5]]
+    >>> assert history.snapshot('2022-01-04') == {'A': {'weight': 0.5}, 'B': {'weight': 0.5}}
+    >>> assert history.reindex(['2022-01-04'], ['C', 'B']).weights.tolist() == [[0.0, 0.5]]
+    """
+    def __init__(   self,
+                    etf: str,
+                    weights: np.ndarray,
+                    dates: List[Union[date, str]],
+                    holdings: List[str]):
+        weights = np.asarray(weights, dtype=float)
+        assert weights.shape == (len(dates), len(holdings)), \
+            f"`weights` has shape {weights.shape}; expected {(len(dates), len(holdings))}"
+        self.etf: str = etf
+        self.weights: np.ndarray = weights
+        self.dates: List[Union[date, str]] = list(dates)
+        self.holdings: List[str] = list(holdings)
+        self.date_index: Mapping[Union[date, str], int] = { date_: i for i, date_ in enumerate(self.dates) }
+        self.holding_index: Mapping[str, int] = { holding: i for i, holding in enumerate(self.holdings) }
+
+    @classmethod
+    def from_records(   cls,
+                        etf: str,
+                        records: Iterable[Tuple[Union[date, str], str, float]]) -> "HoldingsHistory":
+        """Builds a `HoldingsHistory` from `(date, holding, weight)` records, 
+        e.g. the rows returned by `get_holdings_history` (in any order)."""
+        records = list(records)
+        dates = sorted({ date_ for (date_, _, _) in records })
+        holdings = sorted({ holding for (_, holding, _) in records })
+        date_index = { date_: i for i, date_ in enumerate(dates) }
+        holding_index = { holding: i for i, holding in enumerate(holdings) }
+        weights = np.zeros((len(dates), len(holdings)))
+        if len(records) > 0:
+            weights[
+                np.fromiter( (date_index[date_] for (date_, _, _) in records), dtype=np.int64, count=len(records) ),
+                np.fromiter( (holding_index[holding] for (_, holding, _) in records), dtype=np.int64, count=len(records) )
+            ] = np.fromiter( (weight for (_, _, weight) in records), dtype=float, count=len(records) )
+        return cls(etf, weights, dates, holdings)
+
+    @property
+    def shape(self):
+        return self.weights.shape
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __contains__(self, date_: Any) -> bool:
+        return date_ in self.date_index
+
+    def snapshot(self, date_: Union[date, str]) -> Mapping[str, Mapping[str, float]]:
+        """Returns the holdings of the ETF on `date_`, formatted like the values 
+        returned by `get_holdings_and_weights_for_etfs`."""
+        row = self.weights[self.date_index[date_]]
+        return { self.holdings[i]: dict(weight=float(row[i])) for i in np.flatnonzero(row) }
+
+    def reindex(self, 
+                dates: Iterable[Union[date, str]] = None,
+                holdings: Iterable[str] = None) -> "HoldingsHistory":
+        """Returns a new `HoldingsHistory` restricted to (and ordered as) `dates` (which must be in `dates`),
+        with the columns of `holdings` (holdings the ETF never held get all-zero columns).
+        Both default to None, which keeps the current dates or holdings."""
+        dates = self.dates if dates is None else list(dates)
+        holdings = self.holdings if holdings is None else list(holdings)
+        weights = np.zeros((len(dates), len(holdings)))
+        columns = [ (j, self.holding_index[holding]) for j, holding in enumerate(holdings) if holding in self.holding_index ]
+        if len(columns) > 0:
+            new_columns, old_columns = map(list, zip(*columns))
+            weights[:, new_columns] = self.weights[[ self.date_index[date_] for date_ in dates ]][:, old_columns]
+        return HoldingsHistory(self.etf, weights, dates, holdings)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns the history as a Pandas DataFrame with dates as the index and holdings as columns."""
+        return pd.DataFrame(
+            self.weights,
+            index = self.dates,
+            columns = self.holdings
+        )
@@ -0,0 +1,176 @@
+# minhash.py
+
+# standard library dependencies
+import hashlib
+from functools import lru_cache
+from typing import Mapping, List, Tuple, Iterable, Set, Hashable
+
+# external dependencies
+import numpy as np
+
+_MAX_HASH = (1 << 32) - 1
+
+def hash_holding(holding: str) -> int:
+    """Stable (i.e. identical across processes) 32-bit hash of a holding ticker."""
+    return int.from_bytes(
+        hashlib.blake2b(holding.upper().encode('utf-8'), digest_size=4).digest(),
+        'little'
+    )
+
+@lru_cache(maxsize=16384)
+def weighted_samples(seed: int, num_perm: int, holding_hash: int) -> np.ndarray:
+    """Returns the read-only `(3, num_perm)` array of the (r, c, beta) random variables of 
+    the holding with hash `holding_hash` used by `WeightedMinHasher`. They only depend on the 
+    holding (and seed) so that they are consistent across ETFs, and are cached by holding since 
+    seeding a generator costs more than the rest of the signature; 16384 holdings take 48MiB for 128 permutations."""
+    rng = np.random.default_rng([seed, holding_hash])
+    samples = np.stack([
+        rng.gamma(2.0, 1.0, size=num_perm),
+        rng.gamma(2.0, 1.0, size=num_perm),
+        rng.uniform(0.0, 1.0, size=num_perm),
+    ])
+    samples.setflags(write=False)
+    return samples
+
+class MinHasher:
+    """Computes MinHash signatures of sets of holdings; the fraction of equal
+    entries between two signatures is an unbiased estimate of the Jaccard similarity
+    between the corresponding sets of holdings.
+
+    Examples
+    --------
+    >>> minhasher = MinHasher(num_perm=256)
+    >>> signature1 = minhasher.signature(['A', 'B', 'C', 'D'])
+    >>> signature2 = minhasher.signature(['A', 'B', 'C', 'E'])
+    >>> assert signature1.shape == (256,)
+    >>> assert abs(estimate_similarity(signature1, signature2) - 3/5) < 0.15
+    >>> assert estimate_similarity(signature1, minhasher.signature(['D', 'C', 'B', 'A'])) == 1.0
+    """
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # multiply-add-shift hashing: ((a * x + b) mod 2**64) >> 32
+        self._a = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True)
+        self._b = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True)
+
+    def signature(self, holdings: Iterable[str]) -> np.ndarray:
+        """Returns the `num_perm`-long uint64 MinHash signature of `holdings`."""
+        hashes = np.array([ hash_holding(holding) for holding in holdings ], dtype=np.uint64)
+        if len(hashes) == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) >> np.uint64(32)
+        return permuted.min(axis=1)
+
+class WeightedMinHasher:
+    """Computes weighted MinHash signatures of weighted holdings using Ioffe's
+    Improved Consistent Weighted Sampling; the fraction of equal entries between two
+    signatures is an estimate of the weighted Jaccard similarity between the holdings' weights
+    (see `src.utils.weighted_jaccard_distance`).
+
+    References
+    ----------
+    - Ioffe, S. (2010). Improved Consistent Sampling, Weighted Minhash and L1 Sketching. ICDM.
+
+    Examples
+    --------
+    >>> minhasher = WeightedMinHasher(num_perm=256)
+    >>> signature1 = minhasher.signature({'A': 0.5, 'B': 0.5})
+    >>> signature2 = minhasher.signature({'A': 0.1, 'D': 0.3, 'E': 0.3, 'F': 0.3})
+    >>> assert abs(estimate_similarity(signature1, signature2) - 0.1/1.9) < 0.1
+    >>> assert estimate_similarity(signature1, minhasher.signature({'B': 0.5, 'A': 0.5})) == 1.0
+    """
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        self.seed = seed
+
+    def signature(self, weights: Mapping[str, float]) -> np.ndarray:
+        """Returns the `num_perm`-long uint64 weighted MinHash signature of the
+        `{holding: weight}` mapping `weights` (holdings with weights <= 0 are ignored)."""
+        weights = { holding: weight for holding, weight in weights.items() if weight > 0 }
+        if len(weights) == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        holding_hashes = np.array([ hash_holding(holding) for holding in weights.keys() ], dtype=np.uint64)
+        samples = np.stack([ weighted_samples(self.seed, self.num_perm, int(holding_hash)) for holding_hash in holding_hashes ])
+        r, c, beta = samples[:, 0], samples[:, 1], samples[:, 2]
+        log_weights = np.log(np.fromiter(weights.values(), dtype=float))[:, None]
+
+        t = np.floor(log_weights / r + beta)
+        ln_y = r * (t - beta)
+        ln_a = np.log(c) - ln_y - r
+        chosen = ln_a.argmin(axis=0)
+        chosen_t = t[chosen, np.arange(self.num_perm)].astype(np.int64)
+        # fold each (holding, t) sample into a single 64-bit value
+        return holding_hashes[chosen] ^ (chosen_t.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15))
+
+def estimate_similarity(signature1: np.ndarray, signature2: np.ndarray) -> float:
+    """Estimates the (weighted) Jaccard similarity between the sets that produced two signatures."""
+    assert signature1.shape == signature2.shape, \
+        "`estimate_similarity` is meant to be applied to signatures of equal lengths."
+    return float(np.mean(signature1 == signature2))
+
+def signature_to_bytes(signature: np.ndarray) -> bytes:
+    """Serializes a signature for storage in a database."""
+    return np.asarray(signature, dtype='<u8').tobytes()
+
+def signature_from_bytes(data: bytes) -> np.ndarray:
+    """Deserializes a signature serialized with `signature_to_bytes`."""
+    return np.frombuffer(bytes(data), dtype='<u8').astype(np.uint64)
+
+def optimal_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """Returns the (number of bands, rows per band) minimizing the sum of the
+    false positive and false negative probabilities of an LSH index for the given
+    similarity `threshold`.
+
+    Examples
+    --------
+    >>> bands, rows = optimal_bands(128, 0.5)
+    >>> assert bands * rows <= 128
+    >>> assert optimal_bands(128, 0.9)[1] > rows
+    """
+    similarities = np.linspace(0.0, 1.0, 1001)
+    best, best_error = (1, num_perm), float('inf')
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        candidate_probabilities = 1.0 - (1.0 - similarities ** rows) ** bands
+        below = similarities <= threshold
+        false_positives = np.mean(np.where(below, candidate_probabilities, 0.0))
+        false_negatives = np.mean(np.where(below, 0.0, 1.0 - candidate_probabilities))
+        if false_positives + false_negatives < best_error:
+            best, best_error = (bands, rows), false_positives + false_negatives
+    return best
+
+def band_buckets(signature: np.ndarray, bands: int, rows: int) -> List[str]:
+    """Returns the LSH bucket key (hex string) of each of the signature's `bands` bands."""
+    return [
+        hashlib.blake2b(signature_to_bytes(signature[band*rows:(band+1)*rows]), digest_size=8).hexdigest()
+        for band in range(bands)
+    ]
+
+class LSHIndex:
+    """In-memory banded LSH index over MinHash signatures; keys whose signatures
+    agree on at least one band are returned as candidates by `query`.
+
+    Examples
+    --------
+    >>> minhasher = MinHasher(num_perm=128)
+    >>> index = LSHIndex(num_perm=128, threshold=0.8)
+    >>> index.insert('etf1', minhasher.signature([f'T{i}' for i in range(100)]))
+    >>> index.insert('etf2', minhasher.signature([f'T{i}' for i in range(95)]))
+    >>> index.insert('etf3', minhasher.signature([f'X{i}' for i in range(100)]))
+    >>> assert index.query(minhasher.signature([f'T{i}' for i in range(100)])) == {'etf1', 'etf2'}
+    """
+    def __init__(self, num_perm: int = 128, threshold: float = 0.5):
+        self.num_perm = num_perm
+        self.bands, self.rows = optimal_bands(num_perm, threshold)
+        self.buckets: List[Mapping[str, Set[Hashable]]] = [ dict() for _ in range(self.bands) ]
+
+    def insert(self, key: Hashable, signature: np.ndarray) -> None:
+        for band, bucket in enumerate(band_buckets(signature, self.bands, self.rows)):
+            self.buckets[band].setdefault(bucket, set()).add(key)
+
+    def query(self, signature: np.ndarray) -> Set[Hashable]:
+        candidates: Set[Hashable] = set()
+        for band, bucket in enumerate(band_buckets(signature, self.bands, self.rows)):
+            candidates.update(self.buckets[band].get(bucket, set()))
+        return candidates
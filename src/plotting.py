@@ -1,8 +1,9 @@
 # plotting.py 
 
 # standard library dependencies
+import io
 from functools import partial
-from typing import Mapping, List, Callable, Union
+from typing import Mapping, List, Tuple, Callable, Union
 
 # external dependencies
 import numpy as np
@@ -10,17 +11,24 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
+import matplotlib.patches as mpatches
+from matplotlib.collections import PolyCollection
 from scipy.spatial.distance import jaccard
 
 # local dependencies
+from .holdings import HoldingsMatrix
 from .utils import (
-    get_etf_holding_weight_vectors, 
-    get_contiguous_truthy_segments, 
+    get_holdings_matrix, 
+    get_truthy_runs_batched, 
     get_similarity, 
     weighted_jaccard_distance,
     asymmetric_coverage_overlap
 )
 
+# identifies the style below in the keys of the rendered figures (see `src.cache.render_key`);
+# to be changed along with it
+THEME = "classic-dark-1"
+
 plt.style.use('classic')
 plt.rcParams.update({
     "figure.facecolor": '#0e1117',  
@@ -42,13 +50,93 @@ plt.rcParams.update({
     'ytick.major.size': 1.0
 })
 
+def figure_to_png(fig: plt.Figure, **savefig_kwargs) -> bytes:
+    """Renders `fig` as PNG bytes (see `plt.Figure.savefig` for `savefig_kwargs`), then closes it
+    so that pyplot stops holding on to it.
+
+    Examples
+    --------
+    >>> fig = plt.figure()
+    >>> assert figure_to_png(fig, dpi=10).startswith(b"\\x89PNG")
+    >>> assert not plt.fignum_exists(fig.number)
+    """
+    buffer = io.BytesIO()
+    try:
+        fig.savefig(buffer, format = "png", **savefig_kwargs)
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
+
+def get_pixel_width(ax, dpi: float = None) -> int:
+    """Returns the width (in pixels) of the Matplotlib axis `ax` once rendered at `dpi`
+    dots per inch (by default, the figure's own DPI)."""
+    width = ax.get_window_extent().width
+    if dpi is not None:
+        width *= dpi / ax.figure.dpi
+    return max(1, int(np.ceil(width)))
+
+def downsample_columns(matrix: np.ndarray, max_columns: int = None) -> Tuple[np.ndarray, int]:
+    """Reduces the 2D `matrix` to at most `max_columns` columns by taking the maximum
+    of each bin of consecutive columns, such that nothing narrower than a pixel disappears.
+
+    Parameters
+    ----------
+    matrix : np.ndarray
+        2D array to downsample (e.g. the ETF x holding weights or presence matrix).
+    max_columns : int, optional
+        Maximum number of columns to keep (typically the pixel width of the axis), by default None
+        (no downsampling).
+
+    Returns
+    -------
+    Tuple[np.ndarray, int]
+        The downsampled matrix, and the number of columns of `matrix` in each of its columns
+        (the last one possibly holding fewer).
+
+    Examples
+    --------
+    >>> matrix, bin_width = downsample_columns(np.array([[0, 1, 0, 0, 3], [0, 0, 0, 2, 0]]), 3)
+    >>> matrix.tolist(), bin_width
+    ([[1, 0, 3], [0, 2, 0]], 2)
+    >>> matrix, bin_width = downsample_columns(np.array([[0, 1]]), 3)
+    >>> matrix.tolist(), bin_width
+    ([[0, 1]], 1)
+    """
+    n_columns = matrix.shape[1]
+    if max_columns is None or n_columns <= max_columns:
+        return matrix, 1
+    bin_width = -(-n_columns // max_columns)
+    return np.maximum.reduceat(matrix, np.arange(0, n_columns, bin_width), axis=1), bin_width
+
+def get_rectangles(left: np.ndarray, right: np.ndarray, bottom: np.ndarray, top: np.ndarray) -> np.ndarray:
+    """Returns the `(n_rectangles, 4, 2)` array of vertices of axis-aligned rectangles,
+    as expected by `matplotlib.collections.PolyCollection`.
+
+    Examples
+    --------
+    >>> get_rectangles(np.array([0]), np.array([1]), 0, np.array([2])).tolist()
+    [[[0, 0], [0, 2], [1, 2], [1, 0]]]
+    """
+    left, right, bottom, top = np.broadcast_arrays(left, right, bottom, top)
+    return np.stack([
+        np.stack([left, bottom], axis=-1),
+        np.stack([left, top], axis=-1),
+        np.stack([right, top], axis=-1),
+        np.stack([right, bottom], axis=-1)
+    ], axis=1)
+
 def plot_holding_track( etf_name: str, 
                         holding_weight_vector: List[float], 
                         color: str = 'white',
-                        ax = None) -> None:
+                        ax = None,
+                        max_columns: int = None) -> None:
     """Convenience function used to plot the holdings and weights
     of an ETF as a bar plot.
 
+    The bars are drawn as a single `PolyCollection` (rather than one artist per holding), 
+    and holdings get binned (keeping the largest weight of each bin) when there are more 
+    of them than `max_columns`.
+
     Parameters
     ----------
     etf_name : str
@@ -61,20 +149,42 @@ def plot_holding_track( etf_name: str,
     ax : [type], optional
         Matplotlib figure axis on which to plot the bar plot, by default None.
         Gets auto-generated if its default value of None is retained.
+    max_columns : int, optional
+        Maximum number of bars to draw, by default None, which gets replaced by
+        the pixel width of `ax`.
     """
     if ax is None:
         fig, ax = plt.subplots()
-    ax.bar(
-        list(range(len(holding_weight_vector))),
-        holding_weight_vector,
-        color = color
-    )
+    if max_columns is None:
+        max_columns = get_pixel_width(ax)
+    weights = np.asarray(holding_weight_vector, dtype=float)
+    binned_weights, bin_width = downsample_columns(weights[np.newaxis, :], max_columns)
+    positions = np.flatnonzero(binned_weights[0] > 0)
+    # unbinned bars leave a gap between neighbours, like `ax.bar`
+    padding = 0.1 if bin_width == 1 else 0.0
+    ax.add_collection(PolyCollection(
+        get_rectangles(
+            positions * bin_width + padding,
+            np.minimum((positions + 1) * bin_width, len(weights)) - padding,
+            0.0,
+            binned_weights[0, positions]
+        ),
+        facecolors = color,
+        edgecolors = 'none'
+    ))
+    ax.autoscale_view()
+    ax.set_xlim(0, max(1, len(weights)))
     ax.set_ylabel(f"% {etf_name}")
 
-def plot_holdings_tracks(query_output: Mapping[str, Mapping[str, Mapping]]) -> plt.Figure:
+def plot_holdings_tracks(query_output: Mapping[str, Mapping[str, Mapping]],
+                         holdings_matrix: HoldingsMatrix = None,
+                         dpi: float = None) -> plt.Figure:
     """Convenience function used to plot the vertical span chart indicating
     which holdings are held by each ETF. 
 
+    Each track (and the coverage chart) is drawn as a single `PolyCollection`, over
+    at most as many columns as the tracks are wide in pixels (see `downsample_columns`).
+
     Parameters
     ----------
     query_output : Mapping[str, Mapping[str, Mapping]]
@@ -83,53 +193,63 @@ def plot_holdings_tracks(query_output: Mapping[str, Mapping[str, Mapping]]) -> p
         w.r.t. the ETF).
         See the documentation for the `get_holdings_and_weights_for_etfs` method from
         `src.dbms.SQLDatabaseClient` or `src.dbms.TinyDBDatabaseClient`.
+    holdings_matrix : HoldingsMatrix, optional
+        Precomputed output of `get_holdings_matrix(query_output)`, by default None.
+    dpi : float, optional
+        Resolution the figure is going to be rendered at, used to decide how many
+        columns to draw, by default None (the figure's DPI).
 
     Returns
     -------
     plt.Figure
         Matplotlib figure containing the vertical span chart
     """
-    etf_holding_weight_vectors = get_etf_holding_weight_vectors(query_output)
+    if holdings_matrix is None:
+        holdings_matrix = get_holdings_matrix(query_output)
+    n_etfs = len(holdings_matrix.etfs)
+    n_holdings = len(holdings_matrix.holdings)
     fig, figax = plt.subplots(
         nrows = len(query_output)+1,
         figsize = (10, min(10,2*len(query_output))),
         sharex = True
     )
+    max_columns = get_pixel_width(figax[~0], dpi)
     
-    colours = list(mcolors.TABLEAU_COLORS.values())
-    ylabels: List[str] = []
-    for i, (etf_name, etf_holding_weight_vector) in enumerate(etf_holding_weight_vectors.items()):
+    # (ETFs x holdings) weights, one row per track
+    weights = holdings_matrix.weights.T.toarray()
+    for i, etf_name in enumerate(holdings_matrix.etfs):
         plot_holding_track(
             etf_name,
-            etf_holding_weight_vector,
-            ax = figax[i]
+            weights[i],
+            ax = figax[i],
+            max_columns = max_columns
         )
-        ylabels.append(etf_name)
-
-        bottom = i / len(etf_holding_weight_vectors)
-        top = bottom + 1/len(etf_holding_weight_vectors)
-        boundaries = get_contiguous_truthy_segments([i > 0 for i in etf_holding_weight_vector])
-        
-        for j, (start_inc, stop_exc) in enumerate(boundaries):
-            figax[~0].axvspan(
-                start_inc, 
-                stop_exc, 
-                ymin = bottom,
-                ymax = top,
-                zorder = -1,
-                color = colours[i%len(colours)],
-                alpha = 0.75,
-                label = etf_name if j == 0 else None
-            )
+
+    # coverage segments of every ETF at once; ETF `i` spans [i, i+1] vertically
+    presence, bin_width = downsample_columns(weights > 0, max_columns)
+    rows, starts, stops = get_truthy_runs_batched(presence)
+    colours = list(mcolors.TABLEAU_COLORS.values())
+    etf_colours = np.array([ mcolors.to_rgba(colours[i%len(colours)], alpha=0.75) for i in range(n_etfs) ])
+    figax[~0].add_collection(PolyCollection(
+        get_rectangles(starts * bin_width, np.minimum(stops * bin_width, n_holdings), rows, rows + 1),
+        facecolors = etf_colours[rows],
+        edgecolors = 'none',
+        zorder = -1
+    ))
+    figax[~0].set_xlim(0, max(1, n_holdings))
+    figax[~0].set_ylim(0, max(1, n_etfs))
     figax[~0].set_ylabel("ETF Coverage")
-    figax[~0].set_yticks(
-        [ y-len(etf_holding_weight_vectors) for y in list(range(len(etf_holding_weight_vectors)+1)) ]
-    )
-    figax[~0].set_yticklabels([""]+ylabels)
+    figax[~0].set_yticks(np.arange(n_etfs) + 0.5)
+    figax[~0].set_yticklabels(holdings_matrix.etfs)
     figax[~0].set_xticks([])
     
     # Put a legend below current axis
     figax[~0].legend(
+        handles = [
+            mpatches.Patch(color = etf_colours[i], label = etf_name)
+            for i, etf_name in enumerate(holdings_matrix.etfs)
+            if i in set(rows.tolist())
+        ],
         loc = 'upper center', 
         bbox_to_anchor = (0.5, -0.25),
         fancybox = True, 
@@ -147,7 +267,8 @@ def plot_holdings_tracks(query_output: Mapping[str, Mapping[str, Mapping]]) -> p
 def plot_similarity(query_output: Mapping[str, Mapping[str, Mapping]],
                     distance_measure: Union[str,Callable] = jaccard,
                     xlabel: str = None, 
-                    ylabel: str = None) -> plt.Figure:
+                    ylabel: str = None,
+                    similarities: Mapping[Tuple[str,str], float] = None) -> plt.Figure:
     """Plots the annotated heatmap indicating the distance between each ETF.
 
     Parameters
@@ -169,6 +290,10 @@ def plot_similarity(query_output: Mapping[str, Mapping[str, Mapping]],
     ylabel : str, optional
         String to use as y-axis label.
         By default None.
+    similarities : Mapping[Tuple[str,str], float], optional
+        Precomputed output of `get_similarity` (or one of the outputs of `get_similarities`)
+        for `query_output` and `distance_measure`; computed on the fly if None.
+        By default None.
 
     Returns
     -------
@@ -176,10 +301,11 @@ def plot_similarity(query_output: Mapping[str, Mapping[str, Mapping]],
         Matplotlib figure containing the annotated heatmap indicating the distance 
         between each ETF
     """
-    similarities = get_similarity(
-        query_output,
-        distance_measure = distance_measure
-    )
+    if similarities is None:
+        similarities = get_similarity(
+            query_output,
+            distance_measure = distance_measure
+        )
     etf_names = sorted(
         set(etf_name for etf_pair in similarities.keys() for etf_name in etf_pair)
     )
@@ -1,23 +1,94 @@
 # standard library dependencies
+import asyncio
 import logging
 logger = logging.getLogger(f"mainLogger.scrape_etf_holdings")
-from typing import Mapping
+import threading
+from typing import Callable, Iterable, Mapping, Tuple
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # local dependencies
+from .sessions import AsyncSessions
+from .response_store import ResponseStore, NotModified
 from .ishares_scraper import FUNDS as ishares_etf_tickers
+from .ishares_scraper import get_fund_file as get_ishares_fund_url
 from .ishares_scraper import fetch as fetch_from_ishares
+from .ishares_scraper import fetch_async as fetch_from_ishares_async
 from .ark_scraper import FUNDS as ark_etf_tickers
+from .ark_scraper import get_fund_url as get_ark_fund_url
 from .ark_scraper import fetch as fetch_from_ark
+from .ark_scraper import fetch_async as fetch_from_ark_async
 from .invesco_scraper import FUNDS as invesco_etf_tickers
+from .invesco_scraper import get_fund_url as get_invesco_fund_url
 from .invesco_scraper import fetch as fetch_from_invesco
+from .invesco_scraper import fetch_async as fetch_from_invesco_async
+from .zack_scraper import get_fund_url as get_zack_fund_url
 from .zack_scraper import fetch as fetch_from_zack
+from .zack_scraper import fetch_async as fetch_from_zack_async
 
 ishares_etf_tickers = [etf.upper() for etf in ishares_etf_tickers]
 ark_etf_tickers = [etf.upper() for etf in ark_etf_tickers]
 invesco_etf_tickers = [etf.upper() for etf in invesco_etf_tickers]
 
-def scrape_etf_holdings(etf: str) -> Mapping[str, Mapping[str, float]]:
+# maximal number of concurrent downloads from each source (i.e. host), shared by all threads of the process
+MAX_CONCURRENT_DOWNLOADS_PER_SOURCE: Mapping[str, int] = {
+    "ishares": 4,
+    "ark": 2,
+    "invesco": 2,
+    "zack": 4,
+}
+_source_semaphores: Mapping[str, threading.BoundedSemaphore] = {
+    source: threading.BoundedSemaphore(limit) for source, limit in MAX_CONCURRENT_DOWNLOADS_PER_SOURCE.items()
+}
+
+# scrapers (and their asynchronous counterparts) of each source
+FETCHERS: Mapping[str, Callable] = {
+    "ishares": fetch_from_ishares,
+    "ark": fetch_from_ark,
+    "invesco": fetch_from_invesco,
+    "zack": fetch_from_zack,
+}
+ASYNC_FETCHERS: Mapping[str, Callable] = {
+    "ishares": fetch_from_ishares_async,
+    "ark": fetch_from_ark_async,
+    "invesco": fetch_from_invesco_async,
+    "zack": fetch_from_zack_async,
+}
+# sources publishing files that can be fetched conditionally (see `ResponseStore`);
+# zacks.com pages are generated on every request
+CONDITIONAL_SOURCES = ("ishares", "ark", "invesco")
+
+def get_source(etf: str) -> str:
+    """Returns the name of the source (i.e. scraper) used for the ETF ticker `etf`.
+
+    Examples
+    --------
+    >>> assert get_source('ivv') == 'ishares' and get_source('ARKK') == 'ark' and get_source('UNKNOWN') == 'zack'
+    """
+    etf = etf.upper()
+    if etf in ishares_etf_tickers:
+        return "ishares"
+    elif etf in ark_etf_tickers:
+        return "ark"
+    elif etf in invesco_etf_tickers:
+        return "invesco"
+    return "zack"
+
+def get_fund_url(etf: str) -> str:
+    """Returns the URL the holdings of the ETF ticker `etf` are scraped from."""
+    etf = etf.upper()
+    return {
+        "ishares": get_ishares_fund_url,
+        "ark": get_ark_fund_url,
+        "invesco": get_invesco_fund_url,
+        "zack": get_zack_fund_url,
+    }[get_source(etf)](etf)
+
+def _fetcher_kwargs(source: str, store: ResponseStore) -> Mapping[str, ResponseStore]:
+    return { "store": store } if store is not None and source in CONDITIONAL_SOURCES else dict()
+
+def scrape_etf_holdings(etf: str,
+                        store: ResponseStore = None) -> Mapping[str, Mapping[str, float]]:
     """Entrypoint function to iterate over scrapers one-by-one
     until one of them succeeds.
 
@@ -25,6 +96,11 @@ def scrape_etf_holdings(etf: str) -> Mapping[str, Mapping[str, float]]:
     ----------
     etf : str
         Ticker for the ETF of interest
+    store : ResponseStore, optional
+        Store of the last responses of the providers, by default None. If provided, files published
+        by the providers are fetched conditionally, and `NotModified` is raised if the ETF's file 
+        hasn't changed since it was last fetched (see `ResponseStore.stream`). The new file only counts
+        as fetched once `store.commit(get_fund_url(etf))` has been called, after its holdings are stored.
 
     Returns
     -------
@@ -35,31 +111,130 @@ def scrape_etf_holdings(etf: str) -> Mapping[str, Mapping[str, float]]:
 
     """
     etf = etf.upper()
-    source = "zack"
+    source = get_source(etf)
     start_time = datetime.now()
     try:
-        if etf in ishares_etf_tickers:
-            logger.info(f"Using ishares scraper to fetch data for {etf}")
-            source = "ishares"
-            etf_holdings_and_weights = fetch_from_ishares(etf)
-        elif etf in ark_etf_tickers:
-            logger.info(f"Using ark scraper to fetch data for {etf}")
-            source = "ark"
-            etf_holdings_and_weights = fetch_from_ark(etf)
-        elif etf in invesco_etf_tickers:
-            logger.info(f"Using invesco scraper to fetch data for {etf}")
-            source = "invesco"
-            etf_holdings_and_weights = fetch_from_invesco(etf)
-        else:
-            logger.info(f"Using zacks.com scraper to fetch data for {etf}")
-            etf_holdings_and_weights = fetch_from_zack(etf)
+        logger.info(f"Using {source} scraper to fetch data for {etf}")
+        etf_holdings_and_weights = FETCHERS[source](etf, **_fetcher_kwargs(source, store))
     except Exception as e:
         logger.info(f"Getting updated holdings for ETF: {etf} raised {e}")
         raise e
+    return _check_scraped_holdings(etf, source, etf_holdings_and_weights, start_time)
+
+def _check_scraped_holdings(etf: str,
+                            source: str,
+                            etf_holdings_and_weights: Mapping[str, Mapping[str, float]],
+                            start_time: datetime) -> Mapping[str, Mapping[str, float]]:
     try:
         assert len(etf_holdings_and_weights) > 0
     except AssertionError as no_data:
         logger.info(f"Found no data for ETF: {etf} (source: {source})")
         raise no_data
     logger.info(f"Scraping took {datetime.now() - start_time}")
-    return etf_holdings_and_weights
\ No newline at end of file
+    return etf_holdings_and_weights
+
+def scrape_etfs_holdings( etfs: Iterable[str],
+                          max_workers: int = 8) -> Tuple[Mapping[str, Mapping[str, Mapping[str, float]]], Mapping[str, Exception]]:
+    """Scrapes the holdings of all ETF tickers in `etfs` concurrently (see `scrape_etf_holdings`),
+    using up to `max_workers` threads and at most `MAX_CONCURRENT_DOWNLOADS_PER_SOURCE[source]` 
+    concurrent downloads per source, so that the total latency is that of the slowest download
+    rather than the sum of all downloads.
+
+    Parameters
+    ----------
+    etfs : Iterable[str]
+        Tickers for the ETFs of interest.
+    max_workers : int, optional
+        Maximal number of concurrent downloads, by default 8.
+
+    Returns
+    -------
+    Tuple[Mapping[str, Mapping[str, Mapping[str, float]]], Mapping[str, Exception]]
+        Dictionary mapping the (upper-case) tickers of the ETFs that were scraped to their holdings 
+        (formatted like the output of `scrape_etf_holdings`), and
+        dictionary mapping the (upper-case) tickers of the ETFs that couldn't be scraped to the raised exception.
+    """
+    etfs = sorted(set( etf.upper() for etf in etfs ))
+    if len(etfs) == 0:
+        return dict(), dict()
+
+    def scrape(etf: str) -> Mapping[str, Mapping[str, float]]:
+        with _source_semaphores[get_source(etf)]:
+            return scrape_etf_holdings(etf)
+
+    start_time = datetime.now()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(etfs)), thread_name_prefix="scraper") as executor:
+        futures = { etf: executor.submit(scrape, etf) for etf in etfs }
+    etfs_holdings: Mapping[str, Mapping[str, Mapping[str, float]]] = dict()
+    errors: Mapping[str, Exception] = dict()
+    for etf, future in futures.items():
+        try:
+            etfs_holdings[etf] = future.result()
+        except Exception as e:
+            errors[etf] = e
+    logger.info(f"Scraped {len(etfs_holdings)}/{len(etfs)} ETFs in {datetime.now() - start_time}")
+    return etfs_holdings, errors
+
+async def scrape_etf_holdings_async(etf: str,
+                                    sessions: AsyncSessions = None,
+                                    store: ResponseStore = None) -> Mapping[str, Mapping[str, float]]:
+    """Asynchronous counterpart of `scrape_etf_holdings`, sending its requests through `sessions`
+    (see `.sessions.get_async`)."""
+    etf = etf.upper()
+    source = get_source(etf)
+    start_time = datetime.now()
+    try:
+        logger.info(f"Using {source} scraper to fetch data for {etf}")
+        etf_holdings_and_weights = await ASYNC_FETCHERS[source](etf, sessions=sessions, **_fetcher_kwargs(source, store))
+    except Exception as e:
+        logger.info(f"Getting updated holdings for ETF: {etf} raised {e}")
+        raise e
+    return _check_scraped_holdings(etf, source, etf_holdings_and_weights, start_time)
+
+async def scrape_etf_holdings_many_async(etfs: Iterable[str],
+                                         store: ResponseStore = None) -> Tuple[Mapping[str, Mapping[str, Mapping[str, float]]], Mapping[str, Exception]]:
+    """Asynchronous counterpart of `scrape_etf_holdings_many`."""
+    etfs = sorted(set( etf.upper() for etf in etfs ))
+    semaphores = { source: asyncio.Semaphore(limit) for source, limit in MAX_CONCURRENT_DOWNLOADS_PER_SOURCE.items() }
+
+    async def scrape(etf: str, sessions: AsyncSessions) -> Mapping[str, Mapping[str, float]]:
+        async with semaphores[get_source(etf)]:
+            return await scrape_etf_holdings_async(etf, sessions, store)
+
+    start_time = datetime.now()
+    async with AsyncSessions(pool_size=max(MAX_CONCURRENT_DOWNLOADS_PER_SOURCE.values())) as sessions:
+        outcomes = await asyncio.gather(*[ scrape(etf, sessions) for etf in etfs ], return_exceptions=True)
+    etfs_holdings: Mapping[str, Mapping[str, Mapping[str, float]]] = dict()
+    errors: Mapping[str, Exception] = dict()
+    for etf, outcome in zip(etfs, outcomes):
+        if isinstance(outcome, Exception):
+            errors[etf] = outcome
+        else:
+            etfs_holdings[etf] = outcome
+    logger.info(f"Scraped {len(etfs_holdings)}/{len(etfs)} ETFs in {datetime.now() - start_time}")
+    return etfs_holdings, errors
+
+def scrape_etf_holdings_many(etfs: Iterable[str],
+                             store: ResponseStore = None) -> Tuple[Mapping[str, Mapping[str, Mapping[str, float]]], Mapping[str, Exception]]:
+    """Scrapes the holdings of all ETF tickers in `etfs` on an event loop of its own, 
+    with at most `MAX_CONCURRENT_DOWNLOADS_PER_SOURCE[source]` concurrent downloads per source. 
+    All downloads from a host share the keep-alive connections of one client (see `.sessions.AsyncSessions`),
+    which makes it the entry point of choice to scrape large numbers of ETFs (e.g. in `prefetch.py`);
+    use `scrape_etfs_holdings` from threads that may already run an event loop.
+
+    Parameters
+    ----------
+    etfs : Iterable[str]
+        Tickers for the ETFs of interest.
+    store : ResponseStore, optional
+        Store of the last responses of the providers, by default None (see `scrape_etf_holdings`).
+
+    Returns
+    -------
+    Tuple[Mapping[str, Mapping[str, Mapping[str, float]]], Mapping[str, Exception]]
+        Dictionary mapping the (upper-case) tickers of the ETFs that were scraped to their holdings 
+        (formatted like the output of `scrape_etf_holdings`), and
+        dictionary mapping the (upper-case) tickers of the ETFs that couldn't be scraped to the raised exception
+        (`NotModified` for the ETFs whose file hasn't changed).
+    """
+    return asyncio.run(scrape_etf_holdings_many_async(etfs, store))
@@ -1,9 +1,10 @@
 # standard library dependencies
-import csv
-from typing import Union, Mapping
+from typing import List, Mapping, Tuple, Union
 
-# external dependencies
-import requests
+# local dependencies
+from .sessions import AsyncSessions, stream, stream_async
+from .parsing import HoldingsAggregator, read_holdings, read_holdings_async
+from .response_store import ResponseStore
 
 # The ARK adapter fetches the .csv file of the funds' holdings published on their site
 # We're specifically considering the following funds:
@@ -11,9 +12,30 @@ import requests
 
 FUNDS = ('ARKK', 'ARKW', 'ARKQ', 'ARKF', 'ARKG')
 
+HEADERS: Mapping[str,str] = {
+    "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:97.0) Gecko/20100101 Firefox/97.0"
+}
+
+def get_fund_url(fund: str) -> str:
+    """Returns the URL of the .csv file of `fund`'s holdings."""
+    return f"https://ark-funds.com/wp-content/uploads/funds-etf-csv/ARK_INNOVATION_ETF_{fund}_HOLDINGS.csv"
+
+def parse_row(row: List[str]) -> Union[None, Tuple[str, float]]:
+    """Returns the (ticker, weight) pair of a row of ark-funds.com's .csv files, or None if the row should be skipped."""
+    ticker = row[3]
+    weight = row[7]
+    if not ticker or not weight:
+        return None
+    return ticker, float(weight.strip('%'))/100
+
+def holdings_aggregator() -> HoldingsAggregator:
+    """Returns a parser aggregating the holdings of ark-funds.com's .csv files line by line."""
+    return HoldingsAggregator(parse_row, skip_rows=1, ndigits=8)
+
 def fetch(  fund: str, 
             headers: Mapping[str,str] = None,
-            max_iters: int = 5) -> Union[None, Mapping[str, Mapping[str, float]]]:
+            max_iters: int = 5,
+            store: ResponseStore = None) -> Union[None, Mapping[str, Mapping[str, float]]]:
     """Scrapes ark-funds.com for today's holdings data on the specified ETF.
 
     Parameters
@@ -28,6 +50,9 @@ def fetch(  fund: str,
     max_iters : int, optional
         Number of successive HTTP requests to submit before accepting a non-200 response
         (ark-funds.com can have strange inconsistencies in their responses to requests).
+    store : ResponseStore, optional
+        Store of the last response to the fund's URL, by default None. If provided, the request
+        is conditional and `NotModified` is raised if the file hasn't changed (see `ResponseStore.stream`).
 
     Returns
     -------
@@ -39,50 +64,27 @@ def fetch(  fund: str,
     fund = fund.upper()
     global FUNDS
     assert fund in FUNDS
-    if headers is None:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:97.0) Gecko/20100101 Firefox/97.0"
-        }
-    fund_csv_url = f"https://ark-funds.com/wp-content/uploads/funds-etf-csv/ARK_INNOVATION_ETF_{fund}_HOLDINGS.csv"    
-    i = 0
-    req = None
-    while i < max_iters:
-        req = requests.get(
-            fund_csv_url, 
-            headers=headers
-        )
-        try:
-            req.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            print(f"Error: {e}")
-            i += 1
-        else:
-            break
-    print(i, req.status_code)
-    try:
-        req.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        # not a 200
-        print(f"Error: {e}")
-        return dict()
-    else:
-        data = csv.reader(
-            req.content.decode("utf-8").split("\n")
-        )
-        next(data)
-        results = dict()
-        for holding in data:
-            try:
-                ticker = holding[3]
-                weight = holding[7]
-                if not ticker or not weight:
-                    continue
-                results[ticker] = round(
-                    results.get(ticker, 0) + float(weight.strip('%'))/100,
-                    8
-                )
-            except IndexError:
-                continue
-                
-        return {holding: {'weight':weight} for holding, weight in results.items()}
+    with (stream if store is None else store.stream)(
+        get_fund_url(fund),
+        headers = HEADERS if headers is None else headers,
+        attempts = max_iters
+    ) as response:
+        return read_holdings(response, holdings_aggregator())
 
+async def fetch_async(  fund: str, 
+                        headers: Mapping[str,str] = None,
+                        max_iters: int = 5,
+                        sessions: AsyncSessions = None,
+                        store: ResponseStore = None) -> Union[None, Mapping[str, Mapping[str, float]]]:
+    """Asynchronous counterpart of `fetch`, sending its requests through `sessions`
+    (see `.sessions.stream_async`)."""
+    fund = fund.upper()
+    global FUNDS
+    assert fund in FUNDS
+    async with (stream_async if store is None else store.stream_async)(
+        get_fund_url(fund),
+        headers = HEADERS if headers is None else headers,
+        attempts = max_iters,
+        sessions = sessions
+    ) as response:
+        return await read_holdings_async(response, holdings_aggregator())
@@ -1,9 +1,10 @@
 # standard library dependencies
-import csv
-from typing import Mapping
+from typing import List, Mapping, Tuple, Union
 
-# external dependencies
-import requests
+# local dependencies
+from .sessions import AsyncSessions, stream, stream_async
+from .parsing import HoldingsAggregator, read_holdings, read_holdings_async
+from .response_store import ResponseStore
 
 FUNDS = [
     'ADRE',
@@ -162,8 +163,29 @@ tickers = document.querySelectorAll(".fund-link .ticker-label-bold")
 console.log("[" + Array.from(tickers).map(t => '"' + t.textContent.trim() + '"').join(",") + "]")
 """
 
+HEADERS: Mapping[str,str] = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
+}
+
+def get_fund_url(fund: str) -> str:
+    """Returns the URL of the .csv file of `fund`'s holdings."""
+    return f"https://www.invesco.com/us/financial-products/etfs/holdings/main/holdings/0?audienceType=Investor&action=download&ticker={fund}"
+
+def parse_row(row: List[str]) -> Union[None, Tuple[str, float]]:
+    """Returns the (ticker, weight) pair of a row of invesco.com's .csv files, or None if the row should be skipped."""
+    ticker = row[2].strip()
+    weight = row[5]
+    if ticker.startswith("-") or not ticker or not weight:
+        return None
+    return ticker, float(weight)
+
+def holdings_aggregator() -> HoldingsAggregator:
+    """Returns a parser aggregating the holdings of invesco.com's .csv files line by line."""
+    return HoldingsAggregator(parse_row, skip_rows=1)
+
 def fetch(  fund: str, 
-            headers: Mapping[str,str] = None) -> Mapping[str, Mapping[str, float]]:
+            headers: Mapping[str,str] = None,
+            store: ResponseStore = None) -> Mapping[str, Mapping[str, float]]:
     """Scrapes invesco.com for today's holdings data on the specified ETF.
 
     Parameters
@@ -175,6 +197,9 @@ def fetch(  fund: str,
         By default `{
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
         }`.
+    store : ResponseStore, optional
+        Store of the last response to the fund's URL, by default None. If provided, the request
+        is conditional and `NotModified` is raised if the file hasn't changed (see `ResponseStore.stream`).
 
     Returns
     -------
@@ -186,37 +211,24 @@ def fetch(  fund: str,
     fund = fund.upper()
     global FUNDS
     assert fund in FUNDS
-    if headers is None:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
-        }
+    with (stream if store is None else store.stream)(
+        get_fund_url(fund),
+        headers = HEADERS if headers is None else headers
+    ) as response:
+        return read_holdings(response, holdings_aggregator())
 
-    result: Mapping[str, float] = dict()
-    fund_csv_url = f"https://www.invesco.com/us/financial-products/etfs/holdings/main/holdings/0?audienceType=Investor&action=download&ticker={fund}"
-    req = requests.get(
-        fund_csv_url, 
-        headers=headers
-    )
-    try:
-        req.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        # not a 200
-        print(f"Error: {e}")
-    else:
-        data = csv.reader(
-            req.content.decode("utf-8").split("\n")
-        )
-        holdings_data = dict()
-        next(data)
-        for holding in data:
-            try:
-                ticker = holding[2].strip()
-                weight = holding[5]
-                if ticker.startswith("-") or not ticker or not weight:
-                    continue
-                holdings_data[ticker] = holdings_data.get(ticker, 0) + float(weight)
-            except IndexError:
-                continue
-        result = {holding: {'weight':weight} for holding, weight in holdings_data.items()}
-    finally:
-        return result
+async def fetch_async(  fund: str, 
+                        headers: Mapping[str,str] = None,
+                        sessions: AsyncSessions = None,
+                        store: ResponseStore = None) -> Mapping[str, Mapping[str, float]]:
+    """Asynchronous counterpart of `fetch`, sending its request through `sessions`
+    (see `.sessions.stream_async`)."""
+    fund = fund.upper()
+    global FUNDS
+    assert fund in FUNDS
+    async with (stream_async if store is None else store.stream_async)(
+        get_fund_url(fund),
+        headers = HEADERS if headers is None else headers,
+        sessions = sessions
+    ) as response:
+        return await read_holdings_async(response, holdings_aggregator())
@@ -1,9 +1,10 @@
 # standard library dependencies
-import csv
-from typing import Mapping, Union
+from typing import List, Mapping, Tuple, Union
 
-# external dependencies
-import requests
+# local dependencies
+from .sessions import AsyncSessions, stream, stream_async
+from .parsing import HoldingsAggregator, read_holdings, read_holdings_async
+from .response_store import ResponseStore
 
 # The iShares adapter fetches the .csv file of the funds' holdings published on their site
 # AFAIK there's no way to do this programmatically for any fund so we need to manually
@@ -670,8 +671,26 @@ def get_fund_file(symbol: str) -> str:
     }
     return f"https://www.ishares.com/us/products{funds_basepaths[symbol]}?fileType=csv&fileName={symbol.upper()}_holdings&dataType=fund"
 
+HEADERS: Mapping[str,str] = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
+}
+
+def parse_row(row: List[str]) -> Union[None, Tuple[str, float]]:
+    """Returns the (ticker, weight) pair of a row of ishares.com's .csv files, or None if the row should be skipped."""
+    ticker = row[0]
+    weight = row[5]
+    asset_class = row[3]
+    if not ticker or not weight or not (asset_class == "Equity"):
+        return None
+    return ticker, float(weight)
+
+def holdings_aggregator() -> HoldingsAggregator:
+    """Returns a parser aggregating the holdings of ishares.com's .csv files line by line."""
+    return HoldingsAggregator(parse_row, skip_rows=10, stop_at_short_rows=True)
+
 def fetch(  fund: str, 
-            headers: Mapping[str,str] = None) -> Mapping[str, Mapping[str, float]]:
+            headers: Mapping[str,str] = None,
+            store: ResponseStore = None) -> Mapping[str, Mapping[str, float]]:
     """Scrapes ishares.com for today's holdings data on the specified ETF.
 
     Parameters
@@ -683,6 +702,9 @@ def fetch(  fund: str,
         By default `{
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
         }`.
+    store : ResponseStore, optional
+        Store of the last response to the fund's URL, by default None. If provided, the request
+        is conditional and `NotModified` is raised if the file hasn't changed (see `ResponseStore.stream`).
 
     Returns
     -------
@@ -694,37 +716,24 @@ def fetch(  fund: str,
     global FUNDS
     fund = fund.lower()
     assert fund in FUNDS
-    if headers is None:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
-        }
-    fund_csv_url = get_fund_file(fund)
-    result: Mapping[str, float] = dict()
-    req = requests.get(
-        fund_csv_url, 
-        headers=headers
-    )
-    try:
-        req.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        # not a 200
-        print(f"Error: {e}")
-    else:
-        data = csv.reader(
-            req.content.decode("utf-8").split("\n")
-        )
-        
-        for _ in range(0, 10):
-            next(data)
-        for holding in data:
-            try:
-                ticker = holding[0]
-                weight = holding[5]
-                asset_class = holding[3]
-                if not ticker or not weight or not (asset_class == "Equity"):
-                    continue
-                result[ticker] = result.get(ticker, 0) + float(weight)
-            except IndexError:
-                break
-    finally:
-        return {holding: {'weight':weight} for holding, weight in result.items()}
+    with (stream if store is None else store.stream)(
+        get_fund_file(fund),
+        headers = HEADERS if headers is None else headers
+    ) as response:
+        return read_holdings(response, holdings_aggregator())
+
+async def fetch_async(  fund: str, 
+                        headers: Mapping[str,str] = None,
+                        sessions: AsyncSessions = None,
+                        store: ResponseStore = None) -> Mapping[str, Mapping[str, float]]:
+    """Asynchronous counterpart of `fetch`, sending its request through `sessions`
+    (see `.sessions.stream_async`)."""
+    global FUNDS
+    fund = fund.lower()
+    assert fund in FUNDS
+    async with (stream_async if store is None else store.stream_async)(
+        get_fund_file(fund),
+        headers = HEADERS if headers is None else headers,
+        sessions = sessions
+    ) as response:
+        return await read_holdings_async(response, holdings_aggregator())
@@ -0,0 +1,132 @@
+# standard library dependencies
+import csv
+import logging
+logger = logging.getLogger(f"mainLogger.scraping.parsing")
+from collections import deque
+from typing import Callable, Deque, Iterator, List, Mapping, Tuple, Union
+
+# local dependencies
+from .sessions import HTTPStreamResponse
+
+
+class LineBuffer:
+    """Iterator over the lines appended to `lines`, which stops whenever they run out
+    and resumes once more are appended; lets a single `csv.reader` parse lines as they arrive."""
+    def __init__(self):
+        self.lines: Deque[str] = deque()
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+class HoldingsAggregator:
+    """Incrementally parses the rows of a holdings .csv file, fed line by line, into the total
+    weight of each holding; only the aggregated weights (and the lines of an incomplete row) are kept in memory.
+
+    The lines are parsed by a single `csv.reader`, which only gets them once their row is complete, 
+    i.e. once the quoted fields spanning several lines (with an odd number of quotes) are closed.
+
+    Parameters
+    ----------
+    parse_row : Callable[[List[str]], Union[None, Tuple[str, float]]]
+        Function returning the (ticker, weight) pair of a row, or None if the row should be skipped.
+    skip_rows : int, optional
+        Number of (header) rows preceding the holdings, by default 1.
+    stop_at_short_rows : bool, optional
+        Whether the holdings end at the first row `parse_row` raises an `IndexError` for
+        (i.e. with too few columns), by default False, in which case such rows are skipped.
+    ndigits : int, optional
+        Number of digits the total weights are rounded to after each addition, by default None (no rounding).
+
+    Examples
+    --------
+    >>> aggregator = HoldingsAggregator(lambda row: (row[0], float(row[1])))
+    >>> for line in ["Ticker,Weight", "A,0.5", '"A",0.25', "", "B,0.25"]:
+    ...     assert aggregator.feed(line)
+    >>> assert aggregator.holdings == {"A": {"weight": 0.75}, "B": {"weight": 0.25}}
+    >>> for line in ['"C', 'D",0.5']:
+    ...     assert aggregator.feed(line)
+    >>> assert aggregator.holdings["C\\nD"] == {"weight": 0.5}
+    """
+    def __init__(   self,
+                    parse_row: Callable[[List[str]], Union[None, Tuple[str, float]]],
+                    skip_rows: int = 1,
+                    stop_at_short_rows: bool = False,
+                    ndigits: int = None):
+        self.parse_row = parse_row
+        self.stop_at_short_rows = stop_at_short_rows
+        self.ndigits = ndigits
+        self.done = False
+        self.__rows_to_skip = skip_rows
+        self.__weights: Mapping[str, float] = dict()
+        self.__lines = LineBuffer()
+        self.__rows = csv.reader(self.__lines)
+        self.__pending: List[str] = []
+
+    def feed(self, line: str) -> bool:
+        """Parses `line` (without its line terminator), along with the previous lines of its row if 
+        it spans several lines; returns False once the holdings have ended."""
+        if self.done:
+            return False
+        self.__pending.append(line + "\n")
+        if sum( pending.count('"') for pending in self.__pending ) % 2 == 1:
+            # within a quoted field
+            return True
+        self.__lines.lines.extend(self.__pending)
+        self.__pending.clear()
+        for row in self.__rows:
+            self.feed_row(row)
+        return not self.done
+
+    def feed_row(self, row: List[str]) -> None:
+        """Aggregates the weight of the holding in the parsed `row` (unless the holdings have ended)."""
+        if self.done:
+            return
+        if self.__rows_to_skip > 0:
+            self.__rows_to_skip -= 1
+            return
+        try:
+            holding = self.parse_row(row)
+        except IndexError:
+            self.done = self.stop_at_short_rows
+            return
+        if holding is not None:
+            ticker, weight = holding
+            weight += self.__weights.get(ticker, 0)
+            self.__weights[ticker] = weight if self.ndigits is None else round(weight, self.ndigits)
+
+    @property
+    def holdings(self) -> Mapping[str, Mapping[str, float]]:
+        """Dictionary mapping the holdings parsed so far to a sub-dictionary mapping 'weight' to their total weight."""
+        return { holding: {'weight': weight} for holding, weight in self.__weights.items() }
+
+
+def read_holdings(  response: HTTPStreamResponse,
+                    aggregator: HoldingsAggregator) -> Mapping[str, Mapping[str, float]]:
+    """Feeds the lines of the streamed `response` (see `.sessions.stream`) to `aggregator` 
+    until the holdings end, and returns them (or an empty dictionary if `response` isn't a 2XX one)."""
+    if not response.ok:
+        # not a 200
+        logger.warning(f"Got a {response.status_code} response from {response.url}")
+        return dict()
+    for line in response.lines:
+        if not aggregator.feed(line):
+            break
+    return aggregator.holdings
+
+async def read_holdings_async(  response: HTTPStreamResponse,
+                                aggregator: HoldingsAggregator) -> Mapping[str, Mapping[str, float]]:
+    """Asynchronous counterpart of `read_holdings` (see `.sessions.stream_async`)."""
+    if not response.ok:
+        # not a 200
+        logger.warning(f"Got a {response.status_code} response from {response.url}")
+        return dict()
+    async for line in response.lines:
+        if not aggregator.feed(line):
+            break
+    return aggregator.holdings
@@ -0,0 +1,199 @@
+# standard library dependencies
+import os
+import json
+import hashlib
+import logging
+logger = logging.getLogger(f"mainLogger.scraping.response_store")
+import tempfile
+import threading
+from datetime import datetime
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, AsyncIterator, BinaryIO, Iterator, Mapping, Tuple, Union
+
+# local dependencies
+from . import sessions as http_sessions
+from .sessions import HTTPStreamResponse, AsyncSessions
+
+
+class NotModified(Exception):
+    """Raised when the file at `url` hasn't changed since it was last fetched (see `ResponseStore`)."""
+    def __init__(self, url: str):
+        super().__init__(f"{url} hasn't changed since it was last fetched")
+        self.url = url
+
+
+class ResponseStore:
+    """Local store of the last (2XX) response to each URL: its validators (`ETag` and `Last-Modified` 
+    headers), the SHA-256 of its body, and the body itself, under `directory`.
+
+    `stream` (and `stream_async`) send conditional requests based on the stored validators,
+    and raise `NotModified` if the server answers with a 304 or if the body's SHA-256 matches 
+    the stored one, so that unchanged files are neither parsed nor inserted again.
+    Bodies are spooled to disk (and hashed) as they are downloaded, then read back in chunks,
+    so memory usage stays bounded. The record of a response is only updated once the caller
+    `commit`s it, i.e. once the holdings read from its body have been stored: until then, the
+    next requests for the same URL aren't conditional on it (see `pending`).
+
+    Parameters
+    ----------
+    directory : str, optional
+        Directory holding the records and bodies, by default 'data/responses'.
+
+    Examples
+    --------
+    >>> store = ResponseStore(tempfile.mkdtemp())
+    >>> url = "https://www.example.com/holdings.csv"
+    >>> assert store.get(url) is None and store.conditional_headers(url) == dict()
+    >>> store.put(url, {"etag": '"abc"', "Content-Type": "text/csv"}, "0" * 64)
+    >>> assert store.conditional_headers(url) == {"If-None-Match": '"abc"'}
+    >>> store.forget(url)
+    >>> assert store.get(url) is None
+    """
+    def __init__(self, directory: str = os.path.join("data", "responses")):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.__lock = threading.Lock()
+        # URL -> (headers, SHA-256) of the responses read but not committed yet
+        self.__pending: Mapping[str, Tuple[Mapping[str, str], str]] = dict()
+
+    def path(self, url: str, extension: str) -> str:
+        """Returns the path of the record ('json') or body ('body') of the response to `url`."""
+        key = hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def get(self, url: str) -> Union[None, Mapping[str, str]]:
+        """Returns the record (URL, validators, SHA-256 and fetch time) of the last response to `url`, or None."""
+        try:
+            with open(self.path(url, "json"), "r") as record_file:
+                return json.load(record_file)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url: str, headers: Mapping[str, str], sha256: str) -> None:
+        """Records the validators among `headers` and the SHA-256 of the last response to `url`."""
+        headers = { header.lower(): value for header, value in headers.items() }
+        record = {
+            "url": url,
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+            "sha256": sha256,
+            "fetched_at": datetime.now().isoformat(timespec="seconds")
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as record_file:
+            json.dump(record, record_file)
+        os.replace(tmp_path, self.path(url, "json"))
+
+    def pending(self, url: str) -> Union[None, Tuple[Mapping[str, str], str]]:
+        """Returns the headers and SHA-256 of the last response to `url` that was read
+        but not committed yet (None if there isn't any)."""
+        with self.__lock:
+            return self.__pending.get(url)
+
+    def commit(self, url: str) -> bool:
+        """Records the validators of the last response to `url` that was read (see `put`), to be called
+        once the holdings read from it have been stored. Returns False if there was nothing to commit."""
+        with self.__lock:
+            pending = self.__pending.pop(url, None)
+        if pending is None:
+            return False
+        self.put(url, *pending)
+        return True
+
+    def forget(self, url: str) -> None:
+        """Deletes the record and body of the response to `url`, so that it gets fetched unconditionally next time."""
+        with self.__lock:
+            self.__pending.pop(url, None)
+        for extension in ("json", "body"):
+            try:
+                os.remove(self.path(url, extension))
+            except FileNotFoundError:
+                pass
+
+    def conditional_headers(self, url: str) -> Mapping[str, str]:
+        """Returns the `If-None-Match` and `If-Modified-Since` headers matching the last response to `url`."""
+        record = self.get(url)
+        if record is None:
+            return dict()
+        headers: Mapping[str, str] = dict()
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+        return headers
+
+    def _spool(self) -> Tuple[BinaryIO, str, Any]:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        return os.fdopen(fd, "wb"), tmp_path, hashlib.sha256()
+
+    def _keep(self, url: str, headers: Mapping[str, str], tmp_path: str, sha256: str) -> None:
+        record = self.get(url)
+        if record is not None and record.get("sha256") == sha256:
+            # the validators can change while the body doesn't
+            self.put(url, headers, sha256)
+            raise NotModified(url)
+        os.replace(tmp_path, self.path(url, "body"))
+
+    def _read_body(self, url: str) -> Iterator[bytes]:
+        with open(self.path(url, "body"), "rb") as body:
+            yield from iter(lambda: body.read(http_sessions.CHUNK_SIZE), b"")
+
+    @contextmanager
+    def stream( self,
+                url: str,
+                headers: Mapping[str, str] = None,
+                attempts: int = 1) -> Iterator[HTTPStreamResponse]:
+        """Conditional counterpart of `.sessions.stream`, whose response's body is read back from disk.
+
+        Raises
+        ------
+        NotModified
+            If the file at `url` hasn't changed since it was last fetched.
+        """
+        with http_sessions.stream(url, { **(headers or dict()), **self.conditional_headers(url) }, attempts) as response:
+            if response.status_code == 304:
+                raise NotModified(url)
+            if not response.ok:
+                yield response
+                return
+            spool, tmp_path, digest = self._spool()
+            try:
+                with spool:
+                    for chunk in response.chunks:
+                        digest.update(chunk)
+                        spool.write(chunk)
+                self._keep(url, response.headers, tmp_path, digest.hexdigest())
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        yield response._replace(chunks=self._read_body(url))
+        with self.__lock:
+            self.__pending[url] = (response.headers, digest.hexdigest())
+
+    @asynccontextmanager
+    async def stream_async( self,
+                            url: str,
+                            headers: Mapping[str, str] = None,
+                            attempts: int = 1,
+                            sessions: AsyncSessions = None) -> AsyncIterator[HTTPStreamResponse]:
+        """Asynchronous counterpart of `stream` (see `.sessions.stream_async`)."""
+        request_headers = { **(headers or dict()), **self.conditional_headers(url) }
+        async with http_sessions.stream_async(url, request_headers, attempts, sessions) as response:
+            if response.status_code == 304:
+                raise NotModified(url)
+            if not response.ok:
+                yield response
+                return
+            spool, tmp_path, digest = self._spool()
+            try:
+                with spool:
+                    async for chunk in response.chunks:
+                        digest.update(chunk)
+                        spool.write(chunk)
+                self._keep(url, response.headers, tmp_path, digest.hexdigest())
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        yield response._replace(chunks=self._read_body(url))
+        with self.__lock:
+            self.__pending[url] = (response.headers, digest.hexdigest())
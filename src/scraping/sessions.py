@@ -0,0 +1,296 @@
+# standard library dependencies
+import codecs
+import asyncio
+import logging
+logger = logging.getLogger(f"mainLogger.scraping.sessions")
+import threading
+import importlib.util
+from functools import partial
+from urllib.parse import urlsplit
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Mapping, NamedTuple, Union
+
+# external dependencies
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    # optional; enables HTTP/2 (if `h2` is installed too) and non-blocking downloads in `AsyncSessions`
+    import httpx
+except ImportError:
+    httpx = None
+
+# number of keep-alive connections kept open to each host
+POOL_SIZE: int = 8
+# number of seconds to wait for the server (to connect or send data) before giving up
+TIMEOUT: float = 30.0
+HTTP2_AVAILABLE: bool = httpx is not None and importlib.util.find_spec("h2") is not None
+# size (in bytes) of the chunks in which streamed responses are read
+CHUNK_SIZE: int = 64 * 1024
+
+
+class HTTPResponse(NamedTuple):
+    """URL, status code, headers and body of an HTTP response, 
+    independently of the HTTP client that received it."""
+    url: str
+    status_code: int
+    headers: Mapping[str, str]
+    content: bytes
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 300
+
+
+class HTTPStreamResponse(NamedTuple):
+    """URL, status code and headers of an HTTP response whose body is streamed,
+    as an iterator (or an asynchronous iterator) of raw `chunks` of bytes."""
+    url: str
+    status_code: int
+    headers: Mapping[str, str]
+    chunks: Union[Iterator[bytes], AsyncIterator[bytes]]
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 300
+
+    @property
+    def lines(self) -> Union[Iterator[str], AsyncIterator[str]]:
+        """The body, decoded into lines on the fly (see `iter_lines` and `aiter_lines`)."""
+        if hasattr(self.chunks, "__aiter__"):
+            return aiter_lines(self.chunks)
+        return iter_lines(self.chunks)
+
+
+class LineDecoder:
+    """Incrementally decodes chunks of bytes into lines (split on '\\n', like `str.split`),
+    only holding on to the incomplete line at the end of the last chunk.
+
+    Examples
+    --------
+    >>> decoder = LineDecoder()
+    >>> assert decoder.feed(b"a,1\\r\\nb,") == ["a,1\\r"]
+    >>> assert decoder.feed("2\\nc\\u00e9".encode("utf-8")[:-1]) == ["b,2"]
+    >>> assert decoder.feed("\\u00e9".encode("utf-8")[-1:]) == []
+    >>> assert decoder.flush() == ["c\\u00e9"]
+    """
+    def __init__(self, encoding: str = "utf-8"):
+        self.__decoder = codecs.getincrementaldecoder(encoding)()
+        self.__pending = ""
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """Returns the lines completed by `chunk`."""
+        *lines, self.__pending = (self.__pending + self.__decoder.decode(chunk)).split("\n")
+        return lines
+
+    def flush(self) -> List[str]:
+        """Returns the last line (if not empty)."""
+        line = self.__pending + self.__decoder.decode(b"", final=True)
+        self.__pending = ""
+        return [line] if line else []
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Decodes the chunks of bytes in `chunks` into lines on the fly (see `LineDecoder`)."""
+    decoder = LineDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.flush()
+
+async def aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Asynchronous counterpart of `iter_lines`."""
+    decoder = LineDecoder()
+    async for chunk in chunks:
+        for line in decoder.feed(chunk):
+            yield line
+    for line in decoder.flush():
+        yield line
+
+
+# process-wide sessions, keyed by host
+_sessions: Mapping[str, requests.Session] = dict()
+_sessions_lock = threading.Lock()
+
+def get_session(host: str) -> requests.Session:
+    """Returns the process-wide `requests.Session` for `host`, which keeps up 
+    to `POOL_SIZE` connections alive between requests (rather than paying for 
+    a new TCP and TLS handshake on every request)."""
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return _sessions[host]
+
+def _send( url: str,
+           headers: Mapping[str, str] = None,
+           attempts: int = 1,
+           stream: bool = False) -> requests.Response:
+    session = get_session(urlsplit(url).netloc)
+    for attempt in range(1, attempts + 1):
+        response = session.get(url, headers=headers, timeout=TIMEOUT, stream=stream)
+        if response.ok or attempt == attempts:
+            return response
+        logger.warning(f"Got a {response.status_code} response from {url} (attempt {attempt}/{attempts})")
+        response.close()
+
+def _release(response: requests.Response) -> None:
+    try:
+        # reading the rest of the body lets the connection go back to the pool
+        response.raw.drain_conn()
+    except Exception as unreadable_body:
+        logger.debug(unreadable_body)
+    response.close()
+
+def get(url: str, 
+        headers: Mapping[str, str] = None,
+        attempts: int = 1) -> HTTPResponse:
+    """Sends a GET request to `url` through the session of its host (see `get_session`),
+    up to `attempts` times until the response is a 2XX one."""
+    response = _send(url, headers, attempts)
+    return HTTPResponse(response.url, response.status_code, dict(response.headers), response.content)
+
+@contextmanager
+def stream( url: str, 
+            headers: Mapping[str, str] = None,
+            attempts: int = 1) -> Iterator[HTTPStreamResponse]:
+    """Streaming counterpart of `get`: the body is read in chunks of `CHUNK_SIZE` bytes
+    (and decoded into `lines`) as they are iterated over, so that it never sits in memory as a whole.
+    The body has to be read before the context exits."""
+    response = _send(url, headers, attempts, stream=True)
+    try:
+        yield HTTPStreamResponse(
+            response.url, 
+            response.status_code, 
+            dict(response.headers), 
+            response.iter_content(CHUNK_SIZE)
+        )
+    finally:
+        _release(response)
+
+
+class AsyncSessions:
+    """Asynchronous HTTP clients (one per host, each keeping up to `pool_size` connections alive)
+    to share between the coroutines of an event loop, e.g.
+
+        async with AsyncSessions() as sessions:
+            responses = await asyncio.gather(*[ sessions.get(url) for url in urls ])
+
+    Clients are `httpx.AsyncClient`s (over HTTP/2 if `h2` is installed) if `httpx` is installed;
+    otherwise requests are sent through the sessions of `get`, in the event loop's default executor.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Maximal number of connections to each host, by default `POOL_SIZE`.
+    http2 : bool, optional
+        Whether to negotiate HTTP/2 with the hosts supporting it; 
+        by default None, which uses HTTP/2 if available (see `HTTP2_AVAILABLE`).
+    """
+    def __init__(   self,
+                    pool_size: int = POOL_SIZE,
+                    http2: bool = None):
+        self.pool_size = pool_size
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2
+        self.__clients: Mapping[str, Any] = dict()
+
+    def client(self, host: str) -> Any:
+        """Returns the client for `host`, creating it on first use."""
+        if host not in self.__clients:
+            self.__clients[host] = httpx.AsyncClient(
+                http2 = self.http2,
+                limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout = TIMEOUT,
+                follow_redirects = True
+            )
+        return self.__clients[host]
+
+    async def get(  self,
+                    url: str,
+                    headers: Mapping[str, str] = None,
+                    attempts: int = 1) -> HTTPResponse:
+        """Asynchronous counterpart of `get`."""
+        if httpx is None:
+            return await asyncio.get_running_loop().run_in_executor(None, partial(get, url, headers, attempts))
+        client = self.client(urlsplit(url).netloc)
+        for attempt in range(1, attempts + 1):
+            response = await client.get(url, headers=headers)
+            if 200 <= response.status_code < 300:
+                break
+            logger.warning(f"Got a {response.status_code} response from {url} (attempt {attempt}/{attempts})")
+        return HTTPResponse(str(response.url), response.status_code, dict(response.headers), response.content)
+
+    @asynccontextmanager
+    async def stream(   self,
+                        url: str,
+                        headers: Mapping[str, str] = None,
+                        attempts: int = 1) -> AsyncIterator[HTTPStreamResponse]:
+        """Asynchronous counterpart of `stream`, whose response's `chunks` (and `lines`) are asynchronous iterators."""
+        if httpx is None:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, partial(_send, url, headers, attempts, True))
+            chunks = response.iter_content(CHUNK_SIZE)
+
+            async def read_chunks() -> AsyncIterator[bytes]:
+                while True:
+                    chunk = await loop.run_in_executor(None, next, chunks, None)
+                    if chunk is None:
+                        return
+                    yield chunk
+
+            try:
+                yield HTTPStreamResponse(response.url, response.status_code, dict(response.headers), read_chunks())
+            finally:
+                await loop.run_in_executor(None, _release, response)
+            return
+        client = self.client(urlsplit(url).netloc)
+        for attempt in range(1, attempts + 1):
+            async with client.stream("GET", url, headers=headers) as response:
+                if 200 <= response.status_code < 300 or attempt == attempts:
+                    yield HTTPStreamResponse(
+                        str(response.url), 
+                        response.status_code, 
+                        dict(response.headers), 
+                        response.aiter_bytes(CHUNK_SIZE)
+                    )
+                    return
+            logger.warning(f"Got a {response.status_code} response from {url} (attempt {attempt}/{attempts})")
+
+    async def aclose(self) -> None:
+        """Closes the connections of all clients."""
+        clients = list(self.__clients.values())
+        self.__clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    async def __aenter__(self) -> "AsyncSessions":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+async def get_async( url: str,
+                     headers: Mapping[str, str] = None,
+                     attempts: int = 1,
+                     sessions: AsyncSessions = None) -> HTTPResponse:
+    """Asynchronous counterpart of `get`, sending the request through `sessions` 
+    (by default None, in which case the request gets its own `AsyncSessions`)."""
+    if sessions is not None:
+        return await sessions.get(url, headers, attempts)
+    async with AsyncSessions() as sessions:
+        return await sessions.get(url, headers, attempts)
+
+@asynccontextmanager
+async def stream_async( url: str,
+                        headers: Mapping[str, str] = None,
+                        attempts: int = 1,
+                        sessions: AsyncSessions = None) -> AsyncIterator[HTTPStreamResponse]:
+    """Asynchronous counterpart of `stream`, sending the request through `sessions` 
+    (by default None, in which case the request gets its own `AsyncSessions`)."""
+    if sessions is not None:
+        async with sessions.stream(url, headers, attempts) as response:
+            yield response
+        return
+    async with AsyncSessions() as sessions:
+        async with sessions.stream(url, headers, attempts) as response:
+            yield response
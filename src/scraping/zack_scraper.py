@@ -2,8 +2,33 @@
 import re
 from typing import Mapping
 
-# external dependencies
-import requests
+# local dependencies
+from .sessions import HTTPResponse, AsyncSessions, get, get_async
+
+HEADERS: Mapping[str,str] = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
+}
+
+def get_fund_url(etf: str) -> str:
+    """Returns the URL of the zacks.com page listing the holdings of `etf`."""
+    return f"https://www.zacks.com/funds/etf/{etf}/holding"
+
+def parse(response: HTTPResponse) -> Mapping[str, Mapping[str, float]]:
+    """Parses the holdings data out of zacks.com's `response` (see `fetch`)."""
+    etfs_holdings = dict()
+    if not response.ok:
+        # not a 200
+        print(f"Error: {response.status_code} for url: {response.url}")
+        return etfs_holdings
+    pat = re.compile(r'etf\\\/(.*?)\\')
+    pat = re.compile(r'<span class=\\"hoverquote-symbol\\">([a-zA-Z]*?)<span class=\\"sr-only\\"><\\/span><\\/span><\\/a>", "([0-9,]+)", "([0-9,\.]+)", "([0-9,\.]+)"')
+    for (ticker_symbol, str_shares, str_weight, str_52_week_change) in re.findall(pat, response.content.decode("utf-8")):
+        etfs_holdings[ticker_symbol] = {
+            'shares': int(str_shares.replace(",","")),
+            'weight': float(str_weight),
+            '52_week_change': float(str_52_week_change)
+        }
+    return {holding:{'weight':holding_dict['weight']} for holding, holding_dict in etfs_holdings.items()}
 
 def fetch(  etf: str,
             headers: Mapping[str,str] = None) -> Mapping[str, Mapping[str, float]]:
@@ -28,29 +53,20 @@ def fetch(  etf: str,
     """
     if etf == "":
         return dict()
-    if headers is None:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
-        }
-    etfs_holdings = dict()
-    r = requests.get(
-        f"https://www.zacks.com/funds/etf/{etf}/holding",
-        headers = headers
-    )
-    try:
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        # not a 200
-        print(f"Error: {e}")
-    else:
-        pat = re.compile(r'etf\\\/(.*?)\\')
-        pat = re.compile(r'<span class=\\"hoverquote-symbol\\">([a-zA-Z]*?)<span class=\\"sr-only\\"><\\/span><\\/span><\\/a>", "([0-9,]+)", "([0-9,\.]+)", "([0-9,\.]+)"')
-        for (ticker_symbol, str_shares, str_weight, str_52_week_change) in re.findall(pat, r.text):
-            etfs_holdings[ticker_symbol] = {
-                'shares': int(str_shares.replace(",","")),
-                'weight': float(str_weight),
-                '52_week_change': float(str_52_week_change)
-            }
-        etfs_holdings = {holding:{'weight':holding_dict['weight']} for holding, holding_dict in etfs_holdings.items()}
-    finally:
-        return etfs_holdings
\ No newline at end of file
+    return parse(get(
+        get_fund_url(etf),
+        headers = HEADERS if headers is None else headers
+    ))
+
+async def fetch_async(  etf: str,
+                        headers: Mapping[str,str] = None,
+                        sessions: AsyncSessions = None) -> Mapping[str, Mapping[str, float]]:
+    """Asynchronous counterpart of `fetch`, sending its request through `sessions`
+    (see `.sessions.get_async`)."""
+    if etf == "":
+        return dict()
+    return parse(await get_async(
+        get_fund_url(etf),
+        headers = HEADERS if headers is None else headers,
+        sessions = sessions
+    ))
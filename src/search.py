@@ -0,0 +1,194 @@
+# search.py
+
+# standard library dependencies
+import threading
+from typing import Mapping, List, Tuple, Iterable, Any
+
+# external dependencies
+import numpy as np
+from scipy import sparse
+
+# local dependencies
+from .holdings import HoldingsMatrix
+
+SEARCHABLE_DISTANCE_MEASURES = ('jaccard', 'weighted_jaccard')
+
+class ETFIndex:
+    """Precomputed index over the holdings of a universe of ETFs (typically all the ETFs
+    returned by a database client's `get_known_etfs` method), used to score a basket of
+    ETFs against every ETF in the universe at once.
+
+    Examples
+    --------
+    >>> universe = {
+    ...     'etf1': {'A': {'weight': 0.5}, 'B': {'weight': 0.5}},
+    ...     'etf2': {'A': {'weight': 0.1}, 'D': {'weight': 0.9}},
+    ...     'etf3': {'E': {'weight': 1.0}},
+    ... }
+    >>> index = ETFIndex.from_query_output(universe)
+    >>> assert find_k_nearest(index, {'etf1': universe['etf1']}, k=1) == [('etf2', 0.1/1.9)]
+    >>> assert find_k_farthest(index, {'etf1': universe['etf1']}, k=1) == [('etf3', 0.0)]
+    >>> assert find_k_nearest(index, {'etf1': universe['etf1']}, k=3, distance_measure='jaccard') == [('etf2', 1/3), ('etf3', 0.0)]
+    """
+    def __init__(self, holdings_matrix: HoldingsMatrix):
+        self.holdings_matrix = holdings_matrix
+        self.etfs: List[str] = holdings_matrix.etfs
+        # CSR so that selecting the rows (holdings) of a basket is cheap
+        self.weights: sparse.csr_matrix = holdings_matrix.weights.tocsr()
+        self.weight_totals: np.ndarray = np.asarray(self.weights.sum(axis=0)).ravel()
+        self.holding_counts: np.ndarray = self.weights.getnnz(axis=0)
+
+    def __len__(self) -> int:
+        return len(self.etfs)
+
+    @classmethod
+    def from_query_output(cls, query_output: Mapping[str, Mapping[str, Mapping]]) -> "ETFIndex":
+        """Builds the index from the output of `get_holdings_and_weights_for_etfs`."""
+        return cls(HoldingsMatrix.from_query_output(query_output))
+
+    @classmethod
+    def from_database(cls, db_client: Any, date_: Any = None) -> "ETFIndex":
+        """Builds the index over the ETFs stored by `db_client` (a `src.dbms.SQLDatabaseClient`
+        or `src.dbms.TinyDBDatabaseClient` instance) on `date_`, from the stored data only: nothing gets scraped.
+
+        By default, the index holds today's holdings of the ETFs updated today and the holdings
+        stored on the latest earlier date for the others (e.g. when `prefetch.py` hasn't run yet)."""
+        if date_ is not None:
+            return cls.from_query_output(db_client.get_holdings_snapshot(date_))
+        etfs_data = db_client.get_holdings_snapshot(db_client.today)
+        previous_date = db_client.get_latest_holdings_date(before=db_client.today)
+        if previous_date is not None:
+            etfs_data = { **db_client.get_holdings_snapshot(previous_date), **etfs_data }
+        return cls.from_query_output(etfs_data)
+
+    def score(  self,
+                query_output: Mapping[str, Mapping[str, Mapping]],
+                distance_measure: str = 'weighted_jaccard') -> np.ndarray:
+        """Returns the similarity (`1 - distance`) between the basket formed by the
+        ETFs in `query_output` and every ETF in the index (in the order of `self.etfs`).
+
+        The basket holds each holding with its average weight across the ETFs in `query_output`.
+        Holdings that aren't held by any ETF in the index still count towards the basket's size.
+        """
+        distance_measure = distance_measure.lower()
+        assert distance_measure in SEARCHABLE_DISTANCE_MEASURES, \
+            f"{distance_measure} is not among the searchable distance measures {SEARCHABLE_DISTANCE_MEASURES}"
+        assert len(query_output) > 0, "The query basket must contain at least one ETF."
+
+        basket: Mapping[str, float] = dict()
+        for etf_holdings_dict in query_output.values():
+            for holding, metadata in etf_holdings_dict.items():
+                basket[holding] = basket.get(holding, 0.0) + metadata['weight'] / len(query_output)
+        basket = { holding: weight for holding, weight in basket.items() if weight > 0 }
+
+        holding_index = self.holdings_matrix.holding_index
+        indexed = [ (holding_index[holding], weight) for holding, weight in basket.items() if holding in holding_index ]
+        rows = np.array([ row for row, weight in indexed ], dtype=np.int64)
+        basket_weights = np.array([ weight for row, weight in indexed ], dtype=float)
+
+        # only the rows of the basket's holdings can contribute to the intersections
+        block = self.weights[rows, :].tocoo()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if distance_measure == 'jaccard':
+                intersections = np.bincount(block.col, minlength=len(self.etfs)).astype(float)
+                unions = len(basket) + self.holding_counts - intersections
+                return np.where(unions > 0, intersections / unions, 1.0)
+            minimums = np.bincount(
+                block.col,
+                weights = np.minimum(block.data, basket_weights[block.row]),
+                minlength = len(self.etfs)
+            )
+            maximums = sum(basket.values()) + self.weight_totals - minimums
+            return np.where(maximums > 0, minimums / maximums, 1.0)
+
+    def rank(   self,
+                query_output: Mapping[str, Mapping[str, Mapping]],
+                k: int = 5,
+                distance_measure: str = 'weighted_jaccard',
+                farthest: bool = False,
+                exclude: Iterable[str] = None) -> List[Tuple[str, float]]:
+        """Returns the `k` (ETF ticker, similarity) pairs most (or least, if `farthest` is True)
+        similar to the basket formed by `query_output`; the ETFs in `query_output` and in
+        `exclude` are never returned."""
+        similarities = self.score(query_output, distance_measure=distance_measure)
+        excluded = set(query_output.keys()).union(exclude or [])
+        # stable sort, so ties are broken by the order of `self.etfs`
+        order = np.argsort(similarities if farthest else -similarities, kind='stable')
+        ranking: List[Tuple[str, float]] = []
+        for i in order:
+            if len(ranking) >= k:
+                break
+            if self.etfs[i] in excluded:
+                continue
+            ranking.append((self.etfs[i], float(similarities[i])))
+        return ranking
+
+# process-wide indexes over all the ETFs of each database, along with the date they were built for
+_etf_indexes: Mapping[str, Tuple[str, ETFIndex]] = dict()
+_etf_indexes_lock = threading.Lock()
+
+def get_etf_index(db_client: Any, database_key: str) -> ETFIndex:
+    """Returns the process-wide index (see `ETFIndex.from_database`) over the ETFs of the database
+    identified by `database_key` (e.g. the backend's name), built with `db_client` at most once per 
+    day (`db_client.today`); clients are only used to build the index, so they can differ between calls.
+
+    Examples
+    --------
+    >>> class Client:
+    ...     today = '2022-01-03'
+    ...     def get_holdings_snapshot(self, date_):
+    ...         return {'etf1': {'A': {'weight': 1.0}}}
+    ...     def get_latest_holdings_date(self, before=None):
+    ...         return None
+    >>> index = get_etf_index(Client(), 'example')
+    >>> assert get_etf_index(Client(), 'example') is index and index.etfs == ['etf1']
+    """
+    date_ = str(db_client.today)
+    with _etf_indexes_lock:
+        built_on, index = _etf_indexes.get(database_key, (None, None))
+        if built_on != date_:
+            index = ETFIndex.from_database(db_client)
+            _etf_indexes[database_key] = (date_, index)
+        return index
+
+def find_k_nearest( index: ETFIndex,
+                    query_output: Mapping[str, Mapping[str, Mapping]],
+                    k: int = 5,
+                    distance_measure: str = 'weighted_jaccard') -> List[Tuple[str, float]]:
+    """Returns the `k` ETFs of `index` that are the most similar to the basket of ETFs in `query_output`.
+
+    Parameters
+    ----------
+    index : ETFIndex
+        Index over the universe of ETFs to search (see `ETFIndex.from_database`).
+    query_output : Mapping[str, Mapping[str, Mapping]]
+        Dictionary mapping an ETF ticker (strings) to a sub-dictionary
+        mapping the ETF's holdings (strings) to metadata (e.g. the holding's weight
+        w.r.t. the ETF).
+        See the documentation for the `get_holdings_and_weights_for_etfs` method from
+        `src.dbms.SQLDatabaseClient` or `src.dbms.TinyDBDatabaseClient`.
+    k : int, optional
+        Number of ETFs to return, by default 5.
+    distance_measure : str, optional
+        One of ('jaccard', 'weighted_jaccard'), by default 'weighted_jaccard'.
+
+    Returns
+    -------
+    List[Tuple[str, float]]
+        List of (ETF ticker, similarity) tuples sorted by decreasing similarity.
+    """
+    return index.rank(query_output, k=k, distance_measure=distance_measure, farthest=False)
+
+def find_k_farthest(index: ETFIndex,
+                    query_output: Mapping[str, Mapping[str, Mapping]],
+                    k: int = 5,
+                    distance_measure: str = 'weighted_jaccard') -> List[Tuple[str, float]]:
+    """Returns the `k` ETFs of `index` that are the most different from the basket of ETFs in `query_output`.
+    See `find_k_nearest` for a description of the parameters.
+
+    Returns
+    -------
+    List[Tuple[str, float]]
+        List of (ETF ticker, similarity) tuples sorted by increasing similarity.
+    """
+    return index.rank(query_output, k=k, distance_measure=distance_measure, farthest=True)
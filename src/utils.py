@@ -1,12 +1,18 @@
 # utils.py
 
 # standard library dependencies
+from functools import partial
 from typing import Mapping, List, Tuple, Callable, Union, Iterable, Any
 
 # external dependencies
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from scipy.spatial.distance import jaccard
 
+# local dependencies
+from .holdings import HoldingsMatrix, HoldingsHistory
+
 def get_boundaries(enumerable: Iterable[Any]) -> List[int]:
     """Returns the indices of items in `enumerable`
     which differ from the previous item. Also includes the
@@ -36,10 +42,7 @@ def get_boundaries(enumerable: Iterable[Any]) -> List[int]:
     >>> test = get_boundaries([0, 0, 1, 1, 0, 1, 0, 0])
     >>> assert test == [0, 2, 4, 5, 6, 8]
     """
-    transitions = [ i+1 for i, (enumerable_at_i, enumerable_at_i_plus_one)
-                    in enumerate(zip(enumerable[:-1], enumerable[1:]))
-                    if enumerable_at_i != enumerable_at_i_plus_one ]
-    return [0] + transitions + [len(enumerable)]
+    return get_run_boundaries(np.asarray(enumerable)).tolist()
 
 def get_contiguous_truthy_segments(enumerable_: List[bool]) -> List[Tuple[int,int]]:
     """Returns a list of tuples of integers indicating the `(inclusive_starting_index, exclusive_stopping_index)`
@@ -71,19 +74,96 @@ def get_contiguous_truthy_segments(enumerable_: List[bool]) -> List[Tuple[int,in
     >>> out = get_contiguous_truthy_segments([False, False,])
     >>> assert out == []
     """
-    enumerable = list(map(bool, enumerable_))
-    contigs: List[Tuple[int,int]] = []
-    inclusive_starting_index = 0
-    while inclusive_starting_index < len(enumerable):
-        if enumerable[inclusive_starting_index] is False: 
-            inclusive_starting_index += 1
-        else:
-            stop_exc = inclusive_starting_index
-            while stop_exc < len(enumerable) and enumerable[stop_exc]:
-                stop_exc += 1
-            contigs.append((inclusive_starting_index, stop_exc))
-            inclusive_starting_index = stop_exc
-    return contigs
+    starts, stops = get_truthy_runs(np.asarray(enumerable_))
+    return list(zip(starts.tolist(), stops.tolist()))
+
+def get_run_boundaries(values: np.ndarray) -> np.ndarray:
+    """Vectorized run-length encoding of the 1D array `values`: returns the indices
+    at which each run of equal values starts, followed by `len(values)`, such that
+    the `i`th run spans `values[boundaries[i]:boundaries[i+1]]`.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        1D array whose items can be compared using `!=`.
+
+    Returns
+    -------
+    np.ndarray
+        Integer array of the run boundaries (`[0, 0]` for an empty `values`).
+
+    Examples
+    --------
+    >>> get_run_boundaries(np.array([0, 0, 1, 1, 0, 1, 0, 0])).tolist()
+    [0, 2, 4, 5, 6, 8]
+    >>> get_run_boundaries(np.array(["a", "a", "b"])).tolist()
+    [0, 2, 3]
+    >>> get_run_boundaries(np.array([])).tolist()
+    [0, 0]
+    """
+    values = np.asarray(values)
+    transitions = np.flatnonzero(values[1:] != values[:-1]) + 1
+    return np.concatenate(([0], transitions, [len(values)])).astype(np.int64)
+
+def get_truthy_runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized run-length encoding of the truthy segments of the 1D array `mask`.
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        1D array, whose items get converted to booleans.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Integer arrays of the inclusive starting indices and of the exclusive stopping
+        indices of the contiguous truthy segments of `mask`.
+
+    Examples
+    --------
+    >>> starts, stops = get_truthy_runs(np.array([0, 1, 0, 1, 1, 1]))
+    >>> starts.tolist(), stops.tolist()
+    ([1, 3], [2, 6])
+    >>> starts, stops = get_truthy_runs(np.array([], dtype=bool))
+    >>> starts.tolist(), stops.tolist()
+    ([], [])
+    """
+    mask = np.asarray(mask).astype(bool).ravel()
+    # padding with falsy items on both ends makes every run start and stop with a transition
+    padded = np.concatenate(([False], mask, [False]))
+    transitions = np.flatnonzero(padded[1:] != padded[:-1])
+    return transitions[::2], transitions[1::2]
+
+def get_truthy_runs_batched(mask: Union[np.ndarray, sparse.spmatrix]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized run-length encoding of the truthy segments of each row of the 2D array `mask`
+    (e.g. the ETF x holding presence matrix, see `HoldingsMatrix.presence`), in one pass over the matrix.
+
+    Parameters
+    ----------
+    mask : Union[np.ndarray, sparse.spmatrix]
+        2D (dense or sparse) array, whose items get converted to booleans.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Integer arrays of the row, of the inclusive starting index and of the exclusive stopping
+        index of each contiguous truthy segment, ordered by row then by starting index.
+
+    Examples
+    --------
+    >>> rows, starts, stops = get_truthy_runs_batched(np.array([[0, 1, 1, 0, 1], [0, 0, 0, 0, 0], [1, 1, 0, 0, 1]]))
+    >>> rows.tolist(), starts.tolist(), stops.tolist()
+    ([0, 0, 2, 2], [1, 4, 0, 4], [3, 5, 2, 5])
+    """
+    if sparse.issparse(mask):
+        mask = mask.toarray()
+    mask = np.asarray(mask).astype(bool)
+    assert mask.ndim == 2, f"`mask` has {mask.ndim} dimensions; expected 2"
+    padding = np.zeros((mask.shape[0], 1), dtype=bool)
+    padded = np.hstack((padding, mask, padding))
+    # transitions come out row by row, each row alternating between starts and stops
+    rows, transitions = np.nonzero(padded[:, 1:] != padded[:, :-1])
+    return rows[::2], transitions[::2], transitions[1::2]
 
 def get_all_holdings(query_output: Mapping[str, Mapping[str, Mapping]]) -> List[str]:
     """Convenience function used to get all the holding tickers
@@ -121,6 +201,43 @@ def get_all_holdings(query_output: Mapping[str, Mapping[str, Mapping]]) -> List[
         ]
     ))
 
+def get_holdings_matrix(query_output: Mapping[str, Mapping[str, Mapping]],
+                        all_holdings: List[str] = None) -> HoldingsMatrix:
+    """Converts the `query_output` dictionary to a sparse (holdings x ETFs) `HoldingsMatrix`.
+
+    Parameters
+    ----------
+    query_output : Mapping[str, Mapping[str, Mapping]]
+        Dictionary mapping an ETF ticker (strings) to a sub-dictionary
+        mapping the ETF's holdings (strings) to metadata (e.g. the holding's weight 
+        w.r.t. the ETF).
+        See the documentation for the `get_holdings_and_weights_for_etfs` method from
+        `src.dbms.SQLDatabaseClient` or `src.dbms.TinyDBDatabaseClient`.
+    all_holdings : List[str], optional
+        Optional list of all holdings to consider, by default None.
+        If kept as None, it gets converted to the output of `reorder_holdings_by_popularity`
+
+    Returns
+    -------
+    HoldingsMatrix
+        Sparse matrix whose rows are the holdings (ordered as `all_holdings`) and whose
+        columns are the ETFs (ordered as in `query_output`).
+
+    Examples
+    --------
+    >>> example_query_output = {'etf1': {'A': {'weight': 0.2}}, 'etf2': {'B': {'weight': 0.5}, 'A': {'weight': 0.5}}}
+    >>> out = get_holdings_matrix(example_query_output)
+    >>> assert out.holdings == ['A', 'B']
+    >>> assert out.to_dict() == {"etf1": [0.2, 0.0], "etf2": [0.5, 0.5]}
+    """
+    if all_holdings is None:
+        all_holdings = [holding for holding, annotation in 
+                        reorder_holdings_by_popularity(query_output)]
+    return HoldingsMatrix.from_query_output(
+        query_output,
+        holdings = all_holdings
+    )
+
 def get_etf_holding_weight_vectors( query_output: Mapping[str, Mapping[str, Mapping]],
                                     all_holdings: List[str] = None,
                                     as_df: bool = False) -> Union[pd.DataFrame, Mapping[str, List[float]]]:
@@ -158,26 +275,13 @@ def get_etf_holding_weight_vectors( query_output: Mapping[str, Mapping[str, Mapp
     >>> assert expected.equals(out)
     >>> assert get_etf_holding_weight_vectors(dict()) == dict()
     """
-    if all_holdings is None:
-        all_holdings = [holding for holding, annotation in 
-                        reorder_holdings_by_popularity(query_output)]
-
-    etfs_as_vectors = {
-        etf: [0.0]*len(all_holdings)
-        for etf in query_output.keys()
-    }
-    for etf, etf_holdings_dict in query_output.items():
-        for i, holding in enumerate(all_holdings):
-            try:
-                etf_holding_percentage = etf_holdings_dict[holding]['weight']
-            except KeyError:
-                etf_holding_percentage = 0.0
-            etfs_as_vectors[etf][i] = etf_holding_percentage
+    holdings_matrix = get_holdings_matrix(
+        query_output,
+        all_holdings = all_holdings
+    )
     if as_df:
-        df = pd.DataFrame.from_dict(etfs_as_vectors)
-        df.index = all_holdings
-        return df
-    return etfs_as_vectors
+        return holdings_matrix.to_dataframe()
+    return holdings_matrix.to_dict()
 
 def weighted_jaccard_distance(  vector1: Iterable[float], 
                                 vector2: Iterable[float]) -> float:
@@ -298,9 +402,242 @@ def asymmetric_coverage_overlap(vector1: Iterable[float],
     intersect = sum([v_1 * v_2 for v_1, v_2 in zip(v1,v2)])
     return intersect / sum(v1)
 
+SUPPORTED_DISTANCE_MEASURES = ('jaccard', 'weighted_jaccard', 'asymmetric_coverage_overlap')
+
+def resolve_distance_measure(distance_measure: Union[str,Callable]) -> Tuple[Union[None,str], bool]:
+    """Maps `distance_measure` to the name of the corresponding supported distance measure,
+    along with a boolean indicating whether its vectors are swapped (only relevant for
+    `asymmetric_coverage_overlap`).
+
+    Parameters
+    ----------
+    distance_measure : Union[str,Callable]
+        Either the string indicating which distance metric to use 
+        (must be one of 'asymmetric_coverage_overlap', 'jaccard', 'weighted_jaccard' if it is a string), 
+        or the function itself (possibly wrapped in a `functools.partial`).
+
+    Returns
+    -------
+    Tuple[Union[None,str], bool]
+        The name of the supported distance measure (or None if `distance_measure` is a
+        custom function), and a boolean indicating whether the vectors should be swapped.
+
+    Examples
+    --------
+    >>> assert resolve_distance_measure('Jaccard') == ('jaccard', False)
+    >>> assert resolve_distance_measure(weighted_jaccard_distance) == ('weighted_jaccard', False)
+    >>> assert resolve_distance_measure(partial(asymmetric_coverage_overlap, swap_vectors=True)) == ('asymmetric_coverage_overlap', True)
+    >>> assert resolve_distance_measure(lambda v1, v2: 0.0) == (None, False)
+    """
+    if isinstance(distance_measure, str):
+        distance_measure = distance_measure.lower()
+        assert distance_measure in SUPPORTED_DISTANCE_MEASURES, \
+            f"{distance_measure} is not among the supported distance measures ('jaccard', 'weighted_jaccard', 'asymmetric_coverage_overlap')"
+        return distance_measure, False
+    swap_vectors = False
+    if isinstance(distance_measure, partial) and not distance_measure.args:
+        swap_vectors = bool(distance_measure.keywords.get('swap_vectors', False))
+        distance_measure = distance_measure.func
+    function_to_distance_measure = {
+        jaccard: 'jaccard',
+        weighted_jaccard_distance: 'weighted_jaccard',
+        asymmetric_coverage_overlap: 'asymmetric_coverage_overlap'
+    }
+    try:
+        return function_to_distance_measure[distance_measure], swap_vectors
+    except (KeyError, TypeError):
+        return None, False
+
+def get_similarity_matrices(weight_matrix: Union[np.ndarray, sparse.spmatrix],
+                            distance_measures: Iterable[str] = SUPPORTED_DISTANCE_MEASURES,
+                            etf_indices: Iterable[int] = None) -> Mapping[str, np.ndarray]:
+    """Vectorized engine computing the pairwise similarity between all columns (ETFs) 
+    of `weight_matrix` for each of the requested distance measures in a single pass.
+
+    Parameters
+    ----------
+    weight_matrix : Union[np.ndarray, sparse.spmatrix]
+        Dense or sparse (holdings x ETFs) array of weights (>= 0.0), where 
+        `weight_matrix[h, e]` is the weight of holding `h` in ETF `e`.
+    distance_measures : Iterable[str], optional
+        Names of the distance measures to compute (each must be one of 
+        'jaccard', 'weighted_jaccard', 'asymmetric_coverage_overlap').
+        By default all of them.
+    etf_indices : Iterable[int], optional
+        Indices of the columns (ETFs) whose rows of the similarity matrices should be computed.
+        By default None, which computes the full matrices.
+
+    Returns
+    -------
+    Mapping[str, np.ndarray]
+        Dictionary mapping each distance measure's name to an (ETFs x ETFs) array `S`
+        such that `S[i, j] == 1.0 - distance_measure(weight_matrix[:, i], weight_matrix[:, j])`,
+        i.e. the same values as those reported by `get_similarity`.
+        If `etf_indices` is provided, only the rows `S[etf_indices, :]` are returned.
+        The 'asymmetric_coverage_overlap' matrix is not symmetric; its transpose corresponds 
+        to `asymmetric_coverage_overlap(..., swap_vectors=True)`. Its rows are 1.0 for ETFs without
+        any positive weight, for which `asymmetric_coverage_overlap` is undefined.
+
+    Examples
+    --------
+    >>> weights = np.array([[0.5, 0.1], [0.5, 0.0], [0.0, 0.3], [0.0, 0.3], [0.0, 0.3]])
+    >>> matrices = get_similarity_matrices(weights)
+    >>> assert np.allclose(matrices['jaccard'], [[1.0, 0.2], [0.2, 1.0]])
+    >>> assert np.allclose(matrices['weighted_jaccard'], [[1.0, 0.1/1.9], [0.1/1.9, 1.0]])
+    >>> assert np.allclose(matrices['asymmetric_coverage_overlap'], [[0.0, 0.5], [0.75, 0.0]])
+    >>> sparse_matrices = get_similarity_matrices(sparse.csr_matrix(weights))
+    >>> assert all(np.allclose(matrices[m], sparse_matrices[m]) for m in matrices)
+    >>> rows = get_similarity_matrices(weights, etf_indices=[1])
+    >>> assert all(np.allclose(matrices[m][[1]], rows[m]) for m in matrices)
+    """
+    distance_measures = [ measure.lower() for measure in distance_measures ]
+    for measure in distance_measures:
+        assert measure in SUPPORTED_DISTANCE_MEASURES, \
+            f"{measure} is not among the supported distance measures ('jaccard', 'weighted_jaccard', 'asymmetric_coverage_overlap')"
+
+    is_sparse = sparse.issparse(weight_matrix)
+    if is_sparse:
+        weights = sparse.csc_matrix(weight_matrix, dtype=float)
+        weights.eliminate_zeros()
+        minimum_weight = weights.data.min() if weights.nnz > 0 else 0.0
+    else:
+        weights = np.asarray(weight_matrix, dtype=float)
+        assert weights.ndim == 2, "`weight_matrix` must be a 2D (holdings x ETFs) array."
+        minimum_weight = weights.min() if weights.size > 0 else 0.0
+    assert minimum_weight >= 0, \
+        "`get_similarity_matrices` is meant to be used on weights >= 0.0."
+
+    n_etfs = weights.shape[1]
+    if etf_indices is None:
+        etf_indices = np.arange(n_etfs)
+    etf_indices = np.asarray(list(etf_indices), dtype=np.int64)
+
+    presence = (weights > 0).astype(float)
+    intersections = presence[:, etf_indices].T @ presence
+    if is_sparse:
+        intersections = intersections.toarray()
+    intersections = np.asarray(intersections)
+    counts = np.asarray(presence.sum(axis=0)).ravel()
+    row_counts = counts[etf_indices]
+
+    matrices: Mapping[str, np.ndarray] = dict()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if 'jaccard' in distance_measures:
+            unions = row_counts[:, None] + counts[None, :] - intersections
+            # `scipy.spatial.distance.jaccard` returns 0 for two all-zero vectors
+            matrices['jaccard'] = 1.0 - np.where(
+                unions > 0, 
+                (unions - intersections) / unions, 
+                0.0
+            )
+        if 'asymmetric_coverage_overlap' in distance_measures:
+            # an ETF without (positively weighted) holdings covers nothing
+            matrices['asymmetric_coverage_overlap'] = 1.0 - np.where(
+                row_counts[:, None] > 0,
+                intersections / row_counts[:, None],
+                0.0
+            )
+        if 'weighted_jaccard' in distance_measures:
+            minimums = np.zeros((len(etf_indices), n_etfs))
+            for row, i in enumerate(etf_indices):
+                if is_sparse:
+                    # min(w_i, w_j) can only be non-zero where ETF `i` has holdings
+                    start, stop = weights.indptr[i], weights.indptr[i+1]
+                    rows = weights.indices[start:stop]
+                    column = weights.data[start:stop]
+                    block = weights[rows, :].toarray()
+                else:
+                    column = weights[:, i]
+                    block = weights
+                minimums[row] = np.minimum(block, column[:, None]).sum(axis=0)
+            totals = np.asarray(weights.sum(axis=0)).ravel()
+            maximums = totals[etf_indices][:, None] + totals[None, :] - minimums
+            # the denominator can only be 0 if both vectors only contain 0s,
+            # in which case the vectors are identical
+            matrices['weighted_jaccard'] = np.where(
+                maximums > 0, 
+                minimums / maximums, 
+                1.0
+            )
+    return matrices
+
+def get_similarities(   query_output: Mapping[str, Mapping[str, Mapping]],
+                        distance_measures: Iterable[Union[str,Callable]] = SUPPORTED_DISTANCE_MEASURES,
+                        holdings_matrix: HoldingsMatrix = None) -> List[Mapping[Tuple[str,str], float]]:
+    """Computes the similarities between the ETFs in `query_output` for several distance measures
+    at once, building the ETFs' weight vectors only once.
+
+    Parameters
+    ----------
+    query_output : Mapping[str, Mapping[str, Mapping]]
+        Dictionary mapping an ETF ticker (strings) to a sub-dictionary
+        mapping the ETF's holdings (strings) to metadata (e.g. the holding's weight 
+        w.r.t. the ETF).
+        See the documentation for the `get_holdings_and_weights_for_etfs` method from
+        `src.dbms.SQLDatabaseClient` or `src.dbms.TinyDBDatabaseClient`.
+    distance_measures : Iterable[Union[str,Callable]], optional
+        Distance measures to use; see `get_similarity`'s `distance_measure` argument.
+        By default ('jaccard', 'weighted_jaccard', 'asymmetric_coverage_overlap').
+    holdings_matrix : HoldingsMatrix, optional
+        Precomputed output of `get_holdings_matrix(query_output)`, by default None.
+
+    Returns
+    -------
+    List[Mapping[Tuple[str,str], float]]
+        One dictionary per distance measure (in the order of `distance_measures`), 
+        formatted like the output of `get_similarity`.
+
+    Examples
+    --------
+    >>> sample = {"etf1": {"tickerA": {"weight": 0.5}, "tickerB": {"weight": 0.5}}, "etf2": {"tickerA": {"weight": 1.0}}}
+    >>> jaccard_similarities, coverage, swapped_coverage = get_similarities(
+    ...     sample, ['jaccard', 'asymmetric_coverage_overlap', partial(asymmetric_coverage_overlap, swap_vectors=True)]
+    ... )
+    >>> assert jaccard_similarities == {("etf1", "etf2"): 0.5}
+    >>> assert coverage == {("etf1", "etf2"): 0.5}
+    >>> assert swapped_coverage == {("etf1", "etf2"): 0.0}
+    """
+    distance_measures = list(distance_measures)
+    resolved = [ resolve_distance_measure(measure) for measure in distance_measures ]
+    if holdings_matrix is None:
+        holdings_matrix = get_holdings_matrix(query_output)
+    etf_names = sorted(holdings_matrix.etfs)
+    holdings_matrix = holdings_matrix.subset(etf_names)
+    pairs = [
+        (i, j) 
+        for i in range(len(etf_names)) 
+        for j in range(i+1, len(etf_names))
+    ]
+    matrices: Mapping[str, np.ndarray] = dict()
+    if len(etf_names) > 0:
+        matrices = get_similarity_matrices(
+            holdings_matrix.weights,
+            distance_measures = { name for (name, swap_vectors) in resolved if name is not None }
+        )
+
+    all_similarities: List[Mapping[Tuple[str,str], float]] = []
+    for distance_measure, (name, swap_vectors) in zip(distance_measures, resolved):
+        similarities = dict()
+        if name is None:
+            # custom distance measure; no vectorized implementation available
+            etfs_as_vectors = holdings_matrix.to_dict()
+            for i, j in pairs:
+                similarities[(etf_names[i], etf_names[j])] = 1.0 - distance_measure(
+                    etfs_as_vectors[etf_names[i]],
+                    etfs_as_vectors[etf_names[j]]
+                )
+        else:
+            matrix = matrices[name].T if swap_vectors else matrices[name]
+            for i, j in pairs:
+                similarities[(etf_names[i], etf_names[j])] = float(matrix[i, j])
+        all_similarities.append(similarities)
+    return all_similarities
+
 def get_similarity( query_output: Mapping[str, Mapping[str, Mapping]],
                     distance_measure: Union[str,Callable] = jaccard) -> Mapping[Tuple[str,str], float]:
     """Wrapper around the functions for the supported distance measures.
+    Supported distance measures are computed for all pairs of ETFs at once 
+    (see `get_similarity_matrices`).
 
     Parameters
     ----------
@@ -333,37 +670,119 @@ def get_similarity( query_output: Mapping[str, Mapping[str, Mapping]],
     >>> similarities = get_similarity(sample, distance_measure="weighted_jaccard")
     >>> assert round(similarities[('etf1','etf2')],3) == 0.053
     """
-    if isinstance(distance_measure, str):
-        distance_measure = distance_measure.lower()
-        assert distance_measure in ('jaccard','weighted_jaccard','asymmetric_coverage_overlap'), \
-            f"{distance_measure} is not among the supported distance measures ('jaccard', 'weighted_jaccard', 'asymmetric_coverage_overlap')"
-        distance_measure_to_function = {
-            'jaccard': jaccard,
-            'weighted_jaccard': weighted_jaccard_distance,
-            'asymmetric_coverage_overlap': asymmetric_coverage_overlap
-        }
-        distance_measure = distance_measure_to_function[distance_measure]
-        
-    etfs_as_vectors = get_etf_holding_weight_vectors(
-        query_output
-    )
-    
-    etf_names = sorted(etfs_as_vectors.keys())
-    similarities = dict()
-    for i, etf1_name in enumerate(etf_names):
-        for etf2_name in etf_names[i+1:]:
-            if distance_measure is jaccard:
-                # need to map to booleans
-                similarities[(etf1_name, etf2_name)] = 1.0 - distance_measure(
-                    list(map(bool, etfs_as_vectors[etf1_name])),
-                    list(map(bool, etfs_as_vectors[etf2_name]))
-                )
-            else:
-                similarities[(etf1_name, etf2_name)] = 1.0 - distance_measure(
-                    etfs_as_vectors[etf1_name],
-                    etfs_as_vectors[etf2_name]
-                )
-    return similarities
+    return get_similarities(
+        query_output,
+        distance_measures = [distance_measure]
+    )[0]
+
+def get_similarity_time_series( history1: HoldingsHistory,
+                                history2: HoldingsHistory,
+                                distance_measure: Union[str,Callable] = jaccard) -> pd.Series:
+    """Computes the similarity between two ETFs on every date both of them have holdings data for,
+    with one vectorized pass over their (dates x holdings) arrays for the supported distance measures.
+
+    Parameters
+    ----------
+    history1 : HoldingsHistory
+        Holdings of the first ETF over time (see `get_holdings_history`).
+    history2 : HoldingsHistory
+        Holdings of the second ETF over time.
+    distance_measure : Union[str,Callable], optional
+        Distance measure to use; see `get_similarity`'s `distance_measure` argument.
+        By default 'jaccard'
+
+    Returns
+    -------
+    pd.Series
+        Series indexed by the (sorted) dates present in both histories, whose values are 
+        the similarities that `get_similarity` reports for the two ETFs on each date.
+
+    Examples
+    --------
+    >>> history1 = HoldingsHistory.from_records("etf1", [(1, "A", 0.5), (1, "B", 0.5), (2, "A", 1.0)])
+    >>> history2 = HoldingsHistory.from_records("etf2", [(1, "A", 1.0), (2, "A", 0.5), (2, "C", 0.5), (3, "A", 1.0)])
+    >>> assert get_similarity_time_series(history1, history2, "jaccard").to_dict() == {1: 0.5, 2: 0.5}
+    >>> assert get_similarity_time_series(history1, history2, weighted_jaccard_distance).round(3).to_dict() == {1: 0.333, 2: 0.333}
+    >>> assert get_similarity_time_series(history1, history2, "asymmetric_coverage_overlap").to_dict() == {1: 0.5, 2: 0.0}
+    """
+    name, swap_vectors = resolve_distance_measure(distance_measure)
+    dates = sorted(set(history1.dates).intersection(history2.dates))
+    holdings = sorted(set(history1.holdings).union(history2.holdings))
+    weights1 = history1.reindex(dates, holdings).weights
+    weights2 = history2.reindex(dates, holdings).weights
+    if name is None:
+        # custom distance measure; no vectorized implementation available
+        similarities = np.array([ 1.0 - distance_measure(vector1, vector2) for vector1, vector2 in zip(weights1, weights2) ])
+        return pd.Series(similarities, index=dates, dtype=float)
+
+    presence1, presence2 = weights1 > 0, weights2 > 0
+    intersections = (presence1 & presence2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if name == 'jaccard':
+            unions = (presence1 | presence2).sum(axis=1)
+            # `scipy.spatial.distance.jaccard` returns 0 for two all-zero vectors
+            similarities = np.where(unions > 0, intersections / unions, 1.0)
+        elif name == 'weighted_jaccard':
+            minimums = np.minimum(weights1, weights2).sum(axis=1)
+            maximums = np.maximum(weights1, weights2).sum(axis=1)
+            similarities = np.where(maximums > 0, minimums / maximums, 1.0)
+        else:
+            counts = (presence2 if swap_vectors else presence1).sum(axis=1)
+            similarities = 1.0 - intersections / counts
+    return pd.Series(similarities, index=dates, dtype=float)
+
+def get_holdings_membership(query_output: Mapping[str, Mapping[str, Mapping]]) -> Tuple[List[str], np.ndarray]:
+    """Returns the holdings held by >= 1 ETF in `query_output` (in order of first appearance)
+    along with the boolean (holdings x ETFs) matrix indicating which ETF holds which holding.
+
+    Parameters
+    ----------
+    query_output : Mapping[str, Mapping[str, Mapping]]
+        Dictionary mapping an ETF ticker (strings) to a sub-dictionary
+        mapping the ETF's holdings (strings) to metadata (e.g. the holding's weight 
+        w.r.t. the ETF).
+        See the documentation for the `get_holdings_and_weights_for_etfs` method from
+        `src.dbms.SQLDatabaseClient` or `src.dbms.TinyDBDatabaseClient`.
+
+    Returns
+    -------
+    Tuple[List[str], np.ndarray]
+        The holding tickers, and the boolean membership matrix whose `[h, i]`th item
+        indicates whether the `i`th ETF holds the `h`th holding.
+
+    Examples
+    --------
+    >>> sample = {"etf1": {"tickerA": {"weight": 0.5}, "tickerB": {"weight": 0.5}}, "etf2": {"tickerC": {"weight": 1.0}, "tickerA": {"weight": 0.0}}}
+    >>> holdings, membership = get_holdings_membership(sample)
+    >>> holdings
+    ['tickerA', 'tickerB', 'tickerC']
+    >>> membership.astype(int).tolist()
+    [[1, 1], [1, 0], [0, 1]]
+    """
+    holding_index: Mapping[str, int] = dict()
+    rows: List[int] = []
+    columns: List[int] = []
+    for i, etf_holdings_dict in enumerate(query_output.values()):
+        for holding in etf_holdings_dict.keys():
+            rows.append(holding_index.setdefault(holding, len(holding_index)))
+            columns.append(i)
+    membership = np.zeros((len(holding_index), len(query_output)), dtype=bool)
+    membership[np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)] = True
+    return list(holding_index.keys()), membership
+
+def get_membership_annotations(membership: np.ndarray) -> List[str]:
+    """Converts each row of the boolean `membership` matrix (see `get_holdings_membership`)
+    to a string of `'1'`s and `'0'`s, without going through Python-level loops over its items.
+
+    Examples
+    --------
+    >>> get_membership_annotations(np.array([[True, False, True], [False, False, True]]))
+    ['101', '001']
+    """
+    n_rows, n_columns = membership.shape
+    # one ASCII '0' (48) or '1' (49) byte per item, decoded once and sliced per row
+    characters = (np.asarray(membership, dtype=np.uint8) + ord('0')).tobytes().decode('ascii')
+    return [ characters[i*n_columns:(i+1)*n_columns] for i in range(n_rows) ]
 
 def annotate_holdings(query_output: Mapping[str, Mapping[str, Mapping]]) -> Mapping[str, str]:
     """Returns a dictionary mapping each holding held by >= 1 ETF in `query_output`
@@ -397,22 +816,8 @@ def annotate_holdings(query_output: Mapping[str, Mapping[str, Mapping]]) -> Mapp
     >>> assert out == {'tickerA': '101', 'tickerB': '101', 'tickerC': '010', 'tickerD': '001'}
 
     """
-    all_holdings_with_annotations: Mapping[str, tuple] = dict()
-    # loop over all ETFs
-    for i, (etf, etf_holdings_dict) in enumerate(query_output.items()):
-        # loop over each holding in the current ETF
-        for holding in etf_holdings_dict.keys():
-            current_annotation = all_holdings_with_annotations.get(
-                holding,
-                [0]*len(query_output)
-            )
-            current_annotation[i] = 1
-            all_holdings_with_annotations[holding] = current_annotation
-    return {
-        key: ''.join(map(str, annotation))
-        for key, annotation in 
-        all_holdings_with_annotations.items()
-    }
+    holdings, membership = get_holdings_membership(query_output)
+    return dict(zip(holdings, get_membership_annotations(membership)))
 
 def reorder_holdings_by_popularity(query_output: Mapping[str, Mapping[str, Mapping]]) -> List[Tuple[str,str]]:
     """Convenience wrapper around `annotate_holdings` that sorts its result such that
@@ -443,11 +848,15 @@ def reorder_holdings_by_popularity(query_output: Mapping[str, Mapping[str, Mappi
     >>> out = reorder_holdings_by_popularity(sample)
     >>> assert out == [('tickerD', '1011'), ('tickerB', '1010'), ('tickerC', '0100'), ('tickerA', '0010')]
     """
-    return sorted(
-        annotate_holdings(query_output).items(),
-        key = lambda item: int(item[1],2),
-        reverse = True
-    )
+    holdings, membership = get_holdings_membership(query_output)
+    if len(holdings) == 0:
+        return []
+    # sorting the negated membership rows lexicographically (the first ETF being the primary key)
+    # is the same as sorting the annotations' binary values in decreasing order; `np.lexsort` being
+    # stable, holdings with the same membership keep their order
+    order = np.lexsort(~membership.T[::-1])
+    annotations = get_membership_annotations(membership[order])
+    return [ (holdings[i], annotation) for i, annotation in zip(order.tolist(), annotations) ]
 
 if __name__ == '__main__':
     import doctest 
@@ -0,0 +1,167 @@
+# standard library dependencies
+import time
+import datetime
+
+# external dependencies
+import pytest
+
+# local dependencies
+from src.cache import HoldingsCache, SharedCache, DiskCacheBackend, InMemoryCacheBackend, RenderCache, cached_holdings, estimate_nbytes, render_key
+from src.dbms.SQLite3DatabaseClient import SQLite3DatabaseClient
+
+YESTERDAY = str(datetime.date.today() - datetime.timedelta(days=1))
+TODAY = str(datetime.date.today())
+
+def test_holdings_cache_bounds():
+    holdings = {f"H{i}": {"weight": 0.01} for i in range(100)}
+    cache = HoldingsCache(max_entries=10, max_bytes=3 * estimate_nbytes(holdings))
+    for etf in ("A", "B", "C"):
+        cache.put(etf, YESTERDAY, holdings)
+    assert cache.get("A", YESTERDAY) is holdings
+    # "B" is the least recently used entry
+    cache.put("D", YESTERDAY, holdings)
+    assert cache.get("B", YESTERDAY) is None
+    assert len(cache) == 3 and cache.nbytes <= cache.max_bytes
+    assert cache.stats()["evictions"] == 1
+    # values larger than the cache itself are never cached
+    cache.put("E", YESTERDAY, [holdings] * 4)
+    assert cache.get("E", YESTERDAY) is None
+
+def test_holdings_cache_expires_todays_holdings():
+    cache = HoldingsCache(today_ttl_seconds=0.01)
+    cache.put("A", YESTERDAY, {"X": {"weight": 1.0}})
+    cache.put("A", TODAY, {"Y": {"weight": 1.0}})
+    time.sleep(0.02)
+    assert cache.get("A", YESTERDAY) is not None
+    assert cache.get("A", TODAY) is None
+
+def test_cached_holdings_resolves_dates():
+    class Client:
+        today = TODAY
+        holdings_cache = HoldingsCache()
+        calls = []
+
+        @cached_holdings
+        def get_holdings_and_weights_for_etf(self, etf_ticker, date_=None):
+            self.calls.append((etf_ticker, date_))
+            return [(date_, etf_ticker)]
+
+    client = Client()
+    assert client.get_holdings_and_weights_for_etf("spy") == [(TODAY, "spy")]
+    assert client.get_holdings_and_weights_for_etf("SPY", TODAY) == [(TODAY, "spy")]
+    assert client.get_holdings_and_weights_for_etf("SPY", YESTERDAY) == [(YESTERDAY, "SPY")]
+    assert client.calls == [("spy", TODAY), ("SPY", YESTERDAY)]
+    assert client.holdings_cache.stats()["hits"] == 1
+
+def test_inserting_holdings_invalidates_the_cache(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    db_client.insert_etf_holding_data("ETF1", {"A": {"weight": 1.0}})
+    assert len(db_client.get_holdings_and_weights_for_etf("ETF1")) == 1
+    assert db_client.holdings_cache.get("ETF1", db_client.today) is not None
+    db_client.execute_query("DELETE FROM etf_holdings_table;")
+    db_client.insert_etf_holding_data("ETF1", {"A": {"weight": 0.5}, "B": {"weight": 0.5}})
+    assert db_client.holdings_cache.get("ETF1", db_client.today) is None
+    assert len(db_client.get_holdings_and_weights_for_etf("ETF1")) == 2
+
+def test_disk_cache_backend_is_shared_between_instances(tmp_path):
+    writer, reader = DiskCacheBackend(str(tmp_path)), DiskCacheBackend(str(tmp_path))
+    writer.set("key", b"value")
+    writer.set("expiring", b"value", ttl_seconds=0.01)
+    time.sleep(0.02)
+    assert reader.get("key") == b"value"
+    assert reader.get("expiring") is None
+    reader.delete("key")
+    assert writer.get("key") is None
+
+def test_in_memory_cache_backend_bounds():
+    backend = InMemoryCacheBackend(max_entries=10, max_bytes=300)
+    for key in ("A", "B", "C"):
+        backend.set(key, b"x" * 100)
+    assert backend.get("A") == b"x" * 100
+    # "B" is the least recently used value
+    backend.set("D", b"x" * 100)
+    assert backend.get("B") is None
+    assert len(backend) == 3 and backend.nbytes == 300
+    # values larger than the backend itself are never stored
+    backend.set("E", b"x" * 400)
+    assert backend.get("E") is None and len(backend) == 3
+
+def test_disk_cache_backend_sweeps_expired_and_old_files(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_bytes=2 * (100 + 8))
+    backend.set("expiring", b"x" * 100, ttl_seconds=0.01)
+    for key in ("A", "B", "C"):
+        backend.set(key, b"x" * 100)
+        time.sleep(0.01)
+    assert backend.sweep() == 2
+    assert backend.get("expiring") is None and backend.get("A") is None
+    assert backend.get("B") == backend.get("C") == b"x" * 100
+    # writes sweep the directory once `sweep_interval_seconds` have passed
+    backend.sweep_interval_seconds = 0.0
+    backend.set("D", b"x" * 100)
+    assert backend.get("B") is None and len(list(tmp_path.iterdir())) == 2
+
+def test_bulk_reads_are_served_from_the_shared_cache(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    db_client.shared_cache = SharedCache(DiskCacheBackend(str(tmp_path / "cache")), namespace="test")
+    db_client.insert_etf_holding_data("ETF1", {"A": {"weight": 0.5}, "B": {"weight": 0.5}})
+    holdings, unavailable = db_client.get_holdings_and_weights_for_etfs(["etf1"])
+    assert unavailable == [] and holdings["etf1"] == {"A": {"weight": 0.5}, "B": {"weight": 0.5}}
+
+    # another process sharing the cache doesn't query the database
+    other_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    other_client.shared_cache = SharedCache(DiskCacheBackend(str(tmp_path / "cache")), namespace="test")
+    queries = []
+    other_client.execute_query = lambda *args: queries.append(args)
+    assert other_client.get_holdings_and_weights_for_etfs(["ETF1"]) == ({"ETF1": holdings["etf1"]}, [])
+    assert queries == []
+
+    # new holdings invalidate the cached snapshot
+    db_client.execute_query("DELETE FROM etf_holdings_table;")
+    db_client.insert_etf_holding_data("ETF1", {"C": {"weight": 1.0}})
+    assert other_client.shared_cache.get_holdings("ETF1", db_client.today) is None
+
+def test_render_cache_bounds():
+    cache = RenderCache(max_entries=10, max_bytes=300)
+    for etf in ("A", "B", "C"):
+        cache.put(render_key("similarity", "SQLite3", [etf], YESTERDAY, "jaccard"), YESTERDAY, b"x" * 100)
+    assert cache.get(render_key("similarity", "SQLite3", ["A"], YESTERDAY, "jaccard")) == b"x" * 100
+    # "B" is the least recently used image
+    cache.put(render_key("similarity", "SQLite3", ["D"], YESTERDAY, "jaccard"), YESTERDAY, b"x" * 100)
+    assert cache.get(render_key("similarity", "SQLite3", ["B"], YESTERDAY, "jaccard")) is None
+    assert cache.stats() == dict(hits=1, misses=1, evictions=1, entries=3, nbytes=300)
+
+def test_render_cache_is_shared_on_disk(tmp_path):
+    renders = []
+    def render() -> bytes:
+        renders.append(None)
+        return b"png"
+    key = render_key("holdings_tracks", "SQLite3", ["SPY", "QQQ"], YESTERDAY, theme="dark", ordered=True, dpi=200)
+    assert RenderCache(str(tmp_path)).get_or_render(key, YESTERDAY, render) == b"png"
+    # served from the disk by another instance (e.g. another process), without rendering
+    cache = RenderCache(str(tmp_path))
+    assert cache.get_or_render(key, YESTERDAY, render) == b"png"
+    assert len(renders) == 1 and len(cache) == 1
+    # another order of the tracks is another figure
+    other_key = render_key("holdings_tracks", "SQLite3", ["QQQ", "SPY"], YESTERDAY, theme="dark", ordered=True, dpi=200)
+    assert cache.get(other_key) is None
+
+def test_render_cache_expires_todays_images(tmp_path):
+    cache = RenderCache(str(tmp_path), today_ttl_seconds=0.01)
+    cache.put("yesterday", YESTERDAY, b"png")
+    cache.put("today", TODAY, b"png")
+    time.sleep(0.02)
+    assert cache.get("yesterday") == b"png"
+    assert cache.get("today") is None
+    assert RenderCache(str(tmp_path)).get("today") is None
+
+def test_render_cache_bounds_its_disk_store(tmp_path):
+    cache = RenderCache(str(tmp_path), max_disk_bytes=2 * (100 + 8))
+    for etf in ("A", "B", "C"):
+        cache.put(render_key("similarity", "SQLite3", [etf], YESTERDAY, "jaccard"), YESTERDAY, b"x" * 100)
+        time.sleep(0.01)
+    assert cache.disk.sweep() == 1
+    other_cache = RenderCache(str(tmp_path))
+    assert other_cache.get(render_key("similarity", "SQLite3", ["A"], YESTERDAY, "jaccard")) is None
+    assert other_cache.get(render_key("similarity", "SQLite3", ["C"], YESTERDAY, "jaccard")) == b"x" * 100
+    # charts of the same ETFs rendered from another database's data aren't shared
+    assert other_cache.get(render_key("similarity", "TinyDB", ["C"], YESTERDAY, "jaccard")) is None
@@ -1,12 +1,26 @@
 # test_dbms.py 
 
 # standard library dependencies
+import os
+import math
+import time
+import sqlite3
+import datetime
+import threading
+from functools import partial
 
 # external dependencies
 import pytest
+from tinydb import TinyDB
 
 # local dependencies
 from src.backend import select_database
+from src.dbms.SQLite3DatabaseClient import SQLite3DatabaseClient
+from src.dbms.ConnectionPool import ConnectionPool
+from src.dbms.TinyDBDatabaseClient import TinyDBDatabaseClient
+from src.dbms.TinyDBStorage import IndexedTinyDB
+from src.utils import get_similarity, asymmetric_coverage_overlap
+from src.search import ETFIndex, find_k_nearest
 
 test_etfs = [
     ("SPY", True),
@@ -24,3 +38,486 @@ def test_zack_scraper(etf, answer):
                 db_client.get_holdings_and_weights_for_etf(etf)
         else:
             assert len(db_client.get_holdings_and_weights_for_etf(etf)) > 0
+
+def test_find_similar_etfs(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    holdings = [ f"T{i}" for i in range(300) ]
+    db_client.insert_etf_holding_data("ETF1", { holding: {"weight": 1/300} for holding in holdings })
+    db_client.insert_etf_holding_data("ETF2", { holding: {"weight": 1/290} for holding in holdings[:290] })
+    db_client.insert_etf_holding_data("ETF3", { f"X{i}": {"weight": 0.1} for i in range(10) })
+    for weighted in (False, True):
+        similar_etfs = db_client.find_similar_etfs("ETF1", threshold=0.8, weighted=weighted)
+        assert [ etf for etf, similarity in similar_etfs ] == ["ETF2"]
+
+def test_minhash_signatures_are_inserted_with_the_holdings(tmp_path, monkeypatch):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    db_client.insert_etfs_holding_data({
+        "ETF1": {"A": {"weight": 0.5}, "B": {"weight": 0.5}},
+        "ETF2": {"A": {"weight": 1.0}},
+    })
+    for table, rows_per_etf in (("etf_minhash_table", 2), ("etf_lsh_bucket_table", 2 * db_client.lsh_bands)):
+        assert db_client.execute_query(f"SELECT COUNT(*) FROM {table};") == [(2 * rows_per_etf,)]
+
+    def insert_minhash_signatures(cur, signatures, date_):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(db_client, "insert_minhash_signatures", insert_minhash_signatures)
+    # failing to store the signatures rolls back the new holdings, and keeps the previous signatures
+    assert db_client.insert_etfs_holding_data({"ETF1": {"C": {"weight": 1.0}}}) == dict()
+    assert db_client.get_holdings_snapshot(db_client.today, ["ETF1"]) == {"ETF1": {"A": {"weight": 0.5}, "B": {"weight": 0.5}}}
+    assert db_client.execute_query("SELECT COUNT(*) FROM etf_minhash_table;") == [(4,)]
+
+def test_update_similarity_table(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    etfs_data = {
+        "ETF1": {"A": {"weight": 0.5}, "B": {"weight": 0.5}},
+        "ETF2": {"A": {"weight": 0.1}, "D": {"weight": 0.3}, "E": {"weight": 0.3}, "F": {"weight": 0.3}},
+        "ETF3": {"A": {"weight": 0.4}, "B": {"weight": 0.4}, "G": {"weight": 0.2}},
+    }
+    for etf, holdings in etfs_data.items():
+        db_client.insert_etf_holding_data(etf, { holding: dict(metadata) for holding, metadata in holdings.items() })
+    yesterday = db_client.today - datetime.timedelta(days=1)
+    db_client.execute_query(
+        """INSERT INTO etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight) 
+        SELECT ?, ETF_ticker_ID, Holding_ID, Holding_Weight FROM etf_holdings_table WHERE Date = ?;""",
+        (yesterday, db_client.today)
+    )
+    assert db_client.update_similarity_table(yesterday) == 3 * 4
+    # only ETF3 changed since yesterday
+    db_client.execute_query(
+        """DELETE FROM etf_holdings_table WHERE Date = ? AND ETF_ticker_ID = ? 
+        AND Holding_ID = (SELECT Holding_ID FROM holdings_table WHERE Holding = 'G');""",
+        (db_client.today, db_client.get_etf_id_for_ticker("ETF3"))
+    )
+    del etfs_data["ETF3"]["G"]
+    assert db_client.update_similarity_table() == 2 * 4
+    for distance_measure in ("jaccard", "weighted_jaccard"):
+        stored = db_client.get_stored_similarities(etfs_data.keys(), distance_measure)
+        expected = get_similarity(etfs_data, distance_measure=distance_measure)
+        assert stored.keys() == expected.keys()
+        for pair, similarity in expected.items():
+            assert stored[pair] == pytest.approx(similarity)
+    for swap_vectors in (False, True):
+        stored = db_client.get_stored_similarities(etfs_data.keys(), "asymmetric_coverage_overlap", swap_vectors=swap_vectors)
+        expected = get_similarity(etfs_data, distance_measure=partial(asymmetric_coverage_overlap, swap_vectors=swap_vectors))
+        for pair, similarity in expected.items():
+            assert stored[pair] == pytest.approx(similarity)
+    assert db_client.get_stored_similarities(["ETF1", "UNKNOWN"], "jaccard") is None
+
+def test_update_similarity_table_handles_etfs_without_weights_and_refreshes_the_cache(tmp_path):
+    db_client = DatedSQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    etfs_data = {
+        "ETF1": {"X": {"weight": 0.5}, "Y": {"weight": 0.5}},
+        "ETF2": {"X": {"weight": 0.9}, "Z": {"weight": 0.1}},
+        # e.g. a fund whose only line is cash
+        "CASH": {"X": {"weight": 0.0}},
+    }
+    db_client.insert_etfs_holding_data({ etf: { holding: dict(metadata) for holding, metadata in holdings.items() } for etf, holdings in etfs_data.items() })
+    assert db_client.update_similarity_table() == 3 * 4
+    similarities = [ similarity for (similarity,) in db_client.execute_query("SELECT Similarity FROM etf_similarity_table;") ]
+    assert all( similarity is not None and not math.isnan(similarity) for similarity in similarities )
+    coverage = db_client.get_stored_similarities(["ETF1", "CASH"], "asymmetric_coverage_overlap")
+    assert coverage == {("CASH", "ETF1"): 1.0}
+    assert db_client.get_stored_similarities(["ETF1", "CASH"], "asymmetric_coverage_overlap", swap_vectors=True) == {("CASH", "ETF1"): 1.0}
+
+    # recomputing a past date replaces the similarity matrices cached for it
+    assert db_client.get_stored_similarities(["ETF1", "ETF2"], "weighted_jaccard")[("ETF1", "ETF2")] == pytest.approx(0.5 / 1.5)
+    db_client.execute_query("DELETE FROM etf_holdings_table WHERE ETF_ticker_ID = ?;", (db_client.get_etf_id_for_ticker("ETF2"),))
+    db_client.insert_etf_holding_data("ETF2", {"X": {"weight": 0.5}, "Y": {"weight": 0.5}})
+    db_client.update_similarity_table()
+    assert db_client.get_stored_similarities(["ETF1", "ETF2"], "weighted_jaccard")[("ETF1", "ETF2")] == pytest.approx(1.0)
+
+def test_get_holdings_and_weights_for_etfs_reads_in_bulk(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    etfs_data = {
+        "ETF1": {"A": {"weight": 0.5}, "B": {"weight": 0.5}},
+        "ETF2": {"A": {"weight": 0.1}, "D": {"weight": 0.9}},
+    }
+    for etf, holdings in etfs_data.items():
+        db_client.insert_etf_holding_data(etf, { holding: dict(metadata) for holding, metadata in holdings.items() })
+    yesterday = db_client.today - datetime.timedelta(days=1)
+    db_client.execute_query(
+        """INSERT INTO etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight) 
+        SELECT ?, ETF_ticker_ID, Holding_ID, Holding_Weight FROM etf_holdings_table WHERE Date = ?;""",
+        (yesterday, db_client.today)
+    )
+    queries = []
+    execute_query = db_client.execute_query
+    db_client.execute_query = lambda query, *args: queries.append(query) or execute_query(query, *args)
+    # past data can't be scraped, so ETF3 is unavailable rather than fetched
+    results, unavailable_etfs = db_client.get_holdings_and_weights_for_etfs(["etf1", "ETF2", "ETF3"], yesterday)
+    assert results == { "etf1": etfs_data["ETF1"], "ETF2": etfs_data["ETF2"] }
+    assert unavailable_etfs == ["ETF3"]
+    queries.clear()
+    results, unavailable_etfs = db_client.get_holdings_and_weights_for_etfs(["ETF1", "ETF2"])
+    assert results == etfs_data and unavailable_etfs == []
+    assert len(queries) == 1
+
+def test_connection_pool(tmp_path):
+    connect = lambda: sqlite3.connect(str(tmp_path / "pool.sqlite"), check_same_thread=False)
+    pool = ConnectionPool(connect, min_connections=1, max_connections=2, health_check_interval=0.0)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (x integer);")
+    # connections are reused rather than reopened
+    with pool.connection() as reused_conn:
+        assert reused_conn is conn
+    # at most `max_connections` connections are handed out at once
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+    pool.release(first)
+    pool.release(second)
+    assert pool.size == 2
+    # transactions are rolled back on errors
+    with pytest.raises(ZeroDivisionError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO t (x) VALUES (1);")
+            1/0
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t;").fetchall() == [(0,)]
+    # broken connections fail the health check and get replaced
+    conn.close()
+    with pool.connection() as new_conn:
+        assert new_conn is not conn
+        assert new_conn.execute("SELECT COUNT(*) FROM t;").fetchall() == [(0,)]
+    pool.close()
+
+def test_insert_etf_holding_data_rolls_back(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    holdings = db_client.insert_etf_holding_data("etf1", {"A": {"weight": 0.5}, "B": {"weight": 0.5}})
+    assert len(holdings) == 2
+    # the holdings table is shared, so known holdings are reused
+    holdings = db_client.insert_etf_holding_data("etf2", {"B": {"weight": 0.2}, "C": {"weight": 0.8}})
+    assert len(holdings) == 2
+    assert db_client.execute_query("SELECT COUNT(*) FROM holdings_table;") == [(3,)]
+    # a missing weight makes the insertion fail halfway through
+    assert db_client.insert_etf_holding_data("etf3", {"D": {"weight": 1.0}, "E": dict()}) is None
+    assert db_client.execute_query("SELECT COUNT(*) FROM holdings_table;") == [(3,)]
+    assert db_client.get_known_etfs() == ["ETF1", "ETF2"]
+    assert db_client.execute_query("SELECT COUNT(*) FROM etf_holdings_table;") == [(4,)]
+
+def test_resolve_holding_ids(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    holding_ids = db_client.resolve_holding_ids(["A", "B", "A"])
+    assert sorted(holding_ids.keys()) == ["A", "B"]
+    assert db_client.get_holding_id_for_ticker("b") == holding_ids["B"]
+    # clients of the same database share the cache, so known tickers don't hit the database
+    other_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    queries = []
+    other_client.execute_query = lambda query, *args: queries.append(query)
+    other_client.transaction = None
+    assert other_client.resolve_holding_ids(["B", "A"]) == holding_ids
+    assert queries == []
+    # IDs resolved within a rolled back transaction aren't cached
+    assert db_client.insert_etf_holding_data("etf1", {"C": {"weight": 1.0}, "D": dict()}) is None
+    assert "C" not in db_client.holding_ids
+    holdings = db_client.insert_etf_holding_data("etf1", {"C": {"weight": 0.5}, "A": {"weight": 0.5}})
+    assert [ holding_id for (_, _, holding_id, _) in holdings ] == [db_client.holding_ids["C"], holding_ids["A"]]
+
+def test_migrate_upgrades_existing_databases(tmp_path):
+    connection_str = str(tmp_path / "etf.sqlite")
+    # database created before the migrations existed, with duplicated holdings
+    with sqlite3.connect(connection_str) as conn:
+        conn.execute("CREATE TABLE etf_holdings_table(Row_ID integer PRIMARY KEY, Date DATE, ETF_ticker_ID integer, Holding_ID integer, Holding_Weight real);")
+        conn.executemany(
+            "INSERT INTO etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight) VALUES (?, ?, ?, ?);",
+            [("2022-01-03", 1, 1, 0.5), ("2022-01-03", 1, 2, 0.5), ("2022-01-03", 1, 2, 0.5)]
+        )
+    db_client = SQLite3DatabaseClient(connection_str)
+    assert db_client.get_applied_migrations() == [ version for version, _, _ in db_client.schema_migrations ]
+    assert db_client.migrate() == []
+    assert db_client.execute_query("SELECT COUNT(*) FROM etf_holdings_table;") == [(2,)]
+    with pytest.raises(sqlite3.IntegrityError):
+        db_client.execute_query(
+            "INSERT INTO etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight) VALUES (?, ?, ?, ?);",
+            ("2022-01-03", 1, 2, 0.5)
+        )
+    plan = db_client.execute_query(
+        "EXPLAIN QUERY PLAN SELECT * FROM etf_holdings_table WHERE ETF_ticker_ID = ? AND Date = ?;", 
+        (1, "2022-01-03")
+    )
+    # no more full table scans
+    assert all("INDEX" in str(step) for step in plan)
+
+def test_sqlite3_connections_are_per_thread(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    assert db_client.execute_query("PRAGMA journal_mode;") == [("wal",)]
+    assert db_client.execute_query("PRAGMA synchronous;") == [(1,)]
+    # the connection (and its temporary tables) outlives the queries
+    db_client.execute_query("CREATE TEMP TABLE t (x integer);")
+    assert db_client.execute_query("SELECT COUNT(*) FROM t;") == [(0,)]
+    # other clients of the database share the thread's connection
+    assert SQLite3DatabaseClient(str(tmp_path / "etf.sqlite")).execute_query("SELECT COUNT(*) FROM t;") == [(0,)]
+    errors = []
+    def query_from_other_thread():
+        try:
+            db_client.execute_query("SELECT COUNT(*) FROM t;")
+        except sqlite3.OperationalError as no_such_table:
+            errors.append(no_such_table)
+    thread = threading.Thread(target=query_from_other_thread)
+    thread.start()
+    thread.join()
+    assert len(errors) == 1
+    db_client.close()
+    with pytest.raises(sqlite3.OperationalError):
+        db_client.execute_query("SELECT COUNT(*) FROM t;")
+
+def test_scrape_etfs_holdings_limits_concurrency_per_source(monkeypatch):
+    import src.scraping
+    running, max_running = {"ark": 0, "zack": 0}, {"ark": 0, "zack": 0}
+    lock = threading.Lock()
+
+    def scrape_etf_holdings(etf):
+        source = src.scraping.get_source(etf)
+        with lock:
+            running[source] += 1
+            max_running[source] = max(max_running[source], running[source])
+        time.sleep(0.05)
+        with lock:
+            running[source] -= 1
+        if etf == "BULL":
+            raise AssertionError("no data")
+        return {"A": {"weight": 1.0}}
+
+    monkeypatch.setattr(src.scraping, "scrape_etf_holdings", scrape_etf_holdings)
+    ark_etfs = [ etf for etf in src.scraping.ark_etf_tickers ][:4]
+    zack_etfs = ["ZACK1", "ZACK2", "ZACK3", "BULL"]
+    etfs_holdings, errors = src.scraping.scrape_etfs_holdings(ark_etfs + zack_etfs)
+    # downloads run concurrently, within the limits of each source
+    assert max_running["ark"] == src.scraping.MAX_CONCURRENT_DOWNLOADS_PER_SOURCE["ark"]
+    assert max_running["zack"] <= src.scraping.MAX_CONCURRENT_DOWNLOADS_PER_SOURCE["zack"]
+    assert sorted(etfs_holdings.keys()) == sorted(ark_etfs + ["ZACK1", "ZACK2", "ZACK3"])
+    assert list(errors.keys()) == ["BULL"]
+
+def test_get_holdings_and_weights_for_etfs_scrapes_missing_etfs_in_one_batch(tmp_path, monkeypatch):
+    import src.dbms.SQLDatabaseClient
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    db_client.insert_etf_holding_data("ETF1", {"A": {"weight": 1.0}})
+    scraped = []
+
+    def scrape_etfs_holdings(etfs):
+        etfs = list(etfs)
+        scraped.append(etfs)
+        return { etf: {"A": {"weight": 0.5}, etf: {"weight": 0.5}} for etf in etfs if etf != "ETF4" }, {"ETF4": AssertionError("no data")}
+
+    monkeypatch.setattr(src.dbms.SQLDatabaseClient, "scrape_etfs_holdings", scrape_etfs_holdings)
+    transactions = []
+    transaction = db_client.transaction
+    db_client.transaction = lambda: transactions.append(None) or transaction()
+    results, unavailable_etfs = db_client.get_holdings_and_weights_for_etfs(["etf1", "ETF2", "ETF3", "ETF4"])
+    assert scraped == [["ETF2", "ETF3", "ETF4"]]
+    assert len(transactions) == 1
+    assert results["etf1"] == {"A": {"weight": 1.0}}
+    assert results["ETF3"] == {"A": {"weight": 0.5}, "ETF3": {"weight": 0.5}}
+    assert unavailable_etfs == ["ETF4"]
+
+def test_insert_etfs_holding_data_isolates_failures(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    inserted = db_client.insert_etfs_holding_data({
+        "etf1": {"A": {"weight": 0.5}, "B": {"weight": 0.5}},
+        "etf2": {"C": {"weight": 1.0}, "D": dict()},
+        "etf3": dict(),
+    })
+    assert sorted(inserted.keys()) == ["ETF1"]
+    assert db_client.get_known_etfs() == ["ETF1"]
+    assert db_client.execute_query("SELECT COUNT(*) FROM etf_holdings_table;") == [(2,)]
+
+def test_copy_holdings_forward(tmp_path):
+    db_client = SQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    holdings = {"A": {"weight": 0.5}, "B": {"weight": 0.5}}
+    db_client.insert_etf_holding_data("ETF1", { holding: dict(metadata) for holding, metadata in holdings.items() })
+    yesterday = db_client.today - datetime.timedelta(days=1)
+    tables = ("etf_holdings_table", "etf_minhash_table", "etf_lsh_bucket_table")
+    for table in tables:
+        db_client.execute_query(f"UPDATE {table} SET Date = ?;", (yesterday,))
+    counts = [ db_client.execute_query(f"SELECT COUNT(*) FROM {table};")[0][0] for table in tables ]
+    with db_client.transaction() as cur:
+        db_client.insert_etf_ticker(cur, "ETF2")
+    # ETF2 has no earlier holdings to copy
+    assert db_client.copy_holdings_forward(["etf1", "ETF2"]) == ["ETF1"]
+    assert db_client.get_holdings_and_weights_for_etfs(["ETF1"]) == ({"ETF1": holdings}, [])
+    # copying again doesn't duplicate today's rows
+    assert db_client.copy_holdings_forward(["ETF1"]) == ["ETF1"]
+    for table, count in zip(tables, counts):
+        assert db_client.execute_query(f"SELECT COUNT(*) FROM {table} WHERE Date = ?;", (db_client.today,)) == [(count,)]
+
+class IntervalsSQLite3DatabaseClient(SQLite3DatabaseClient):
+    holdings_history = "intervals"
+    today = datetime.date(2022, 1, 3)
+
+def test_intervals_holdings_history(tmp_path):
+    db_client = IntervalsSQLite3DatabaseClient(str(tmp_path / "etf.sqlite"))
+    days = [ db_client.today + datetime.timedelta(days=i) for i in range(3) ]
+    history = [
+        {"ETF1": {"A": {"weight": 0.5}, "B": {"weight": 0.5}}, "ETF2": {"A": {"weight": 1.0}}},
+        {"ETF1": {"A": {"weight": 0.5}, "C": {"weight": 0.5}}, "ETF2": {"A": {"weight": 1.0}}},
+        {"ETF1": {"A": {"weight": 0.25}, "C": {"weight": 0.75}}},
+    ]
+    for day, etfs_data in zip(days, history):
+        db_client.today = day
+        db_client.insert_etfs_holding_data({ 
+            etf: { holding: dict(metadata) for holding, metadata in holdings.items() } for etf, holdings in etfs_data.items() 
+        })
+    # ETF2's file didn't change on the last day
+    assert db_client.copy_holdings_forward(["ETF2"]) == ["ETF2"]
+    history[2]["ETF2"] = history[1]["ETF2"]
+    for day, etfs_data in zip(days, history):
+        assert db_client.get_holdings_snapshot(day) == etfs_data
+        assert db_client.get_holdings_and_weights_for_etfs(["ETF1", "ETF2"], day) == (etfs_data, [])
+    assert db_client.get_holdings_snapshot(days[0] - datetime.timedelta(days=1)) == dict()
+    assert db_client.get_latest_holdings_date() == days[-1]
+    # A (twice) and B, C (twice) for ETF1, A for ETF2, instead of 2 + 2 + 2 + 1 + 1 + 1 rows
+    assert db_client.execute_query("SELECT COUNT(*) FROM etf_holding_intervals_table;") == [(6,)]
+    assert db_client.execute_query("SELECT COUNT(*) FROM etf_holdings_table;") == [(0,)]
+    # inserting the same ETF again on the same day replaces the intervals it opened
+    db_client.insert_etf_holding_data("ETF1", {"A": {"weight": 0.5}, "C": {"weight": 0.5}})
+    for day in days[1:]:
+        assert db_client.get_holdings_snapshot(day, ["ETF1"]) == { "ETF1": history[1]["ETF1"] }
+    assert db_client.execute_query("SELECT COUNT(*) FROM etf_holding_intervals_table;") == [(6,)]
+
+def test_compact_holdings_history(tmp_path):
+    connection_str = str(tmp_path / "etf.sqlite")
+    snapshots_client = SQLite3DatabaseClient(connection_str)
+    snapshots_client.insert_etf_holding_data("ETF1", {"A": {"weight": 0.5}, "B": {"weight": 0.5}})
+    days = [ snapshots_client.today - datetime.timedelta(days=i) for i in (2, 1) ]
+    for day in days:
+        snapshots_client.execute_query(
+            """INSERT INTO etf_holdings_table (Date, ETF_ticker_ID, Holding_ID, Holding_Weight) 
+            SELECT ?, ETF_ticker_ID, Holding_ID, Holding_Weight FROM etf_holdings_table WHERE Date = ?;""",
+            (day, snapshots_client.today)
+        )
+    # B left the ETF yesterday
+    snapshots_client.execute_query(
+        "DELETE FROM etf_holdings_table WHERE Date = ? AND Holding_ID = ?;", 
+        (days[1], snapshots_client.get_holding_id_for_ticker("B"))
+    )
+    expected = { day: snapshots_client.get_holdings_snapshot(day) for day in (*days, snapshots_client.today) }
+    # the database keeps the mode its holdings were written in until it's compacted
+    intervals_client = IntervalsSQLite3DatabaseClient(connection_str)
+    assert intervals_client.holdings_history == "snapshots"
+    intervals_client.today = snapshots_client.today
+    # A throughout, B for the first day, then B again today
+    assert intervals_client.compact_holdings_history() == 3
+    assert intervals_client.compact_holdings_history() == 0
+    assert { day: intervals_client.get_holdings_snapshot(day) for day in expected.keys() } == expected
+    assert intervals_client.execute_query("SELECT COUNT(*) FROM etf_holdings_table;") == [(0,)]
+    # clients of the default 'snapshots' class read the intervals instead of an empty `etf_holdings_table`
+    snapshots_client = SQLite3DatabaseClient(connection_str)
+    assert snapshots_client.holdings_history == "intervals"
+    assert snapshots_client.get_holdings_snapshot(days[0]) == expected[days[0]]
+    assert snapshots_client.get_latest_holdings_date() == snapshots_client.today
+
+class DatedSQLite3DatabaseClient(SQLite3DatabaseClient):
+    today = datetime.date(2022, 1, 3)
+
+@pytest.mark.parametrize("client_class", [DatedSQLite3DatabaseClient, IntervalsSQLite3DatabaseClient])
+def test_get_holdings_history(tmp_path, client_class):
+    db_client = client_class(str(tmp_path / "etf.sqlite"))
+    days = [ db_client.today + datetime.timedelta(days=i) for i in range(4) ]
+    history = [
+        {"A": {"weight": 0.5}, "B": {"weight": 0.5}},
+        {"A": {"weight": 0.5}, "C": {"weight": 0.5}},
+        None,
+        {"A": {"weight": 0.25}, "C": {"weight": 0.75}},
+    ]
+    for day, holdings in zip(days, history):
+        db_client.today = day
+        # no data for ETF1 on the third day
+        if holdings is not None:
+            db_client.insert_etf_holding_data("ETF1", { holding: dict(metadata) for holding, metadata in holdings.items() })
+        db_client.insert_etf_holding_data("ETF2", {"A": {"weight": 1.0}})
+    queries = []
+    execute_query = db_client.execute_query
+    db_client.execute_query = lambda query, *args: queries.append(query) or execute_query(query, *args)
+    etf_history = db_client.get_holdings_history("etf1", days[1])
+    # the ID lookup and the holdings
+    assert len(queries) == 2
+    assert etf_history.etf == "ETF1" and etf_history.dates == [days[1], days[3]] and etf_history.holdings == ["A", "C"]
+    assert etf_history.weights.tolist() == [[0.5, 0.5], [0.25, 0.75]]
+    assert db_client.get_holdings_history("ETF1", days[0], days[0]).snapshot(days[0]) == history[0]
+    with pytest.raises(ValueError):
+        db_client.get_holdings_history("ETF3", days[0])
+
+@pytest.mark.parametrize("client_class", [DatedSQLite3DatabaseClient, IntervalsSQLite3DatabaseClient])
+def test_export_and_import_holdings(tmp_path, client_class):
+    pq = pytest.importorskip("pyarrow.parquet")
+    db_client = client_class(str(tmp_path / "etf.sqlite"))
+    days = [ db_client.today + datetime.timedelta(days=i) for i in range(3) ]
+    for i, day in enumerate(days):
+        db_client.today = day
+        db_client.insert_etfs_holding_data({
+            "ETF1": {"A": {"weight": 0.5}, f"B{i}": {"weight": 0.5}},
+            "ETF2": {"A": {"weight": 1.0}},
+        })
+    directory = str(tmp_path / "export")
+    assert db_client.export_holdings(directory, start=days[1]) == 2 * 3
+    assert sorted(os.listdir(directory)) == [ f"Date={day}" for day in days[1:] ]
+    table = pq.read_table(os.path.join(directory, f"Date={days[1]}"), columns=["Holding"])
+    assert sorted(table.column("Holding").to_pylist()) == ["A", "A", "B1"]
+    # a fresh database gets the same holdings (and signatures)
+    fresh_client = client_class(str(tmp_path / "fresh.sqlite"))
+    fresh_client.today = days[-1]
+    assert fresh_client.import_holdings(directory) == 2 * 3
+    for day in days[1:]:
+        assert fresh_client.get_holdings_snapshot(day) == db_client.get_holdings_snapshot(day)
+    assert fresh_client.find_similar_etfs("ETF1", threshold=0.0, date_=days[1]) == db_client.find_similar_etfs("ETF1", threshold=0.0, date_=days[1])
+
+class DatedTinyDBDatabaseClient(TinyDBDatabaseClient):
+    today = "2022-01-04"
+
+@pytest.mark.parametrize("client_class", [DatedSQLite3DatabaseClient, DatedTinyDBDatabaseClient])
+def test_etf_index_is_built_from_stored_data(tmp_path, client_class, monkeypatch):
+    db_client = client_class(str(tmp_path / "etf.db"))
+    today = str(db_client.today)
+    yesterday = str(datetime.date.fromisoformat(today) - datetime.timedelta(days=1))
+    holdings = {
+        yesterday: {"ETF1": {"A": {"weight": 1.0}}, "ETF2": {"B": {"weight": 1.0}}},
+        today: {"ETF1": {"C": {"weight": 1.0}}},
+    }
+    if isinstance(db_client, TinyDBDatabaseClient):
+        db_client.store.insert_multiple([
+            {"name": etf, "date": date_, "holdings": etf_holdings}
+            for date_, etfs_data in holdings.items() for etf, etf_holdings in etfs_data.items()
+        ])
+    else:
+        for date_, etfs_data in holdings.items():
+            db_client.today = datetime.date.fromisoformat(date_)
+            db_client.insert_etfs_holding_data({ etf: dict(etf_holdings) for etf, etf_holdings in etfs_data.items() })
+    # ETF2 has no holdings today, which must not get it scraped
+    def scrape(*args, **kwargs):
+        raise AssertionError("scraped while building the index")
+    monkeypatch.setattr(db_client, "get_holdings_and_weights_for_etfs", scrape)
+    monkeypatch.setattr(db_client, "get_holdings_and_weights_for_etf", scrape)
+    index = ETFIndex.from_database(db_client)
+    assert sorted(index.etfs) == ["ETF1", "ETF2"]
+    assert find_k_nearest(index, {"query": {"C": {"weight": 1.0}}}, k=1) == [("ETF1", 1.0)]
+    assert ETFIndex.from_database(db_client, yesterday).holdings_matrix.to_dict() == {"ETF1": [1.0, 0.0], "ETF2": [0.0, 1.0]}
+
+def test_tinydb_reads_go_through_the_index(tmp_path):
+    db_client = TinyDBDatabaseClient(str(tmp_path / "etf_tinydb.json"))
+    db_client.store.insert_multiple([
+        {"name": f"ETF{i}", "date": date_, "holdings": {"A": {"weight": 1.0}, f"B{i}": {"weight": 0.5}}}
+        for i in range(50) for date_ in ("2022-01-03", "2022-01-04")
+    ])
+    # lookups never scan the documents
+    db_client.db.search = db_client.db.all = db_client.db.contains = None
+    results, unavailable_etfs = db_client.get_holdings_and_weights_for_etfs(["ETF1", "ETF2", "ETF50"], "2022-01-04")
+    assert results == { f"ETF{i}": {"A": {"weight": 1.0}, f"B{i}": {"weight": 0.5}} for i in (1, 2) }
+    assert unavailable_etfs == ["ETF50"]
+    assert len(db_client.get_known_etfs()) == 50
+    assert db_client.get_holdings_history("ETF1", "2022-01-01").dates == ["2022-01-03", "2022-01-04"]
+
+def test_indexed_tinydb_writes_are_shared_between_processes(tmp_path):
+    db_path = str(tmp_path / "etf_tinydb.json")
+    # e.g. the Streamlit app and `prefetch.py`
+    store, other_store = IndexedTinyDB(db_path), IndexedTinyDB(db_path)
+    store.insert_multiple([{"name": "ETF1", "date": "2022-01-03", "holdings": {"A": {"weight": 1.0}}}])
+    # every batch is written right away
+    assert IndexedTinyDB(db_path).names() == ["ETF1"]
+    other_store.insert_multiple([{"name": "ETF2", "date": "2022-01-03", "holdings": {"A": {"weight": 1.0}}}])
+    # records of the same (name, date) are replaced
+    store.insert_multiple([{"name": "ETF1", "date": "2022-01-03", "holdings": {"B": {"weight": 1.0}}}])
+    for reader in (store, other_store, IndexedTinyDB(db_path)):
+        assert reader.snapshot("2022-01-03") == {"ETF1": {"B": {"weight": 1.0}}, "ETF2": {"A": {"weight": 1.0}}}
+    # the file stays readable by TinyDB's default storage
+    assert len(TinyDB(db_path).all()) == 2
@@ -0,0 +1,66 @@
+# test_holdings.py
+
+# standard library dependencies
+
+# external dependencies
+import pytest
+import numpy as np
+
+# local dependencies
+from src.holdings import HoldingsMatrix, HoldingsHistory
+
+from_query_output_tests = [
+    (
+        {'etf1': {'A': {'weight': 0.2}, 'B': {'weight': 0.3}}, 'etf2': {'C': {'weight': 1.0}}},
+        None,
+        {"etf1": [0.2, 0.3, 0.0], "etf2": [0.0, 0.0, 1.0]}
+    ),
+    (
+        {'etf1': {'A': {'weight': 0.2}, 'B': {'weight': 0.3}}, 'etf2': {'C': {'weight': 1.0}}},
+        ['C', 'A'],
+        {"etf1": [0.0, 0.2], "etf2": [1.0, 0.0]}
+    ),
+    (
+        {'etf1': {}, 'etf2': {'C': {'weight': 0.9}}},
+        None,
+        {"etf1": [0.0], "etf2": [0.9]}
+    ),
+]
+@pytest.mark.parametrize("case,holdings,answer", from_query_output_tests)
+def test_from_query_output(case, holdings, answer):
+    assert HoldingsMatrix.from_query_output(case, holdings=holdings).to_dict() == answer
+
+def test_to_dataframe():
+    matrix = HoldingsMatrix.from_query_output(
+        {'etf1': {'A': {'weight': 0.2}, 'B': {'weight': 0.3}}, 'etf2': {'C': {'weight': 1.0}}}
+    )
+    df = matrix.to_dataframe()
+    assert list(df.index) == ['A', 'B', 'C']
+    assert list(df.columns) == ['etf1', 'etf2']
+    assert np.array_equal(df.values, [[0.2, 0.0], [0.3, 0.0], [0.0, 1.0]])
+
+def test_memory_footprint():
+    rng = np.random.default_rng(0)
+    universe = [ f"HOLDING{i}" for i in range(20_000) ]
+    query_output = {
+        f"ETF{e}": {
+            universe[h]: {'weight': 1.0} 
+            for h in rng.choice(len(universe), size=500, replace=False)
+        }
+        for e in range(500)
+    }
+    matrix = HoldingsMatrix.from_query_output(query_output, holdings=universe)
+    assert matrix.shape == (20_000, 500)
+    assert matrix.nbytes < 5 * 2**20
+
+def test_holdings_history():
+    records = [ (day, holding, 0.1 * day) for day in (3, 1, 2) for holding in ('B', 'A')[:day] ]
+    history = HoldingsHistory.from_records('etf1', records)
+    assert history.shape == (3, 2) and history.dates == [1, 2, 3] and history.holdings == ['A', 'B']
+    assert history.snapshot(1) == {'B': {'weight': 0.1}}
+    assert 2 in history and 4 not in history
+    reindexed = history.reindex([3, 1], ['C', 'A'])
+    assert np.allclose(reindexed.weights, [[0.0, 0.3], [0.0, 0.0]])
+    df = history.to_dataframe()
+    assert list(df.index) == [1, 2, 3] and list(df.columns) == ['A', 'B']
+    assert len(HoldingsHistory.from_records('etf2', [])) == 0
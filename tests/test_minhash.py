@@ -0,0 +1,68 @@
+# test_minhash.py
+
+# standard library dependencies
+
+# external dependencies
+import pytest
+import numpy as np
+
+# local dependencies
+from src.minhash import (
+    MinHasher,
+    WeightedMinHasher,
+    LSHIndex,
+    estimate_similarity,
+    signature_to_bytes,
+    signature_from_bytes,
+    weighted_samples
+)
+from src.utils import weighted_jaccard_distance
+
+jaccard_tests = [
+    (range(0, 100), range(0, 100)),
+    (range(0, 100), range(50, 150)),
+    (range(0, 100), range(90, 190)),
+    (range(0, 100), range(100, 200)),
+]
+@pytest.mark.parametrize("case1,case2", jaccard_tests)
+def test_minhash_estimates_jaccard(case1, case2):
+    set1, set2 = { f"T{i}" for i in case1 }, { f"T{i}" for i in case2 }
+    minhasher = MinHasher(num_perm=512)
+    estimate = estimate_similarity(minhasher.signature(set1), minhasher.signature(set2))
+    assert estimate == pytest.approx(len(set1 & set2) / len(set1 | set2), abs=0.1)
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_weighted_minhash_estimates_weighted_jaccard(seed):
+    rng = np.random.default_rng(seed)
+    holdings = [ f"T{i}" for i in range(200) ]
+    weights1 = { holding: rng.random() for holding in holdings[:150] }
+    weights2 = { holding: rng.random() for holding in holdings[50:] }
+    expected = 1.0 - weighted_jaccard_distance(
+        [ weights1.get(holding, 0.0) for holding in holdings ],
+        [ weights2.get(holding, 0.0) for holding in holdings ]
+    )
+    minhasher = WeightedMinHasher(num_perm=512)
+    estimate = estimate_similarity(minhasher.signature(weights1), minhasher.signature(weights2))
+    assert estimate == pytest.approx(expected, abs=0.1)
+
+def test_signature_serialization():
+    signature = MinHasher().signature(["A", "B"])
+    assert np.array_equal(signature_from_bytes(signature_to_bytes(signature)), signature)
+
+def test_lsh_index():
+    minhasher = MinHasher(num_perm=128)
+    index = LSHIndex(num_perm=128, threshold=0.8)
+    for i in range(50):
+        index.insert(f"etf{i}", minhasher.signature([ f"T{i}_{j}" for j in range(100) ]))
+    index.insert("near_duplicate", minhasher.signature([ f"T0_{j}" for j in range(98) ]))
+    assert index.query(minhasher.signature([ f"T0_{j}" for j in range(100) ])) == {"etf0", "near_duplicate"}
+
+def test_weighted_minhash_reuses_the_samples_of_each_holding():
+    minhasher = WeightedMinHasher(num_perm=64, seed=7)
+    weights = { f"T{i}": float(i + 1) for i in range(10) }
+    signature = minhasher.signature(weights)
+    hits = weighted_samples.cache_info().hits
+    # the samples of the holdings are cached, and don't depend on the other holdings
+    assert np.array_equal(WeightedMinHasher(num_perm=64, seed=7).signature(weights), signature)
+    assert weighted_samples.cache_info().hits == hits + len(weights)
+    assert not weighted_samples(7, 64, 0).flags.writeable
@@ -1,20 +1,36 @@
-# test_scraping.py 
-
 # standard library dependencies
+import socket
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # external dependencies
 import pytest
 
 # local dependencies
+from src.scraping import sessions
+from src.scraping import ark_scraper as ark
+from src.scraping.response_store import ResponseStore, NotModified
+from src.scraping.parsing import read_holdings, read_holdings_async
 from src.scraping.zack_scraper import fetch as zack_scraper
 from src.scraping.ark_scraper import fetch as ark_scraper
 from src.scraping.invesco_scraper import fetch as invesco_scraper
 from src.scraping.ishares_scraper import fetch as ishares_scraper
 
+def network_available(host: str = "www.zacks.com", port: int = 443) -> bool:
+    try:
+        socket.create_connection((host, port), timeout=3).close()
+    except OSError:
+        return False
+    return True
+
+# the cases that download holdings need access to the providers' websites
+network = pytest.mark.skipif(not network_available(), reason="no network access")
+
 zack_scraping_tests = [
     ("", False),
-    ("NONSENSE_ETF", False),
-    ("QQQ", True)
+    pytest.param("NONSENSE_ETF", False, marks=network),
+    pytest.param("QQQ", True, marks=network)
 ]
 @pytest.mark.parametrize("case,answer", zack_scraping_tests)
 def test_zack_scraper(case, answer):
@@ -23,11 +39,11 @@ def test_zack_scraper(case, answer):
 ark_scraping_tests = [
     ("", False),
     ("Nonsense", False),
-    ("ARKK", True),
-    ('ARKW', True),
-    ('ARKQ', True), 
-    ('ARKF', True),
-    ('ARKG', True)
+    pytest.param("ARKK", True, marks=network),
+    pytest.param('ARKW', True, marks=network),
+    pytest.param('ARKQ', True, marks=network), 
+    pytest.param('ARKF', True, marks=network),
+    pytest.param('ARKG', True, marks=network)
 ]
 @pytest.mark.parametrize("case,answer", ark_scraping_tests)
 def test_ark_scraper(case, answer):
@@ -38,8 +54,8 @@ def test_ark_scraper(case, answer):
         assert (len(ark_scraper(case)) > 0) == answer   
 
 invesco_scraping_tests = [
-    ("BKLN", True),
-    ("ADRE", True),
+    pytest.param("BKLN", True, marks=network),
+    pytest.param("ADRE", True, marks=network),
     ("", False),
     ("Nonsense", False)
 ]
@@ -52,8 +68,8 @@ def test_invesco_scraper(case, answer):
         assert (len(invesco_scraper(case)) > 0) == answer   
 
 ishares_scraping_tests = [
-    ('aaxj', True),
-    ('acwf', True),
+    pytest.param('aaxj', True, marks=network),
+    pytest.param('acwf', True, marks=network),
     ('', False),
     ('Nonsense', False)
 ]
@@ -64,3 +80,140 @@ def test_ishares_scraper(case, answer):
             ishares_scraper(case)
     else:
         assert (len(ishares_scraper(case)) > 0) == answer   
+
+ARK_CSV = b"""date,fund,company,ticker,cusip,shares,market value ($),weight (%)
+01/03/2022,ARKK,TESLA INC,TSLA,88160R101,"1,000","$1,000.00",10.00%
+01/03/2022,ARKK,ROKU INC,ROKU,77543R102,"1,000","$1,000.00",5.50%
+"""
+# company names may span several lines within their quotes
+ARK_MULTILINE_CSV = ARK_CSV.replace(b"TESLA INC", b'"TESLA\nINC"').replace(b"ROKU INC", b'"ROKU\r\n""INC"""')
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    client_ports = []
+
+    def do_GET(self):
+        self.client_ports.append(self.client_address[1])
+        status, body = (200, ARK_CSV) if self.path.startswith(("/ok", "/etag")) else (503, b"")
+        if self.path.startswith("/multiline"):
+            status, body = 200, ARK_MULTILINE_CSV
+        if self.path.startswith("/etag") and self.headers.get("If-None-Match") == '"v1"':
+            status, body = 304, b""
+        self.send_response(status)
+        if self.path.startswith("/etag"):
+            self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    Handler.client_ports = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+ARK_HOLDINGS = {"TSLA": {"weight": 0.1}, "ROKU": {"weight": 0.055}}
+
+def test_get_reuses_connections(server):
+    for _ in range(3):
+        response = sessions.get(f"{server}/ok")
+        assert response.ok and response.content == ARK_CSV
+    with sessions.stream(f"{server}/ok") as response:
+        assert read_holdings(response, ark.holdings_aggregator()) == ARK_HOLDINGS
+    # all requests went through the same keep-alive connection
+    assert len(set(Handler.client_ports)) == 1
+
+def test_get_retries_failed_requests(server):
+    response = sessions.get(f"{server}/unavailable", attempts=3)
+    assert response.status_code == 503 and not response.ok
+    assert len(Handler.client_ports) == 3
+    with sessions.stream(f"{server}/unavailable") as response:
+        assert read_holdings(response, ark.holdings_aggregator()) == dict()
+
+def test_stream_parses_lines_across_chunks(server, monkeypatch):
+    monkeypatch.setattr(sessions, "CHUNK_SIZE", 7)
+    with sessions.stream(f"{server}/ok") as response:
+        assert read_holdings(response, ark.holdings_aggregator()) == ARK_HOLDINGS
+
+    async def read_async():
+        async with sessions.stream_async(f"{server}/ok") as response:
+            return await read_holdings_async(response, ark.holdings_aggregator())
+
+    assert asyncio.run(read_async()) == ARK_HOLDINGS
+
+def test_read_holdings_parses_quoted_fields_spanning_lines(server, monkeypatch):
+    monkeypatch.setattr(sessions, "CHUNK_SIZE", 7)
+    with sessions.stream(f"{server}/multiline") as response:
+        assert read_holdings(response, ark.holdings_aggregator()) == ARK_HOLDINGS
+
+    async def read_async():
+        async with sessions.stream_async(f"{server}/multiline") as response:
+            return await read_holdings_async(response, ark.holdings_aggregator())
+
+    assert asyncio.run(read_async()) == ARK_HOLDINGS
+
+def test_async_sessions(server):
+    async def get_all():
+        async with sessions.AsyncSessions() as async_sessions:
+            return await asyncio.gather(*[ async_sessions.get(f"{server}/ok") for _ in range(4) ])
+
+    responses = asyncio.run(get_all())
+    assert all( response.ok and response.content == ARK_CSV for response in responses )
+    assert len(Handler.client_ports) == 4
+
+def test_scrape_etf_holdings_many(monkeypatch):
+    import src.scraping
+    running, max_running = [0], [0]
+
+    async def fetch_async(etf, sessions=None):
+        assert isinstance(sessions, sessions_class)
+        running[0] += 1
+        max_running[0] = max(max_running[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return dict() if etf == "BULL" else {"A": {"weight": 1.0}}
+
+    sessions_class = sessions.AsyncSessions
+    monkeypatch.setitem(src.scraping.ASYNC_FETCHERS, "zack", fetch_async)
+    etfs = [ f"ZACK{i}" for i in range(10) ] + ["bull"]
+    etfs_holdings, errors = src.scraping.scrape_etf_holdings_many(etfs)
+    assert sorted(etfs_holdings.keys()) == sorted(etfs[:-1])
+    assert list(errors.keys()) == ["BULL"] and isinstance(errors["BULL"], AssertionError)
+    assert max_running[0] == src.scraping.MAX_CONCURRENT_DOWNLOADS_PER_SOURCE["zack"]
+
+def test_response_store_skips_unchanged_files(server, tmp_path):
+    store = ResponseStore(str(tmp_path))
+    for path in ("/etag", "/ok"):
+        url = f"{server}{path}"
+        with store.stream(url) as response:
+            assert read_holdings(response, ark.holdings_aggregator()) == ARK_HOLDINGS
+        # nothing is recorded until the holdings have been stored, e.g. if the process crashes before
+        assert store.get(url) is None and store.pending(url) is not None
+        with store.stream(url) as response:
+            assert read_holdings(response, ark.holdings_aggregator()) == ARK_HOLDINGS
+        assert store.commit(url) and not store.commit(url)
+        # answered with a 304 (ETag) or with the same content (no validators)
+        with pytest.raises(NotModified):
+            with store.stream(url) as response:
+                read_holdings(response, ark.holdings_aggregator())
+        # forgotten responses are fetched unconditionally
+        store.forget(url)
+        with store.stream(url) as response:
+            assert read_holdings(response, ark.holdings_aggregator()) == ARK_HOLDINGS
+        store.commit(url)
+    assert store.get(f"{server}/etag")["etag"] == '"v1"'
+
+    async def read_async():
+        async with sessions.AsyncSessions() as async_sessions:
+            async with store.stream_async(f"{server}/etag", sessions=async_sessions) as response:
+                return await read_holdings_async(response, ark.holdings_aggregator())
+
+    with pytest.raises(NotModified):
+        asyncio.run(read_async())
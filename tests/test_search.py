@@ -0,0 +1,43 @@
+# test_search.py
+
+# standard library dependencies
+
+# external dependencies
+import pytest
+
+# local dependencies
+from src.search import ETFIndex, find_k_nearest, find_k_farthest
+from src.utils import get_similarity
+
+universe = {
+    "etf1": {"tickerA": {"weight": 0.5}, "tickerB": {"weight": 0.5}},
+    "etf2": {"tickerA": {"weight": 0.1}, "tickerD": {"weight": 0.3}, "tickerE": {"weight": 0.3}, "tickerF": {"weight": 0.3}},
+    "etf3": {"tickerG": {"weight": 1.0}},
+    "etf4": {"tickerA": {"weight": 0.4}, "tickerB": {"weight": 0.4}, "tickerG": {"weight": 0.2}},
+}
+
+@pytest.mark.parametrize("distance_measure", ["jaccard", "weighted_jaccard"])
+@pytest.mark.parametrize("query_etf", list(universe.keys()))
+def test_score_matches_get_similarity(query_etf, distance_measure):
+    index = ETFIndex.from_query_output(universe)
+    query_output = {"query": universe[query_etf]}
+    scores = index.score(query_output, distance_measure=distance_measure)
+    for etf, score in zip(index.etfs, scores):
+        expected = get_similarity({"query": universe[query_etf], etf: universe[etf]}, distance_measure=distance_measure)
+        assert score == pytest.approx(list(expected.values())[0])
+
+find_k_tests = [
+    ({"etf1": universe["etf1"]}, 2, [("etf4", 0.8/1.2), ("etf2", 0.1/1.9)], [("etf3", 0.0), ("etf2", 0.1/1.9)]),
+    ({"new": {"tickerG": {"weight": 1.0}}}, 1, [("etf3", 1.0)], [("etf1", 0.0)]),
+]
+@pytest.mark.parametrize("query_output,k,nearest,farthest", find_k_tests)
+def test_find_k(query_output, k, nearest, farthest):
+    index = ETFIndex.from_query_output(universe)
+    for result, answer in ((find_k_nearest(index, query_output, k=k), nearest), (find_k_farthest(index, query_output, k=k), farthest)):
+        assert [ etf for etf, similarity in result ] == [ etf for etf, similarity in answer ]
+        assert [ similarity for etf, similarity in result ] == pytest.approx([ similarity for etf, similarity in answer ])
+
+def test_unsupported_distance_measure():
+    index = ETFIndex.from_query_output(universe)
+    with pytest.raises(AssertionError):
+        find_k_nearest(index, {"etf1": universe["etf1"]}, distance_measure="asymmetric_coverage_overlap")
@@ -4,17 +4,28 @@
 
 # external dependencies
 import pytest 
+import numpy as np
+from scipy import sparse
+from scipy.spatial.distance import jaccard
 
 # local dependencies
 from src.utils import (
     get_boundaries,
     get_contiguous_truthy_segments,
+    get_run_boundaries,
+    get_truthy_runs,
+    get_truthy_runs_batched,
     get_etf_holding_weight_vectors,
     weighted_jaccard_distance,
     get_similarity,
+    get_similarity_matrices,
+    asymmetric_coverage_overlap,
     annotate_holdings,
-    reorder_holdings_by_popularity
+    reorder_holdings_by_popularity,
+    get_holdings_membership,
+    get_similarity_time_series
 )
+from src.holdings import HoldingsHistory
 
 get_boundaries_tests = [
     ([], [0, 0]),
@@ -50,6 +61,28 @@ get_contiguous_truthy_segments_tests = [
 def test_get_contiguous_truthy_segments(case, answer):
     assert get_contiguous_truthy_segments(case) == answer
 
+@pytest.mark.parametrize("case,answer", get_boundaries_tests)
+def test_get_run_boundaries(case, answer):
+    assert get_run_boundaries(np.array(case)).tolist() == answer
+
+@pytest.mark.parametrize("case,answer", get_contiguous_truthy_segments_tests)
+def test_get_truthy_runs(case, answer):
+    starts, stops = get_truthy_runs(np.array(case))
+    assert list(zip(starts.tolist(), stops.tolist())) == answer
+
+def test_get_truthy_runs_batched():
+    rng = np.random.default_rng(0)
+    mask = rng.random((10, 500)) < 0.3
+    mask[3] = False
+    mask[4] = True
+    rows, starts, stops = get_truthy_runs_batched(sparse.csr_matrix(mask))
+    for i, row in enumerate(mask):
+        expected = get_contiguous_truthy_segments(row)
+        assert list(zip(starts[rows == i].tolist(), stops[rows == i].tolist())) == expected
+    assert (rows[1:] >= rows[:-1]).all()
+    rows, starts, stops = get_truthy_runs_batched(np.zeros((0, 3)))
+    assert len(rows) == len(starts) == len(stops) == 0
+
 get_etf_holding_weight_vectors_tests = [
     (
         {'etf1': {'A': {'weight': 0.2}, 'B': {'weight': 0.3}}, 'etf2': {'C': {'weight': 1.0}}}, 
@@ -127,6 +160,27 @@ def test_get_similarity(case, distance, answer):
     similarity = result[("etf1","etf2")]
     assert round(similarity, 2) == answer
 
+get_similarity_matrices_tests = [
+    [[1, 0], [0, 1], [0, 0]],
+    [[2, 2], [0, 1], [3, 0]],
+    [[.5, .1, 0], [.5, 0, 0], [0, .3, 1], [0, .3, 0], [0, .3, 0]],
+    [[1, 0, 1], [1, 0, 1], [0, 0, 1]],
+]
+@pytest.mark.parametrize("case", get_similarity_matrices_tests)
+@pytest.mark.parametrize("as_sparse", [False, True])
+def test_get_similarity_matrices(case, as_sparse):
+    weights = np.array(case, dtype=float)
+    matrices = get_similarity_matrices(
+        sparse.csr_matrix(weights) if as_sparse else weights
+    )
+    for i in range(weights.shape[1]):
+        for j in range(weights.shape[1]):
+            v1, v2 = weights[:, i].tolist(), weights[:, j].tolist()
+            assert np.isclose(matrices['jaccard'][i, j], 1.0 - jaccard(list(map(bool, v1)), list(map(bool, v2))))
+            assert np.isclose(matrices['weighted_jaccard'][i, j], 1.0 - weighted_jaccard_distance(v1, v2))
+            if sum(v1) > 0:
+                assert np.isclose(matrices['asymmetric_coverage_overlap'][i, j], 1.0 - asymmetric_coverage_overlap(v1, v2))
+
 annotate_holdings_tests = [
     (
         {"etf1": {"tickerA": {"weight": 0.5}, "tickerB": {"weight": 0.5}}, "etf2": {"tickerC": {"weight": 1.0}}},
@@ -145,6 +199,13 @@ annotate_holdings_tests = [
 def test_annotate_holdings(case, answer):
     assert annotate_holdings(case) == answer
 
+def test_get_holdings_membership():
+    holdings, membership = get_holdings_membership({"etf1": {}, "etf2": {}})
+    assert holdings == [] and membership.shape == (0, 2)
+    holdings, membership = get_holdings_membership(annotate_holdings_tests[1][0])
+    assert holdings == ['tickerA', 'tickerB', 'tickerC', 'tickerD']
+    assert membership.tolist() == [[True, False, True], [True, False, True], [False, True, False], [False, False, True]]
+
 
 reorder_holdings_by_popularity_tests = [
     (
@@ -163,3 +224,44 @@ reorder_holdings_by_popularity_tests = [
 @pytest.mark.parametrize("case,answer", reorder_holdings_by_popularity_tests)
 def test_reorder_holdings_by_popularity(case, answer):
     assert reorder_holdings_by_popularity(case) == answer
+
+def test_reorder_holdings_by_popularity_with_many_etfs():
+    rng = np.random.default_rng(0)
+    universe = [ f"ticker{i}" for i in range(200) ]
+    query_output = {
+        f"etf{i}": { universe[h]: {"weight": 1.0} for h in rng.choice(len(universe), size=40, replace=False) }
+        for i in range(25)
+    }
+    annotations = annotate_holdings(query_output)
+    assert all( len(annotation) == 25 for annotation in annotations.values() )
+    assert set(annotations.keys()) == { holding for holdings in query_output.values() for holding in holdings }
+    for i, (etf, holdings) in enumerate(query_output.items()):
+        assert { holding for holding, annotation in annotations.items() if annotation[i] == '1' } == set(holdings)
+    # same ordering as sorting the annotations' binary values
+    assert reorder_holdings_by_popularity(query_output) == sorted(
+        annotations.items(), key = lambda item: int(item[1], 2), reverse = True
+    )
+
+
+def test_get_similarity_time_series():
+    rng = np.random.default_rng(0)
+    universe = [ f"ticker{i}" for i in range(30) ]
+    histories = []
+    for etf in ("etf1", "etf2"):
+        records = [
+            (day, universe[h], float(rng.random()))
+            for day in range(10)
+            for h in rng.choice(len(universe), size=rng.integers(1, 10), replace=False)
+        ]
+        histories.append(HoldingsHistory.from_records(etf, records))
+    # etf2 has no data on the first day
+    histories[1] = histories[1].reindex(histories[1].dates[1:])
+    for distance_measure in ("jaccard", "weighted_jaccard", "asymmetric_coverage_overlap", weighted_jaccard_distance, lambda v1, v2: 0.5):
+        time_series = get_similarity_time_series(*histories, distance_measure=distance_measure)
+        assert list(time_series.index) == list(range(1, 10))
+        for day, similarity in time_series.items():
+            expected = get_similarity(
+                { history.etf: history.snapshot(day) for history in histories }, 
+                distance_measure = distance_measure
+            )[("etf1", "etf2")]
+            assert similarity == pytest.approx(expected)